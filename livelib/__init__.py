@@ -1,5 +1,8 @@
-from .parser import Parser, ParserFromHTML, ParserForDB, ParserForCSV, BookDataFormatter, ParserForXLSX
-from .webconnection import WebConnection, SimpleWeb, WebWithCache
+from .parser import Parser, ParserFromHTML, ParserFromLXML, ParserForDB, ParserForCSV, BookDataFormatter, ParserForXLSX, \
+    BookRecord, get_html_parser
+from .webconnection import WebConnection, SimpleWeb, WebWithCache, AsyncWeb, AsyncWebWithCache, MemoWeb, RateLimiter, \
+    CircuitBreaker, RetryablePageError
+from .cachestorage import CacheStorage, FileTreeStorage, SQLiteStorage, PageCodec, CacheManager
 from .reader import Reader
 from .dbconnection import DBConnection,SQLite3Connection
 from .export import Export, XLSXExport
@@ -19,19 +22,31 @@ logging.basicConfig(filename='log.log', level=logging.DEBUG, filemode='a', forma
     Reader - основной класс
     Config - класс для загрузки конфигурации
     WebConnection - классы для соединения с веб
+        RateLimiter - ограничитель частоты запросов к сайту
+        CircuitBreaker - предохранитель, приостанавливающий запросы при капче и ошибках сайта
         SimpleWeb(WebConnection) - класс для соединения с веб напрямую
         WebWithCache(WebConnection) - класс для соединения с веб с кешированием данных
+        AsyncWeb(SimpleWeb) - класс для соединения с веб напрямую с параллельным запросом пачки страниц
+        AsyncWebWithCache(WebWithCache) - класс для соединения с веб с кешированием и параллельным запросом пачки страниц
+        MemoWeb(WebConnection) - обертка над соединением, запоминающая последние страницы в памяти
+    CacheStorage - классы хранилищ для кеша страниц
+        FileTreeStorage(CacheStorage) - каждая страница в отдельном файле в дереве папок
+        SQLiteStorage(CacheStorage) - все страницы в одном файле sqlite3
+    PageCodec - класс для сжатия страниц в кеше (zlib или zstd)
+    CacheManager - класс для ограничения размера кеша и времени жизни страниц в нем
     DBConnection - классы для соединения с базой данных
         SQLite3Connection(DBConnection) - класс для соединения с базой данных sqlite3
     Export - классы для экспорта
         XLSXExport(Export) - класс для экспорта данных в формате xlsx
     Parser - классы для парсинга данных
         ParserFromHTML(Parser) - класс для парсинга страниц сайта в формате html
+        ParserFromLXML(ParserFromHTML) - класс для быстрого парсинга страниц сайта напрямую через lxml
         ParserForDB(Parser) - класс для подготовки данных для сохранения в БД
         ParserForXLSX(Parser) - класс для подготовки данных для сохранения в XLSX
     DataFormatter - класс задания соответствий между свойствами свойств на сайте (парсинг HTML) 
                     и колонок в БД и XLSX
         BookDataFormatter(DataFormatter) - класс задания соответствий 
                                             между свойствами книг на сайте и колонок в БД и XLSX
+    BookRecord - запись о книге со слотами под свойства из BookDataFormatter, ведет себя как словарь
 
 """
\ No newline at end of file
@@ -0,0 +1,709 @@
+import argparse
+import atexit
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import typing
+import zlib
+from typing import List
+
+from .config import Config
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+"""
+Модуль хранилищ для кеша страниц сайта, которым пользуется WebWithCache.
+Страницы хранятся по ключу - нормализованному адресу страницы без адреса сайта и расширения,
+например '/reader/qwerty/read/~1' или '/reader/qwerty/index'.
+
+Страницы могут храниться сжатыми (zlib или zstd), способ сжатия определяется при чтении по первым байтам,
+поэтому сжатые и несжатые страницы могут лежать в одном хранилище.
+
+Классы:
+    PageCodec - сжатие и распаковка страниц
+    CacheStorage - абстрактное хранилище
+        FileTreeStorage(CacheStorage) - каждая страница в отдельном файле в дереве папок, повторяющем адрес страницы
+        SQLiteStorage(CacheStorage) - все страницы в одном файле sqlite3
+    CacheManager - ограничение размера кеша и времени жизни страниц в нем
+
+Перенос имеющегося кеша из дерева папок в файл sqlite3 (со сжатием страниц):
+    python -m livelib.cachestorage cache cache/pages.sqlite3 --compression zlib
+"""
+
+
+class PageCodec:
+    """
+    Сжимает страницы перед сохранением в хранилище и распаковывает их при чтении.
+    Способ сжатия сохраненной страницы определяется по ее первым байтам, а не по настройке,
+    так что старые несжатые страницы читаются и после включения сжатия.
+    Кодек считает объем страниц до и после сжатия, см. compression_ratio.
+    :param compression: 'none', 'zlib' или 'zstd'
+        defaults to 'none'
+    :type compression: str
+    :param encoding: кодировка текста страниц
+        defaults to 'utf-8'
+    :type encoding: str
+    :param level: уровень сжатия
+        defaults to 6 для zlib и 3 для zstd
+    :type level: int
+    """
+    compressions = ('none', 'zlib', 'zstd')
+    zstd_magic = b'\x28\xb5\x2f\xfd'
+
+    def __init__(self, compression: str = 'none', encoding: str = 'utf-8', level: int = None):
+        if compression not in self.compressions:
+            raise ValueError(f'Unknown cache compression {compression}, expected one of {self.compressions}')
+        if compression == 'zstd' and zstandard is None:
+            logging.warning('Package zstandard is not installed, using zlib for cache compression.')
+            compression = 'zlib'
+        self.compression = compression
+        self.encoding = encoding
+        self.lock = threading.Lock()
+        self.raw_size = 0     # объем записанных страниц до сжатия, байт
+        self.stored_size = 0  # объем записанных страниц после сжатия, байт
+        if compression == 'zlib':
+            self.level = level if level is not None else 6
+        elif compression == 'zstd':
+            self.level = level if level is not None else 3
+            self.zstd_compressor = zstandard.ZstdCompressor(level=self.level)
+        else:
+            self.level = None
+
+    @classmethod
+    def is_zlib(cls, data: bytes) -> bool:
+        # заголовок zlib: метод сжатия 8 в младших битах первого байта, первые два байта кратны 31
+        return len(data) > 1 and data[0] & 0x0f == 8 and (data[0] << 8 | data[1]) % 31 == 0
+
+    def encode(self, text: str) -> str or bytes:
+        """
+        Сжимает текст страницы. Без сжатия возвращает исходный текст.
+        :param text: текст страницы
+        :type text: str
+        :return: сжатая страница или исходный текст
+        :rtype: str or bytes
+        """
+        if self.compression == 'none':
+            return text
+        raw = text.encode(self.encoding)
+        if self.compression == 'zstd':
+            data = self.zstd_compressor.compress(raw)
+        else:
+            data = zlib.compress(raw, self.level)
+        with self.lock:
+            self.raw_size += len(raw)
+            self.stored_size += len(data)
+        return data
+
+    def decode(self, data: str or bytes) -> str:
+        """
+        Возвращает текст страницы, распаковывая ее, если она сжата zlib или zstd.
+        Переводы строк несжатых страниц приводятся к '\\n', как при чтении файла в текстовом режиме.
+        :param data: сохраненная страница
+        :type data: str or bytes
+        :rtype: str
+        """
+        if isinstance(data, str):
+            return data
+        if data.startswith(self.zstd_magic):
+            if zstandard is None:
+                raise RuntimeError('Page in cache is compressed with zstd, but package zstandard is not installed')
+            return zstandard.ZstdDecompressor().decompress(data).decode(self.encoding)
+        if self.is_zlib(data):
+            try:
+                return zlib.decompress(data).decode(self.encoding)
+            except zlib.error:
+                # несжатая страница, случайно начинающаяся с байтов, похожих на заголовок zlib
+                pass
+        return data.decode(self.encoding).replace('\r\n', '\n').replace('\r', '\n')
+
+    def decode_bytes(self, data: str or bytes) -> bytes:
+        """
+        Возвращает страницу в виде байтов в кодировке encoding, распаковывая ее, если она сжата zlib или zstd.
+        В отличие от decode несжатая страница не декодируется в строку, переводы строк в ней так же приводятся к '\\n'.
+        :param data: сохраненная страница
+        :type data: str or bytes
+        :rtype: bytes
+        """
+        if isinstance(data, str):
+            return data.encode(self.encoding)
+        if data.startswith(self.zstd_magic):
+            if zstandard is None:
+                raise RuntimeError('Page in cache is compressed with zstd, but package zstandard is not installed')
+            return zstandard.ZstdDecompressor().decompress(data)
+        if self.is_zlib(data):
+            try:
+                return zlib.decompress(data)
+            except zlib.error:
+                pass
+        if b'\r' in data:
+            data = data.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+        return data
+
+    def compression_ratio(self) -> float:
+        """
+        Возвращает степень сжатия страниц, записанных через кодек: объем до сжатия к объему после.
+        :return: степень сжатия, 1.0 если ничего не сжималось
+        :rtype: float
+        """
+        with self.lock:
+            return self.raw_size / self.stored_size if self.stored_size else 1.0
+
+
+class CacheStorage:
+    """
+    Абстрактный класс хранилища страниц кеша.
+    Кроме текста страницы хранилище держит ее валидаторы вида {'etag': ..., 'last_modified': ..., 'fetch_time': ...}.
+    """
+    codec: PageCodec = PageCodec()
+
+    def compression_ratio(self) -> float:
+        """
+        Возвращает степень сжатия страниц, записанных в хранилище с момента его открытия.
+        :rtype: float
+        """
+        return self.codec.compression_ratio()
+
+    def get(self, key: str) -> str or None:
+        """
+        Возвращает текст страницы из хранилища.
+        :param key: ключ страницы
+        :type key: str
+        :return: текст страницы или None, если ее нет в хранилище
+        :rtype: str or None
+        """
+        pass
+
+    def get_bytes(self, key: str) -> bytes or None:
+        """
+        Возвращает страницу из хранилища в виде байтов в кодировке кодека, без декодирования в строку.
+        Нужна для разбора страниц прямо из байтов.
+        :param key: ключ страницы
+        :type key: str
+        :return: страница или None, если ее нет в хранилище
+        :rtype: bytes or None
+        """
+        text = self.get(key)
+        return text.encode(self.codec.encoding) if text is not None else None
+
+    def put(self, key: str, text: str, validators: dict = None) -> None:
+        """
+        Сохраняет страницу в хранилище, заменяя старую версию, если она есть.
+        :param key: ключ страницы
+        :type key: str
+        :param text: текст страницы
+        :type text: str
+        :param validators: валидаторы страницы
+            defaults to None
+        :type validators: dict
+        """
+        pass
+
+    def get_validators(self, key: str) -> dict:
+        """
+        Возвращает валидаторы страницы либо пустой словарь.
+        :param key: ключ страницы
+        :type key: str
+        :rtype: dict
+        """
+        pass
+
+    def put_validators(self, key: str, validators: dict) -> None:
+        """
+        Сохраняет валидаторы страницы.
+        :param key: ключ страницы
+        :type key: str
+        :param validators: словарь вида {'etag': ..., 'last_modified': ..., 'fetch_time': ...}
+        :type validators: dict
+        """
+        pass
+
+    def contains(self, key: str) -> bool:
+        """
+        Проверяет, есть ли страница в хранилище.
+        :param key: ключ страницы
+        :type key: str
+        :rtype: bool
+        """
+        pass
+
+    def delete(self, key: str) -> None:
+        """
+        Удаляет страницу и ее валидаторы из хранилища.
+        :param key: ключ страницы
+        :type key: str
+        """
+        pass
+
+    def keys(self) -> List[str]:
+        """
+        Возвращает ключи всех страниц в хранилище.
+        :rtype: List[str]
+        """
+        pass
+
+    def get_entry(self, key: str) -> dict or None:
+        """
+        Возвращает сведения о странице в хранилище:
+        {'key': ..., 'size': размер в байтах, 'stored_time': время сохранения, 'access_time': время последнего чтения}
+        :param key: ключ страницы
+        :type key: str
+        :return: сведения о странице или None, если ее нет в хранилище
+        :rtype: dict or None
+        """
+        pass
+
+    def get_entries(self) -> List[dict]:
+        """
+        Возвращает сведения обо всех страницах в хранилище в том же виде, что и get_entry.
+        :rtype: List[dict]
+        """
+        pass
+
+    def flush(self) -> None:
+        """
+        Записывает накопленные изменения.
+        """
+        pass
+
+    def close(self) -> None:
+        """
+        Записывает накопленные изменения и освобождает ресурсы хранилища.
+        """
+        pass
+
+
+class FileTreeStorage(CacheStorage):
+    """
+    Хранилище, в котором каждая страница лежит в отдельном файле в дереве папок, повторяющем ее адрес.
+    Например, страница с ключом '/reader/qwerty/read/~1' лежит в файле <folder>/reader/qwerty/read/~1.html,
+    а ее валидаторы - рядом в файле ~1.html.meta.
+    :param folder: корневая папка кеша
+    :type folder: str
+    :param encoding: кодировка файлов
+        defaults to 'utf-8'
+    :type encoding: str
+    :param extension: расширение файлов страниц
+        defaults to '.html'
+    :type extension: str
+    :param codec: кодек для сжатия страниц
+        defaults to PageCodec без сжатия
+    :type codec: PageCodec
+    """
+    # расширение файлов с валидаторами страниц, лежащих рядом со страницами
+    meta_extension = '.meta'
+
+    def __init__(self, folder: str, encoding: str = 'utf-8', extension: str = '.html', codec: PageCodec = None):
+        self.folder = folder
+        self.encoding = encoding
+        self.extension = extension
+        self.codec = codec if codec else PageCodec(encoding=encoding)
+        self.logger = logging.getLogger()
+
+    def _get_filename(self, key: str) -> str:
+        return self.folder + key + self.extension
+
+    def _read(self, key: str) -> bytes or None:
+        filename = self._get_filename(key)
+        try:
+            with open(filename, mode='rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        # время чтения запоминаем в atime файла сами, так как atime часто не обновляется (noatime, relatime)
+        try:
+            os.utime(filename, (time.time(), os.stat(filename).st_mtime))
+        except OSError:
+            self.logger.debug(f'Can not update access time of {filename}')
+        return data
+
+    def get(self, key: str) -> str or None:
+        data = self._read(key)
+        return self.codec.decode(data) if data is not None else None
+
+    def get_bytes(self, key: str) -> bytes or None:
+        data = self._read(key)
+        return self.codec.decode_bytes(data) if data is not None else None
+
+    def put(self, key: str, text: str, validators: dict = None) -> None:
+        filename = self._get_filename(key)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        data = self.codec.encode(text)
+        if isinstance(data, bytes):
+            with open(filename, mode='wb') as f:
+                f.write(data)
+        else:
+            with open(filename, mode='w', encoding=self.encoding) as f:
+                f.write(data)
+        self.logger.debug(f'Create file {filename} ')
+        if validators:
+            self.put_validators(key, validators)
+
+    def get_validators(self, key: str) -> dict:
+        filename = self._get_filename(key) + self.meta_extension
+        try:
+            with open(filename, mode='r', encoding=self.encoding) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception:
+            self.logger.exception(f'Can not load validators from {filename} ', exc_info=True)
+            return {}
+
+    def put_validators(self, key: str, validators: dict) -> None:
+        filename = self._get_filename(key) + self.meta_extension
+        try:
+            with open(filename, mode='w', encoding=self.encoding) as f:
+                json.dump(validators, f)
+        except Exception:
+            self.logger.exception(f'Can not save validators to {filename} ', exc_info=True)
+
+    def contains(self, key: str) -> bool:
+        return os.path.isfile(self._get_filename(key))
+
+    def delete(self, key: str) -> None:
+        for filename in (self._get_filename(key), self._get_filename(key) + self.meta_extension):
+            if os.path.isfile(filename):
+                os.remove(filename)
+
+    def keys(self) -> List[str]:
+        result = []
+        for root, dirs, files in os.walk(self.folder):
+            for file_name in files:
+                if file_name.endswith(self.extension):
+                    path = os.path.join(root, file_name.removesuffix(self.extension))
+                    result.append('/' + os.path.relpath(path, self.folder).replace(os.sep, '/'))
+        return result
+
+    def get_entry(self, key: str) -> dict or None:
+        filename = self._get_filename(key)
+        try:
+            stat = os.stat(filename)
+        except FileNotFoundError:
+            return None
+        size = stat.st_size
+        if os.path.isfile(filename + self.meta_extension):
+            size += os.path.getsize(filename + self.meta_extension)
+        return {'key': key, 'size': size, 'stored_time': stat.st_mtime, 'access_time': stat.st_atime}
+
+    def get_entries(self) -> List[dict]:
+        result = []
+        for key in self.keys():
+            entry = self.get_entry(key)
+            if entry:
+                result.append(entry)
+        return result
+
+
+class SQLiteStorage(CacheStorage):
+    """
+    Хранилище, в котором все страницы лежат в одном файле sqlite3, в таблице Page с ключом - адресом страницы.
+    Хранилище держит одно открытое соединение с файлом (его можно использовать из нескольких потоков)
+    и записывает изменения пачками по batch_size штук в одной транзакции.
+    Оставшиеся изменения записываются при вызове flush или close и при завершении программы.
+    :param filename: путь к файлу sqlite3
+    :type filename: str
+    :param batch_size: сколько изменений накапливать перед записью
+        defaults to 50
+    :type batch_size: int
+    :param codec: кодек для сжатия страниц, сжатые страницы хранятся в поле text как BLOB
+        defaults to PageCodec без сжатия
+    :type codec: PageCodec
+    """
+    table: str = 'Page'
+    # колонки, добавленные в таблицу позже ее создания, с типами - для обновления старых файлов кеша
+    extra_columns: dict = {'size': 'INTEGER', 'stored_time': 'REAL', 'access_time': 'REAL'}
+
+    def __init__(self, filename: str, batch_size: int = 50, codec: PageCodec = None):
+        self.filename = filename
+        self.batch_size = batch_size
+        self.codec = codec if codec else PageCodec()
+        self.logger = logging.getLogger()
+        self.lock = threading.RLock()
+        self.pending = 0  # количество изменений, еще не записанных в файл
+        if os.path.dirname(filename):
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+        self.con = sqlite3.connect(filename, check_same_thread=False)
+        self.con.execute(f"CREATE TABLE IF NOT EXISTS {self.table} (key TEXT PRIMARY KEY, text TEXT, etag TEXT, "
+                         f"last_modified TEXT, fetch_time REAL, size INTEGER, stored_time REAL, access_time REAL)")
+        columns = [row[1] for row in self.con.execute(f"PRAGMA table_info({self.table})")]
+        for column, column_type in self.extra_columns.items():
+            if column not in columns:
+                self.con.execute(f"ALTER TABLE {self.table} ADD COLUMN {column} {column_type}")
+        self.con.commit()
+        atexit.register(self.close)
+
+    def _write(self, sql: str, params: typing.Iterable = ()) -> None:
+        with self.lock:
+            self.con.execute(sql, params)
+            self.pending += 1
+            if self.pending >= self.batch_size:
+                self.flush()
+
+    def _read(self, key: str) -> str or bytes or None:
+        with self.lock:
+            row = self.con.execute(f"SELECT text FROM {self.table} WHERE key=?", (key,)).fetchone()
+            if row:
+                self._write(f"UPDATE {self.table} SET access_time=? WHERE key=?", (time.time(), key))
+        return row[0] if row else None
+
+    def get(self, key: str) -> str or None:
+        data = self._read(key)
+        return self.codec.decode(data) if data is not None else None
+
+    def get_bytes(self, key: str) -> bytes or None:
+        data = self._read(key)
+        return self.codec.decode_bytes(data) if data is not None else None
+
+    def put(self, key: str, text: str, validators: dict = None) -> None:
+        validators = validators if validators else {}
+        data = self.codec.encode(text)
+        size = len(data) if isinstance(data, bytes) else len(data.encode('utf-8'))
+        now = time.time()
+        self._write(f"INSERT OR REPLACE INTO {self.table} "
+                    f"(key, text, etag, last_modified, fetch_time, size, stored_time, access_time) "
+                    f"VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (key, data, validators.get('etag'), validators.get('last_modified'), validators.get('fetch_time'),
+                     size, now, now))
+
+    def get_validators(self, key: str) -> dict:
+        with self.lock:
+            row = self.con.execute(f"SELECT etag, last_modified, fetch_time FROM {self.table} WHERE key=?",
+                                   (key,)).fetchone()
+        if not row:
+            return {}
+        return {name: value for name, value in zip(('etag', 'last_modified', 'fetch_time'), row) if value is not None}
+
+    def put_validators(self, key: str, validators: dict) -> None:
+        self._write(f"UPDATE {self.table} SET etag=?, last_modified=?, fetch_time=? WHERE key=?",
+                    (validators.get('etag'), validators.get('last_modified'), validators.get('fetch_time'), key))
+
+    def contains(self, key: str) -> bool:
+        with self.lock:
+            return self.con.execute(f"SELECT 1 FROM {self.table} WHERE key=?", (key,)).fetchone() is not None
+
+    def delete(self, key: str) -> None:
+        self._write(f"DELETE FROM {self.table} WHERE key=?", (key,))
+
+    def keys(self) -> List[str]:
+        with self.lock:
+            return [row[0] for row in self.con.execute(f"SELECT key FROM {self.table}")]
+
+    def _get_entries(self, where: str = '', params: typing.Iterable = ()) -> List[dict]:
+        # у страниц, сохраненных до появления колонок size и stored_time, размер и время считаются на месте
+        with self.lock:
+            rows = self.con.execute(f"SELECT key, coalesce(size, length(CAST(text AS BLOB))), "
+                                    f"coalesce(stored_time, fetch_time, 0), coalesce(access_time, stored_time, 0) "
+                                    f"FROM {self.table} {where}", params).fetchall()
+        return [{'key': row[0], 'size': row[1], 'stored_time': row[2], 'access_time': row[3]} for row in rows]
+
+    def get_entry(self, key: str) -> dict or None:
+        entries = self._get_entries('WHERE key=?', (key,))
+        return entries[0] if entries else None
+
+    def get_entries(self) -> List[dict]:
+        return self._get_entries()
+
+    def flush(self) -> None:
+        with self.lock:
+            if self.con is not None and self.pending:
+                self.con.commit()
+                self.logger.debug(f'Saved {self.pending} changes to cache {self.filename}')
+                self.pending = 0
+
+    def close(self) -> None:
+        with self.lock:
+            if self.con is not None:
+                self.flush()
+                self.con.close()
+                self.con = None
+        atexit.unregister(self.close)
+
+
+class CacheManager:
+    """
+    Следит за тем, чтобы кеш страниц не превышал заданный размер и не отдавал устаревшие страницы.
+    Время жизни страницы задается правилами вида {регулярное_выражение: дней}, которые проверяются по порядку
+    на ключе страницы, например {'/read/': 7, '/book/': 365}; если ни одно правило не подошло, действует default_ttl.
+    Если размер кеша превышает max_size, сначала удаляются устаревшие страницы, затем страницы,
+    которые дольше всех не читались, пока кеш не уменьшится до low_water доли от max_size.
+    :param storage: хранилище кеша
+    :type storage: CacheStorage
+    :param max_size: максимальный размер кеша в байтах, 0 - без ограничения
+        defaults to 0
+    :type max_size: int
+    :param ttl_rules: правила времени жизни страниц в днях, 0 - без ограничения
+        defaults to None
+    :type ttl_rules: dict
+    :param default_ttl: время жизни страниц в днях, не подошедших ни под одно правило, 0 - без ограничения
+        defaults to 0
+    :type default_ttl: float
+    :param check_every: через сколько сохраненных страниц проверять размер кеша
+        defaults to 100
+    :type check_every: int
+    :param low_water: до какой доли max_size уменьшать кеш при очистке
+        defaults to 0.9
+    :type low_water: float
+    """
+    day: int = 24 * 60 * 60
+
+    def __init__(self, storage: CacheStorage, max_size: int = 0, ttl_rules: dict = None, default_ttl: float = 0,
+                 check_every: int = 100, low_water: float = 0.9):
+        self.storage = storage
+        self.max_size = max_size
+        self.ttl_rules = [(re.compile(pattern), days) for pattern, days in (ttl_rules if ttl_rules else {}).items()]
+        self.default_ttl = default_ttl
+        self.check_every = check_every
+        self.low_water = low_water
+        self.puts = 0  # количество сохраненных страниц после последней проверки
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger()
+
+    @classmethod
+    def from_config(cls, config: Config, storage: CacheStorage) -> 'CacheManager':
+        """
+        Создает менеджер кеша с настройками из Config.web_connection.
+        :param config: конфигурация
+        :type config: Config
+        :param storage: хранилище кеша
+        :type storage: CacheStorage
+        :rtype: CacheManager
+        """
+        return cls(storage, max_size=int(config.web_connection.cache_max_size * 1024 * 1024),
+                   ttl_rules=config.web_connection.cache_ttl_rules, default_ttl=config.web_connection.cache_ttl)
+
+    @property
+    def has_ttl(self) -> bool:
+        return bool(self.default_ttl) or any(days for pattern, days in self.ttl_rules)
+
+    def get_ttl(self, key: str) -> float:
+        """
+        Возвращает время жизни страницы в секундах, 0 - без ограничения.
+        :param key: ключ страницы
+        :type key: str
+        :rtype: float
+        """
+        for pattern, days in self.ttl_rules:
+            if pattern.search(key):
+                return days * self.day
+        return self.default_ttl * self.day
+
+    def is_expired(self, key: str, entry: dict = None) -> bool:
+        """
+        Проверяет, истекло ли время жизни страницы в кеше.
+        :param key: ключ страницы
+        :type key: str
+        :param entry: сведения о странице из CacheStorage.get_entry, если они уже получены
+            defaults to None
+        :type entry: dict
+        :rtype: bool
+        """
+        ttl = self.get_ttl(key)
+        if not ttl:
+            return False
+        entry = entry if entry else self.storage.get_entry(key)
+        return bool(entry) and time.time() - entry['stored_time'] > ttl
+
+    def page_saved(self) -> None:
+        """
+        Отмечает сохранение страницы в кеше и раз в check_every страниц запускает очистку кеша.
+        """
+        if not self.max_size:
+            return
+        with self.lock:
+            self.puts += 1
+            if self.puts < self.check_every:
+                return
+            self.puts = 0
+        self.evict()
+
+    def evict(self) -> int:
+        """
+        Удаляет из кеша устаревшие страницы, а если кеш больше max_size - страницы, которые дольше всех не читались.
+        :return: количество удаленных страниц
+        :rtype: int
+        """
+        if not self.max_size and not self.has_ttl:
+            return 0
+        entries = self.storage.get_entries()
+        result = 0
+        alive = []
+        for entry in entries:
+            if self.is_expired(entry['key'], entry):
+                self.storage.delete(entry['key'])
+                result += 1
+            else:
+                alive.append(entry)
+        total = sum(entry['size'] for entry in alive)
+        if self.max_size and total > self.max_size:
+            alive.sort(key=lambda entry: entry['access_time'])
+            for entry in alive:
+                if total <= self.max_size * self.low_water:
+                    break
+                self.storage.delete(entry['key'])
+                total -= entry['size']
+                result += 1
+        self.storage.flush()
+        if result:
+            self.logger.info(f'Evicted {result} pages from cache, {total} bytes left.')
+        return result
+
+
+def create_cache_storage(config: Config) -> CacheStorage:
+    """
+    Создает хранилище кеша страниц по настройкам из Config.web_connection.
+    :param config: конфигурация
+    :type config: Config
+    :rtype: CacheStorage
+    """
+    codec = PageCodec(config.web_connection.cache_compression, encoding=config.encoding)
+    if config.web_connection.cache_storage == 'sqlite':
+        filename = config.web_connection.cache_db
+        if not filename:
+            filename = os.path.join(config.web_connection.cache_folder, 'pages.sqlite3')
+        return SQLiteStorage(filename, codec=codec)
+    else:
+        return FileTreeStorage(config.web_connection.cache_folder, encoding=config.encoding, codec=codec)
+
+
+def migrate_file_tree(source: FileTreeStorage, target: CacheStorage) -> int:
+    """
+    Переносит все страницы вместе с валидаторами из дерева папок в другое хранилище.
+    Страницы, уже имеющиеся в целевом хранилище, заменяются.
+    :param source: хранилище с деревом папок
+    :type source: FileTreeStorage
+    :param target: целевое хранилище
+    :type target: CacheStorage
+    :return: количество перенесенных страниц
+    :rtype: int
+    """
+    result = 0
+    for key in source.keys():
+        text = source.get(key)
+        if text is None:
+            continue
+        target.put(key, text, source.get_validators(key))
+        result += 1
+    target.flush()
+    logging.info(f'Migrated {result} pages from {source.folder} to cache storage.')
+    return result
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Перенос кеша страниц из дерева папок в один файл sqlite3.')
+    arg_parser.add_argument('folder', help='папка с кешем страниц, например cache')
+    arg_parser.add_argument('db', help='файл sqlite3 для нового кеша, например cache/pages.sqlite3')
+    arg_parser.add_argument('--encoding', default='utf-8', help='кодировка файлов кеша')
+    arg_parser.add_argument('--compression', default='none', choices=PageCodec.compressions,
+                            help='сжатие страниц в новом кеше')
+    args = arg_parser.parse_args()
+    storage = SQLiteStorage(args.db, codec=PageCodec(args.compression, encoding=args.encoding))
+    print('Перенесено страниц:', migrate_file_tree(FileTreeStorage(args.folder, encoding=args.encoding), storage))
+    print(f'Степень сжатия: {storage.compression_ratio():.1f}')
+    storage.close()
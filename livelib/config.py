@@ -1,5 +1,5 @@
 import os.path
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from environs import Env
 
 """
@@ -11,9 +11,59 @@ from environs import Env
     
     CACHE_FOLDER = cache
     
+    # необязательные настройки кеша: forever - страницы из кеша не проверяются,
+    # revalidate - страницы проверяются на сайте условным запросом (ETag / Last-Modified)
+    CACHE_MODE = forever
+    CACHE_REVALIDATE_AFTER = 0
+    # files - каждая страница в отдельном файле в папке CACHE_FOLDER, sqlite - все страницы в одном файле CACHE_DB
+    CACHE_STORAGE = files
+    CACHE_DB = cache/pages.sqlite3
+    # none, zlib или zstd (нужен пакет zstandard) - сжатие страниц в кеше
+    CACHE_COMPRESSION = none
+    # ограничения кеша: размер в мегабайтах и время жизни страниц в днях, 0 - без ограничения,
+    # CACHE_TTL_RULES - время жизни страниц, ключ которых подходит под регулярное выражение
+    CACHE_MAX_SIZE = 0
+    CACHE_TTL = 0
+    CACHE_TTL_RULES = /read/=7,/book/=365
+    
+    # необязательные настройки пула http-соединений
+    WEB_POOL_SIZE = 10
+    WEB_KEEP_ALIVE = True
+    WEB_CONNECT_TIMEOUT = 10
+    WEB_READ_TIMEOUT = 60
+    WEB_CONCURRENCY = 4
+    
+    # необязательные настройки ограничения частоты запросов к сайту
+    RATE_PER_MINUTE = 6
+    RATE_BURST = 2
+    RATE_MIN_PER_MINUTE = 0.5
+    RATE_SLOW_LATENCY = 10
+    
+    # необязательные настройки паузы при капче и ошибках сайта
+    BREAKER_BASE_DELAY = 60
+    BREAKER_MAX_DELAY = 1800
+    BREAKER_MAX_RETRIES = 3
+    
     BS_FEATURES = lxml
+    # необязательная настройка: bs4 - страницы разбираются BeautifulSoup (ParserFromHTML),
+    # lxml - напрямую lxml.html (ParserFromLXML), что быстрее
+    HTML_PARSER = bs4
+    # необязательная настройка: строить дерево BeautifulSoup только для списка книг и паджинатора
+    HTML_TARGETED_PARSE = False
+    # необязательная настройка: количество процессов для параллельного разбора страниц (livelib.parsepool),
+    # 0 - по количеству ядер
+    HTML_PARSE_WORKERS = 0
     
     SQLITE_DB = db/main.db
+    # необязательная настройка: сколько подготовленных запросов держит в кеше каждое соединение с БД
+    SQLITE_CACHED_STATEMENTS = 256
+    # необязательные настройки производительности БД: набор PRAGMA, выполняемых при открытии соединения,
+    # none (по умолчанию) - настройки sqlite3 по умолчанию, crawler - для хоста, который скачивает книги,
+    # export - для реплики, с которой только делается экспорт (см. SQLite3Connection.profiles);
+    # crawler переводит файл БД в режим журнала WAL насовсем, рядом с ним появляются файлы -wal и -shm;
+    # SQLITE_PRAGMAS заменяет отдельные значения профиля
+    SQLITE_PROFILE = crawler
+    SQLITE_PRAGMAS = synchronous=FULL,cache_size=-16000
     
     XLSX_FOLDER = export/xlsx
 """
@@ -25,6 +75,26 @@ class WebConnectionConfig:
     """
     site: str         # Адрес сайта по умолчанию (формата http://www.livelib.ru )
     cache_folder: str # папка для хранения кешированных страниц
+    cache_mode: str = 'forever'          # 'forever' или 'revalidate' - проверять ли страницы из кеша на сайте
+    cache_revalidate_after: float = 0    # сколько секунд после получения страница считается свежей без проверки
+    cache_storage: str = 'files'         # 'files' или 'sqlite' - хранилище кеша страниц
+    cache_db: str = ''                   # файл sqlite3 для хранилища 'sqlite', по умолчанию pages.sqlite3 в папке кеша
+    cache_compression: str = 'none'      # 'none', 'zlib' или 'zstd' - сжатие страниц в кеше
+    cache_max_size: float = 0            # максимальный размер кеша в мегабайтах, 0 - без ограничения
+    cache_ttl: float = 0                 # время жизни страниц в кеше в днях, 0 - без ограничения
+    cache_ttl_rules: dict = field(default_factory=dict)  # {регулярное выражение для адреса: время жизни в днях}
+    pool_size: int = 10           # количество соединений, которые держит пул сессии для одного хоста
+    keep_alive: bool = True       # держать ли соединения с сайтом открытыми между запросами
+    connect_timeout: float = 10   # таймаут на установку соединения, в секундах
+    read_timeout: float = 60      # таймаут на получение ответа, в секундах
+    concurrency: int = 4          # сколько страниц одного хоста асинхронные соединения запрашивают одновременно
+    requests_per_minute: float = 6       # максимальное количество запросов к одному хосту в минуту
+    burst: int = 2                       # сколько запросов можно сделать подряд без ожидания
+    min_requests_per_minute: float = 0.5 # ниже этой частоты ограничитель не опускается при ошибках
+    slow_latency: float = 10             # ответ дольше этого количества секунд считается признаком перегрузки сайта
+    breaker_base_delay: float = 60       # пауза в секундах после первой капчи или ошибки сайта, далее удваивается
+    breaker_max_delay: float = 1800      # максимальная пауза в секундах
+    breaker_max_retries: int = 3         # сколько раз повторно запрашивать страницу после капчи или ошибки сайта
 
 @dataclass
 class BSParserConfig:
@@ -32,6 +102,9 @@ class BSParserConfig:
     Класс для хранения конфигурации парсера BeautifulSoup.
     """
     features: str # Способ парсинга BeautifulSoup. Рекоммендуется 'lxml'
+    parser: str = 'bs4'  # 'bs4' - парсер ParserFromHTML, 'lxml' - ParserFromLXML
+    targeted: bool = False  # разбирать только блоки со списком книг и паджинатором
+    workers: int = 0  # количество процессов для параллельного разбора страниц, 0 - по количеству ядер
 
 @dataclass
 class DBConfig:
@@ -39,6 +112,9 @@ class DBConfig:
     Класс для хранения конфигурации базы данных.
     """
     sqlite_db: str # основная база данных в sqlite3
+    cached_statements: int = 256  # размер кеша подготовленных запросов соединения sqlite3
+    profile: str = 'none'  # 'none', 'crawler' или 'export' - набор PRAGMA при открытии соединения
+    pragmas: dict = field(default_factory=dict)  # {PRAGMA: значение}, заменяют значения профиля
 
 @dataclass
 class XLSXConfig:
@@ -70,9 +146,35 @@ class Config:
         if os.path.isfile(path):
             env.read_env(path,override=True)
             self.encoding = env('ENCODING')
-            self.web_connection = WebConnectionConfig(site=env('SITE'), cache_folder=env('CACHE_FOLDER'))
-            self.bs_parser = BSParserConfig(features=env('BS_FEATURES'))
-            self.db = DBConfig(sqlite_db=env("SQLITE_DB"))
+            self.web_connection = WebConnectionConfig(site=env('SITE'), cache_folder=env('CACHE_FOLDER'),
+                                                      cache_mode=env('CACHE_MODE', 'forever'),
+                                                      cache_revalidate_after=env.float('CACHE_REVALIDATE_AFTER', 0),
+                                                      cache_storage=env('CACHE_STORAGE', 'files'),
+                                                      cache_db=env('CACHE_DB', ''),
+                                                      cache_compression=env('CACHE_COMPRESSION', 'none'),
+                                                      cache_max_size=env.float('CACHE_MAX_SIZE', 0),
+                                                      cache_ttl=env.float('CACHE_TTL', 0),
+                                                      cache_ttl_rules=env.dict('CACHE_TTL_RULES', {},
+                                                                               subcast_values=float),
+                                                      pool_size=env.int('WEB_POOL_SIZE', 10),
+                                                      keep_alive=env.bool('WEB_KEEP_ALIVE', True),
+                                                      connect_timeout=env.float('WEB_CONNECT_TIMEOUT', 10),
+                                                      read_timeout=env.float('WEB_READ_TIMEOUT', 60),
+                                                      concurrency=env.int('WEB_CONCURRENCY', 4),
+                                                      requests_per_minute=env.float('RATE_PER_MINUTE', 6),
+                                                      burst=env.int('RATE_BURST', 2),
+                                                      min_requests_per_minute=env.float('RATE_MIN_PER_MINUTE', 0.5),
+                                                      slow_latency=env.float('RATE_SLOW_LATENCY', 10),
+                                                      breaker_base_delay=env.float('BREAKER_BASE_DELAY', 60),
+                                                      breaker_max_delay=env.float('BREAKER_MAX_DELAY', 1800),
+                                                      breaker_max_retries=env.int('BREAKER_MAX_RETRIES', 3))
+            self.bs_parser = BSParserConfig(features=env('BS_FEATURES'), parser=env('HTML_PARSER', 'bs4'),
+                                           targeted=env.bool('HTML_TARGETED_PARSE', False),
+                                           workers=env.int('HTML_PARSE_WORKERS', 0))
+            self.db = DBConfig(sqlite_db=env("SQLITE_DB"),
+                               cached_statements=env.int('SQLITE_CACHED_STATEMENTS', 256),
+                               profile=env('SQLITE_PROFILE', 'none'),
+                               pragmas=env.dict('SQLITE_PRAGMAS', {}))
             self.export = ExportConfig(xlsx=XLSXConfig(folder=env('XLSX_FOLDER')))
         else:
             raise Exception(f'Can not read configuration from {path} file!')
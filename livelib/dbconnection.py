@@ -1,10 +1,14 @@
+import argparse
+import datetime
 import json
 import logging
 import sqlite3
 import os
+import re
+import threading
 import typing
 
-from livelib.parser import BookDataFormatter
+from livelib.parser import BookDataFormatter, ParserForDB
 from livelib.config import Config
 from typing import Dict, List
 
@@ -24,7 +28,27 @@ class DBConnection:
         """
         pass
 
-    def run_single_sql(self, sql: str, params: typing.Iterable = (), return_lastrowid=False) -> list or int or None:
+    def update_db(self, formatter: type[BookDataFormatter] = BookDataFormatter) -> List[str]:
+        """
+        Добавляет в таблицы уже существующей базы данных колонки, которые появились в BookDataFormatter позже.
+        :param formatter: класс BookDataFormatter со словарем данных по каждому столбцу БД
+                defaults to BookDataFormatter
+        :type formatter: type[BookDataFormatter]
+        :return: список добавленных колонок вида 'таблица.колонка'
+        :rtype: List[str]
+        """
+        pass
+
+    def migrate(self) -> List[int]:
+        """
+        Применяет к базе данных миграции схемы, которые еще не были применены.
+        :return: список номеров примененных миграций
+        :rtype: List[int]
+        """
+        pass
+
+    def run_single_sql(self, sql: str, params: typing.Iterable = (), return_lastrowid=False,
+                       record: type = None) -> list or int or None:
         """
         Запускает одну команду sql, переданную в строке sql с подставленными параметрами params.
         Невозможно с помощью подстановки параметров создать таблицу, удалить таблицу, проверить схему таблицы,
@@ -36,19 +60,47 @@ class DBConnection:
         :param return_lastrowid: Нужно ли возвращать ID последней добавленной строки
         :type return_lastrowid: Bool
                 defaults to False
+        :param record: класс BookRecord (см. BookDataFormatter.record()), в записи которого собираются строки
+            результата вместо словарей, колонки, которых нет в записи, пропускаются
+        :type record: type
+                defaults to None
         :return: результат запроса или None
         :rtype: list|int|None
         """
         pass
 
-    def insert_values(self, table: str, values: List[Dict]) -> int:
+    def iter_sql(self, sql: str, params: typing.Iterable = (), batch_size: int = 1000,
+                 record: type = None) -> typing.Iterator:
+        """
+        Запускает запрос sql и возвращает итератор по строкам результата, которые читаются из БД пачками.
+        :param sql: запрос SELECT с возможными placeholders (?) для параметров из params
+        :type sql: str
+        :param params: список, кортеж, словарь подставляемых параметров
+        :type params: typing.Iterable
+        :param batch_size: сколько строк читать из БД за один раз
+        :type batch_size: int
+                defaults to 1000
+        :param record: класс BookRecord (см. BookDataFormatter.record()), в записи которого собираются строки
+            результата вместо словарей
+        :type record: type
+                defaults to None
+        :return: итератор по словарям или записям record
+        :rtype: typing.Iterator
+        """
+        pass
+
+    def insert_values(self, table: str, values: List[Dict] or List[typing.Sequence], fields: List[str] = None) -> int:
         """
         Вставляет несколько новых строк в БД. Должно быть согласовано с DataFormatter
         :param table: название базы данных
         :type table: str
         :param values: список вида [{'field_name1':'field_value1','field_name2':'field_value2',...},{...}],
-                        где каждый словарь это новая строка
-        :type values: list[Dict]
+                        где каждый словарь это новая строка,
+                        либо при заданных fields список строк значений в порядке fields
+        :type values: list[Dict] or list[Sequence]
+        :param fields: названия колонок для строк значений
+            defaults to None
+        :type fields: List[str]
         :return: количество вставленных строк
         :rtype: int
         """
@@ -64,6 +116,35 @@ class DBConnection:
         """
         pass
 
+    def ingest_read_books(self, reader_id: int, books: List[typing.Sequence], book_fields: List[str],
+                          read_books: List[typing.Sequence], read_book_fields: List[str],
+                          updated: List[typing.Sequence] = (), prepend: bool = False) -> int:
+        """
+        Сохраняет книги читателя одной транзакцией: добавляет в таблицу книг те, которых там еще нет,
+        и связывает все книги с читателем строками таблицы прочитанных книг.
+        Уже сохраненные книги и связи не меняются, кроме строк updated. Книга в таблице находится по book_id,
+        а если не нашлась - по work_id, при повторах книги в books берется первая.
+        :param reader_id: id читателя
+        :type reader_id: int
+        :param books: строки значений книг в порядке book_fields
+        :type books: List[Sequence]
+        :param book_fields: названия колонок таблицы книг, среди них должны быть book_id и work_id
+        :type book_fields: List[str]
+        :param read_books: строки значений прочитанных книг в порядке read_book_fields, по одной на каждую книгу books
+        :type read_books: List[Sequence]
+        :param read_book_fields: названия колонок таблицы прочитанных книг без reader_id, book_id и position
+        :type read_book_fields: List[str]
+        :param updated: строки значений уже сохраненных прочитанных книг в порядке read_book_fields с id строки
+            в конце, они обновляются на месте в той же транзакции и остаются на своих местах
+        :type updated: List[Sequence]
+        :param prepend: новые прочитанные книги ставятся перед уже сохраненными книгами читателя в порядке books,
+            иначе - после них
+        :type prepend: bool
+        :return: количество добавленных прочитанных книг
+        :rtype: int
+        """
+        pass
+
     def get_table_schema(self, table: str) -> str or None:
         """
         Возвращает схему таблицы в виде сериализованной для json строки
@@ -74,11 +155,21 @@ class DBConnection:
         """
         pass
 
+    def close(self) -> None:
+        """
+        Закрывает соединение с БД.
+        """
+        pass
+
 
 class SQLite3Connection(DBConnection):
     """
     Класс работы с базой данных в формате sqlite3.
     Структура таблиц БД описана в uml_diagrams/Database.pdf
+    Каждый поток работает со своим соединением, которое открывается при первом запросе и держится открытым
+    до вызова close, поэтому подготовленные запросы (до Config.db.cached_statements штук) переиспользуются.
+    Объект можно использовать как контекстный менеджер: with SQLite3Connection(config) as db: ...
+    закрывает соединения при выходе из блока. После close соединения снова открываются при следующем запросе.
 
     ...
     Attributes
@@ -96,18 +187,74 @@ class SQLite3Connection(DBConnection):
         Создает объект соединения с БД, создает файл БД, если нужно
     create_db(self, formatter: type[BookDataFormatter] = BookDataFormatter) -> None
         Создает базу данных по заданным в formatter полям
-    run_single_sql(self, sql: str, params: typing.Iterable = (), return_lastrowid=False) -> list or None
+    update_db(self, formatter: type[BookDataFormatter] = BookDataFormatter) -> List[str]
+        Добавляет в существующие таблицы недостающие колонки из formatter
+    merge_duplicate_readers(self) -> Dict[str, int]
+        Объединяет читателей с одинаковым логином, которые мешают миграции с уникальным индексом
+    backfill_review_plain(self, batch_size: int = 500) -> int
+        Заполняет текст рецензий без разметки для строк, сохраненных до появления колонки review_plain
+    run_single_sql(self, sql: str, params: typing.Iterable = (), return_lastrowid=False, record: type = None) -> list or None
         Запускает одну команду sql, переданную в строке sql с подставленными параметрами params
-    insert_values(self, table: str, values: List[Dict]) -> int
+    iter_sql(self, sql: str, params: typing.Iterable = (), batch_size: int = 1000, record: type = None) -> Iterator
+        Возвращает итератор по строкам результата запроса, которые читаются из БД пачками
+    insert_values(self, table: str, values: List[Dict], fields: List[str] = None) -> int
         Вставляет несколько новых строк в БД.
+    ingest_read_books(self, reader_id: int, books, book_fields, read_books, read_book_fields) -> int
+        Сохраняет книги читателя и связи с ними одной транзакцией
+    get_schema_version(self) -> int
+        Возвращает версию схемы БД
+    migrate(self) -> List[int]
+        Применяет к БД миграции схемы (индексы), которые еще не были применены
     table_exists(self, name: str) -> bool
          Проверяет, существует ли таблица с заданным именем name.
     get_table_schema(self, table: str) -> str or None
         Возвращает схему таблицы в виде сериализованной для json строки
+    close(self) -> None
+        Закрывает соединения всех потоков
     """
     table_book: str = 'Book'
     table_reader: str = 'Reader'
     table_readbook: str = 'ReadBook'
+    table_schema_version: str = 'SchemaVersion'
+    # миграции схемы БД вида (версия, описание, команды SQL), применяются по порядку к БД с меньшей версией,
+    # каждая в своей транзакции; таблицы в командах - Book, Reader, ReadBook
+    migrations: tuple = (
+        (1, 'indexes for reader lookups by login and read books by reader', (
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_reader_login ON Reader (login)",
+            # книги читателя: удаление, выгрузка и сравнение при обновлении ищут по reader_id,
+            # а book_id в индексе позволяет соединить строки с Book, не читая саму таблицу ReadBook
+            "CREATE INDEX IF NOT EXISTS idx_readbook_reader ON ReadBook (reader_id, book_id)",
+        )),
+        (2, 'index for read books of a reader in their order', (
+            # выгрузка идет в порядке position, а строки без него (сохраненные до появления колонки) - в порядке id,
+            # id строки в индексе есть и так, поэтому сортировать их отдельно не нужно
+            "CREATE INDEX IF NOT EXISTS idx_readbook_position ON ReadBook (reader_id, position)",
+        )),
+    )
+    # проверки перед миграцией: запрос, который находит мешающие ей данные, и что с ними делать;
+    # данные пользователя миграции сами не меняют
+    migration_checks: dict = {
+        # читатели с повторяющимся логином остались от гонок при регистрации
+        1: ("SELECT login FROM Reader WHERE login IS NOT NULL GROUP BY login HAVING count(*) > 1 ORDER BY login",
+            'readers with the same login, merge them with: python -m livelib.dbconnection --merge-readers'),
+    }
+    # SQLite до версии 3.32 принимает не больше 999 параметров в одном запросе
+    max_variables: int = 999
+    # наборы PRAGMA, которые выполняются при открытии каждого соединения, профиль выбирается в Config.db.profile
+    profiles: dict = {
+        # хост, который скачивает книги: журнал WAL, чтобы экспорт читал БД, не дожидаясь записи, и наоборот;
+        # при synchronous=NORMAL в режиме WAL fsync делается только при переносе журнала в БД, а не на каждый commit,
+        # после сбоя питания могут потеряться последние транзакции, но БД не портится
+        'crawler': {'busy_timeout': 5000, 'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'cache_size': -64000,
+                    'mmap_size': 268435456, 'temp_store': 'MEMORY'},
+        # реплика, с которой только делается экспорт: БД в основном читается, поэтому больше кеш страниц
+        # и отображение файла в память, а ожидание блокировки дольше, чтобы переждать обновление реплики;
+        # режим журнала остается тем, который выбрал пишущий в БД хост
+        'export': {'busy_timeout': 30000, 'synchronous': 'NORMAL', 'cache_size': -262144,
+                   'mmap_size': 1073741824, 'temp_store': 'MEMORY'},
+        # настройки sqlite3 по умолчанию
+        'none': {},
+    }
 
     def __init__(self, config: Config, create_if_not_exist: bool = False):
         """
@@ -118,6 +265,11 @@ class SQLite3Connection(DBConnection):
         :type create_if_not_exist: bool
         """
         self.filename: str = config.db.sqlite_db  # файл базы данных
+        self.cached_statements: int = config.db.cached_statements
+        self.pragmas: dict = self.get_pragmas(config.db.profile, config.db.pragmas)
+        self.local = threading.local()  # соединение текущего потока
+        self.connections = []  # открытые соединения всех потоков вида (соединение, pid процесса)
+        self.lock = threading.Lock()
         # создаем файл с базой данной, если требуется
         if not os.path.isfile(self.filename) and create_if_not_exist:
             try:
@@ -128,13 +280,77 @@ class SQLite3Connection(DBConnection):
             except Exception as exc:
                 logging.exception(f'Can not create DB file {self.filename}', exc_info=True)
         try:
-            con = sqlite3.connect(self.filename)
+            self._get_connection()
             logging.info(f'Successfully connected to {self.filename} db.')
         except sqlite3.Error:
             logging.exception(f'Error while connecting to {self.filename} db.', exc_info=True)
             raise
-        else:
-            con.close()
+        # базы данных, созданные прошлыми версиями, дополняем новыми колонками и индексами
+        self.update_db(BookDataFormatter)
+        try:
+            self.migrate()
+        except ValueError:
+            # БД работает и без индексов, миграция применится после исправления данных, ошибка уже в логе
+            pass
+
+    @classmethod
+    def get_pragmas(cls, profile: str, pragmas: dict = None) -> dict:
+        """
+        Возвращает PRAGMA профиля с замененными значениями из pragmas.
+        :param profile: название профиля из profiles
+        :type profile: str
+        :param pragmas: значения, заменяющие значения профиля, {PRAGMA: значение}
+        :type pragmas: dict
+        :raises ValueError: если профиль неизвестен, PRAGMA не из настроек производительности или значение не похоже
+            на число или ключевое слово
+        :return: {PRAGMA: значение}
+        :rtype: dict
+        """
+        if profile not in cls.profiles:
+            raise ValueError(f'Unknown sqlite profile {profile}, expected one of {list(cls.profiles)}')
+        result = dict(cls.profiles[profile])
+        for name, value in (pragmas or {}).items():
+            # значения подставляются прямо в текст PRAGMA, поэтому пропускаем только известные настройки
+            if name not in cls.profiles['crawler'] or not re.fullmatch(r'-?\w+', str(value)):
+                raise ValueError(f'Unsupported sqlite pragma {name} = {value}, '
+                                 f'expected one of {list(cls.profiles["crawler"])}')
+            result[name] = value
+        return result
+
+    def _get_connection(self) -> sqlite3.Connection:
+        """
+        Возвращает соединение текущего потока, открывая его при первом обращении.
+        В процессе, созданном через fork, соединения родителя не используются, открывается новое.
+        :return: соединение с БД
+        :rtype: sqlite3.Connection
+        """
+        con = getattr(self.local, 'con', None)
+        if con is None or self.local.pid != os.getpid():
+            # соединение используется только своим потоком, но закрыть его можно из любого, см. close
+            con = sqlite3.connect(self.filename, cached_statements=self.cached_statements, check_same_thread=False)
+            for name, value in self.pragmas.items():
+                con.execute(f'PRAGMA {name} = {value}')
+            self.local.con, self.local.pid = con, os.getpid()
+            with self.lock:
+                self.connections.append((con, os.getpid()))
+        return con
+
+    def close(self) -> None:
+        """
+        Закрывает соединения всех потоков. Соединения, унаследованные от родительского процесса, не трогаются.
+        """
+        with self.lock:
+            connections, self.connections = self.connections, []
+            self.local = threading.local()
+        for con, pid in connections:
+            if pid == os.getpid():
+                con.close()
+
+    def __enter__(self) -> 'SQLite3Connection':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
 
     def create_db(self, formatter: type[BookDataFormatter] = BookDataFormatter) -> None:
         """
@@ -147,8 +363,8 @@ class SQLite3Connection(DBConnection):
         """
         logging.info('Starting to create new database.')
         # создаем таблицу книг
-        book_fields: dict[str, str] = {i: formatter.all_properties_db()[i] for i in formatter.book_properties_db}
-        fields_str = ','.join(["id INTEGER PRIMARY KEY AUTOINCREMENT "] + [i + ' ' + j for i, j in book_fields.items()])
+        fields_str = ','.join(["id INTEGER PRIMARY KEY AUTOINCREMENT "] +
+                              list(formatter.db_columns(formatter.book_properties_db)))
         sql = f"CREATE TABLE {self.table_book} ( {fields_str} , UNIQUE(book_id), UNIQUE(work_id) )"
         logging.debug(f'Creating new table: {sql}')
         try:
@@ -157,9 +373,8 @@ class SQLite3Connection(DBConnection):
             logging.exception(f"Can't create table {self.table_book}!", exc_info=True)
             raise
         # создаем таблицу читателей
-        reader_fields: dict[str, str] = {i: formatter.all_properties_db()[i] for i in formatter.reader_properties_db}
-        fields_str = ','.join(
-            ["id INTEGER PRIMARY KEY AUTOINCREMENT "] + [i + ' ' + j for i, j in reader_fields.items()])
+        fields_str = ','.join(["id INTEGER PRIMARY KEY AUTOINCREMENT "] +
+                              list(formatter.db_columns(formatter.reader_properties_db)))
         sql = f"CREATE TABLE {self.table_reader} ( {fields_str})"
         logging.debug(f'Creating new table: {sql}')
         try:
@@ -168,12 +383,10 @@ class SQLite3Connection(DBConnection):
             logging.exception(f"Can't create table {self.table_reader}!", exc_info=True)
             raise
         # создаем таблицу прочитанных книг
-        readbook_fields: dict[str, str] = {i: formatter.all_properties_db()[i] for i in
-                                           formatter.readbook_properties_db}
         fields_str = ','.join(["id INTEGER PRIMARY KEY AUTOINCREMENT "] +
                               ["book_id INTEGER "] +
                               ["reader_id INTEGER "] +
-                              [i + ' ' + j for i, j in readbook_fields.items()] +
+                              list(formatter.db_columns(formatter.readbook_properties_db)) +
                               [
                                   f"CONSTRAINT fk_book_id FOREIGN KEY(book_id) REFERENCES {self.table_book}(id) ON DELETE CASCADE "] +
                               [
@@ -186,8 +399,141 @@ class SQLite3Connection(DBConnection):
         except sqlite3.Error:
             logging.exception(f"Can't create table {self.table_readbook}!", exc_info=True)
             raise
+        # индексы и версию схемы создают миграции
+        self.migrate()
+
+    def update_db(self, formatter: type[BookDataFormatter] = BookDataFormatter) -> List[str]:
+        """
+        Добавляет в таблицы уже существующей базы данных колонки, которые появились в BookDataFormatter позже.
+        Таблицы, которых еще нет, пропускаются: их создает create_db.
+        :param formatter: класс BookDataFormatter со словарем данных по каждому столбцу БД
+                defaults to BookDataFormatter
+        :type formatter: type[BookDataFormatter]
+        :return: список добавленных колонок вида 'таблица.колонка'
+        :rtype: List[str]
+        """
+        result = []
+        tables = {self.table_book: formatter.book_properties_db,
+                  self.table_reader: formatter.reader_properties_db,
+                  self.table_readbook: formatter.readbook_properties_db}
+        for table, properties in tables.items():
+            if not self.table_exists(table):
+                continue
+            columns = {i['name'] for i in self.run_single_sql(f'PRAGMA table_info ({table})')}
+            for i, column in zip(properties, formatter.db_columns(properties)):
+                if i not in columns:
+                    # название и тип колонки берутся из BookDataFormatter, а не от пользователя
+                    self.run_single_sql(f'ALTER TABLE {table} ADD COLUMN {column}')
+                    logging.info(f'Add column {i} to table {table} in {self.filename}')
+                    result.append(f'{table}.{i}')
+        return result
 
-    def run_single_sql(self, sql: str, params: typing.Iterable = (), return_lastrowid=False) -> list or int or None:
+    def get_schema_version(self) -> int:
+        """
+        Возвращает версию схемы БД - номер последней примененной миграции, 0 если миграций еще не было.
+        :rtype: int
+        """
+        if not self.table_exists(self.table_schema_version):
+            return 0
+        result = self.run_single_sql(f'SELECT max(version) AS version FROM {self.table_schema_version}')
+        return result[0]['version'] or 0 if result else 0
+
+    def migrate(self) -> List[int]:
+        """
+        Применяет к базе данных миграции из migrations с версией больше текущей, каждую в своей транзакции.
+        БД без таблиц Book, Reader и ReadBook не трогается: миграции применятся после create_db.
+        Если проверка из migration_checks нашла мешающие миграции данные, миграция и следующие за ней не применяются.
+        :raises ValueError: если в БД есть данные, мешающие миграции, в сообщении они перечислены
+        :raises sqlite3.Error: если миграцию не удалось применить, она откатывается целиком
+        :return: список номеров примененных миграций
+        :rtype: List[int]
+        """
+        result = []
+        if not all(self.table_exists(i) for i in (self.table_book, self.table_reader, self.table_readbook)):
+            return result
+        con = self._get_connection()
+        con.execute(f'CREATE TABLE IF NOT EXISTS {self.table_schema_version} '
+                    f'(version INTEGER PRIMARY KEY, description TEXT, applied_time TEXT)')
+        current = self.get_schema_version()
+        for version, description, commands in self.migrations:
+            if version <= current:
+                continue
+            check = self.migration_checks.get(version)
+            conflicts = [str(row[0]) for row in con.execute(check[0])] if check else []
+            if conflicts:
+                message = f'Can not apply migration {version} to {self.filename}, {check[1]}: {", ".join(conflicts)}'
+                logging.error(message)
+                raise ValueError(message)
+            # команды CREATE INDEX sqlite3 сам в транзакцию не включает, поэтому начинаем ее явно
+            con.execute('BEGIN')
+            try:
+                for sql in commands:
+                    con.execute(sql)
+                con.execute(f'INSERT INTO {self.table_schema_version} (version, description, applied_time) '
+                            f'VALUES (?, ?, ?)',
+                            (version, description, datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+                con.commit()
+            except sqlite3.Error:
+                con.rollback()
+                logging.exception(f'Can not apply migration {version} to {self.filename}', exc_info=True)
+                raise
+            logging.info(f'Applied migration {version} ({description}) to {self.filename}')
+            result.append(version)
+        return result
+
+    def merge_duplicate_readers(self) -> Dict[str, int]:
+        """
+        Объединяет читателей с одинаковым логином в читателя с меньшим id - его приложение всегда и брало.
+        Прочитанные книги остальных читателей переносятся к нему, из книг, которые у него уже есть,
+        остается его вариант. Все изменения делаются одной транзакцией.
+        :return: словарь {логин: количество перенесенных книг}
+        :rtype: Dict[str, int]
+        """
+        result = {}
+        con = self._get_connection()
+        with con:
+            duplicates = con.execute(f'SELECT login, min(id) FROM {self.table_reader} WHERE login IS NOT NULL '
+                                     f'GROUP BY login HAVING count(*) > 1').fetchall()
+            for login, reader_id in duplicates:
+                others = [row[0] for row in con.execute(f'SELECT id FROM {self.table_reader} WHERE login=? AND id<>?',
+                                                        (login, reader_id))]
+                placeholders = ','.join(['?'] * len(others))
+                result[login] = con.execute(f'UPDATE OR IGNORE {self.table_readbook} SET reader_id=? '
+                                            f'WHERE reader_id IN ({placeholders})', (reader_id, *others)).rowcount
+                # остались только книги, которые у читателя уже есть
+                con.execute(f'DELETE FROM {self.table_readbook} WHERE reader_id IN ({placeholders})', others)
+                con.execute(f'DELETE FROM {self.table_reader} WHERE id IN ({placeholders})', others)
+                logging.info(f'Merged {len(others)} readers with login {login} into reader {reader_id}, '
+                             f'moved {result[login]} read books')
+        return result
+
+    def backfill_review_plain(self, batch_size: int = 500) -> int:
+        """
+        Заполняет колонку review_plain (текст рецензии без разметки) для строк ReadBook,
+        сохраненных до появления этой колонки.
+        :param batch_size: сколько строк обновляется за одну транзакцию
+            defaults to 500
+        :type batch_size: int
+        :return: количество обновленных строк
+        :rtype: int
+        """
+        result = 0
+        while True:
+            rows = self.run_single_sql(f'SELECT id, review_text FROM {self.table_readbook} '
+                                       f'WHERE review_plain IS NULL AND review_text IS NOT NULL LIMIT ?',
+                                       (batch_size,))
+            if not rows:
+                break
+            con = self._get_connection()
+            with con:
+                con.executemany(f'UPDATE {self.table_readbook} SET review_plain = ? WHERE id = ?',
+                                [(ParserForDB.create_review_plain(i['review_text']), i['id']) for i in rows])
+            result += len(rows)
+            logging.info(f'Backfilled review_plain for {result} rows of {self.table_readbook} in {self.filename}')
+        return result
+
+    def run_single_sql(self, sql: str, params: typing.Iterable = (), return_lastrowid=False,
+                       record: type = None) -> list or int or None:
         """
         Запускает одну команду sql, переданную в строке sql с подставленными параметрами params.
         Невозможно с помощью подстановки параметров создать таблицу, удалить таблицу, проверить схему таблицы,
@@ -199,6 +545,10 @@ class SQLite3Connection(DBConnection):
         :param return_lastrowid: Нужно ли возвращать ID последней добавленной строки
         :type return_lastrowid: Bool
                 defaults to False
+        :param record: класс BookRecord (см. BookDataFormatter.record()), в записи которого собираются строки
+            результата вместо словарей, колонки, которых нет в записи, пропускаются
+        :type record: type
+                defaults to None
         :return: результат запроса или None
         :rtype: list|int|None
         """
@@ -207,11 +557,18 @@ class SQLite3Connection(DBConnection):
             fields = [column[0] for column in cursor.description]
             return {key: value for key, value in zip(fields, row)}
 
+        def record_factory(cursor, row):
+            result = record.__new__(record)
+            for column, value in zip(cursor.description, row):
+                if column[0] in record._field_set:
+                    setattr(result, column[0], value)
+            return result
+
         result = None
         try:
-            con = sqlite3.connect(self.filename)
-            con.row_factory = dict_factory
+            con = self._get_connection()
             cur = con.cursor()
+            cur.row_factory = dict_factory if record is None else record_factory
             try:
                 result = cur.execute(sql, params).fetchall()
                 if return_lastrowid:
@@ -219,32 +576,87 @@ class SQLite3Connection(DBConnection):
                 con.commit()
             except sqlite3.Error:
                 logging.exception('Error while processing sql!', exc_info=True)
+                # незавершенная транзакция в общем соединении заблокировала бы следующие запросы
+                con.rollback()
                 # raise
-            con.close()
+            finally:
+                cur.close()
         except sqlite3.Error:
             logging.exception(f'Error while processing sql {sql} in {self.filename} SQLiteConnection! ', exc_info=True)
             # raise
         return result
 
-    def insert_values(self, table: str, values: List[Dict]) -> int:
+    def iter_sql(self, sql: str, params: typing.Iterable = (), batch_size: int = 1000,
+                 record: type = None) -> typing.Iterator:
+        """
+        Запускает запрос sql и возвращает итератор по строкам результата. Строки берутся из курсора пачками
+        по batch_size, поэтому весь результат в памяти не держится. Колонки лучше перечислять в запросе явно:
+        колонки, которых нет в записи record, пропускаются.
+        В отличие от run_single_sql ошибка не скрывается: оборванный на середине результат выглядел бы полным.
+        :param sql: запрос SELECT с возможными placeholders (?) для параметров из params
+        :type sql: str
+        :param params: список, кортеж, словарь подставляемых параметров
+        :type params: typing.Iterable
+        :param batch_size: сколько строк читать из БД за один раз
+        :type batch_size: int
+                defaults to 1000
+        :param record: класс BookRecord (см. BookDataFormatter.record()), в записи которого собираются строки
+            результата вместо словарей
+        :type record: type
+                defaults to None
+        :raises sqlite3.Error: если запрос не удалось выполнить
+        :return: итератор по словарям или записям record
+        :rtype: typing.Iterator
+        """
+        cur = self._get_connection().cursor()
+        try:
+            cur.execute(sql, params)
+            fields = [column[0] for column in cur.description]
+            columns = range(len(fields))
+            if record is not None:
+                columns = [n for n, i in enumerate(fields) if i in record._field_set]
+                fields = [fields[n] for n in columns]
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    if len(columns) != len(row):
+                        row = [row[n] for n in columns]
+                    yield dict(zip(fields, row)) if record is None else record.from_row(fields, row)
+        except sqlite3.Error:
+            logging.exception(f'Error while processing sql {sql} in {self.filename} SQLiteConnection! ', exc_info=True)
+            raise
+        finally:
+            cur.close()
+
+    def insert_values(self, table: str, values: List[Dict] or List[typing.Sequence], fields: List[str] = None) -> int:
         """
         Вставляет несколько новых строк в БД. Должно быть согласовано с DataFormatter
         :param table: название базы данных
         :type table: str
-        :param values: список вида [{'field_name1':'field_value1','field_name2':'field_value2',...},{...}], где каждый словарь это новая строка
-        :type values: list[Dict]
+        :param values: список вида [{'field_name1':'field_value1','field_name2':'field_value2',...},{...}], где каждый словарь это новая строка,
+                        либо при заданных fields список строк значений в порядке fields
+        :type values: list[Dict] or list[Sequence]
+        :param fields: названия колонок для строк значений
+            defaults to None
+        :type fields: List[str]
         :return: количество вставленных строк
         :rtype: int
         """
         result = 0
-        field_names = ', '.join([i for i in values[0].keys()])
-        field_values = [[val for val in book.values()] for book in values]
-        placeholders = ', '.join(['?' for i in range(len(values[0].keys()))])
+        if fields is None:
+            fields = list(values[0].keys())
+            field_values = [list(book.values()) for book in values]
+        else:
+            field_values = values
+        field_names = ', '.join(fields)
+        placeholders = ', '.join(['?'] * len(fields))
         # print('field_names:', field_names)
         # print('field_values:', field_values)
         # print('placeholders:', placeholders)
         try:
-            con = sqlite3.connect(self.filename)
+            con = self._get_connection()
             try:
                 with con:
                     result = con.executemany(f"INSERT OR IGNORE INTO {table} ({field_names}) VALUES ({placeholders})",
@@ -256,13 +668,114 @@ class SQLite3Connection(DBConnection):
                                   f'place_holders = {placeholders}, \n'
                                   f'field_values = {sep.join([str(i) for i in field_values])}', exc_info=True)
                 raise
-            con.close()
         except sqlite3.Error:
             logging.exception(f'Error while processing executemany in {self.filename} SQLiteConnection! ',
                               exc_info=True)
             raise
         return result
 
+    def _id_chunks(self, books: List[typing.Sequence], book_id: int,
+                   work_id: int) -> typing.Iterator[typing.Tuple[list, list]]:
+        """
+        Делит непустые book_id и work_id книг на пачки, в каждой из которых не больше max_variables значений.
+        :param book_id: номер book_id в строке книги
+        :param work_id: номер work_id в строке книги
+        :return: пары списков (book_id, work_id)
+        """
+        book_ids, work_ids = [], []
+        for book in books:
+            if len(book_ids) + len(work_ids) + 2 > self.max_variables:
+                yield book_ids, work_ids
+                book_ids, work_ids = [], []
+            if book[book_id]:
+                book_ids.append(book[book_id])
+            if book[work_id]:
+                work_ids.append(book[work_id])
+        if book_ids or work_ids:
+            yield book_ids, work_ids
+
+    def ingest_read_books(self, reader_id: int, books: List[typing.Sequence], book_fields: List[str],
+                          read_books: List[typing.Sequence], read_book_fields: List[str],
+                          updated: List[typing.Sequence] = (), prepend: bool = False) -> int:
+        """
+        Сохраняет книги читателя одной транзакцией: добавляет в таблицу книг те, которых там еще нет,
+        и связывает все книги с читателем строками таблицы прочитанных книг.
+        Уже сохраненные книги и связи не меняются, кроме строк updated. Книга в таблице находится по book_id,
+        а если не нашлась - по work_id, при повторах книги в books берется первая.
+        :param reader_id: id читателя
+        :type reader_id: int
+        :param books: строки значений книг в порядке book_fields
+        :type books: List[Sequence]
+        :param book_fields: названия колонок таблицы книг, среди них должны быть book_id и work_id
+        :type book_fields: List[str]
+        :param read_books: строки значений прочитанных книг в порядке read_book_fields, по одной на каждую книгу books
+        :type read_books: List[Sequence]
+        :param read_book_fields: названия колонок таблицы прочитанных книг без reader_id, book_id и position
+        :type read_book_fields: List[str]
+        :param updated: строки значений уже сохраненных прочитанных книг в порядке read_book_fields с id строки
+            в конце, они обновляются на месте в той же транзакции и остаются на своих местах
+        :type updated: List[Sequence]
+        :param prepend: новые прочитанные книги ставятся перед уже сохраненными книгами читателя в порядке books,
+            иначе - после них
+        :type prepend: bool
+        :return: количество добавленных прочитанных книг
+        :rtype: int
+        """
+        book_id = book_fields.index('book_id')
+        work_id = book_fields.index('work_id')
+        # номера прочитанных книг в books по book_id и work_id книги, поиск по словарям вместо перебора списка
+        by_book_id = {}
+        by_work_id = {}
+        for n, book in enumerate(books):
+            if book[book_id]:
+                by_book_id.setdefault(book[book_id], n)
+            if book[work_id]:
+                by_work_id.setdefault(book[work_id], n)
+        con = self._get_connection()
+        try:
+            with con:
+                if updated:
+                    con.executemany(f"UPDATE {self.table_readbook} SET {', '.join(i + '=?' for i in read_book_fields)} "
+                                    f"WHERE id=?", updated)
+                con.executemany(f"INSERT OR IGNORE INTO {self.table_book} ({', '.join(book_fields)}) "
+                                f"VALUES ({', '.join(['?'] * len(book_fields))})", books)
+                # id книг ищем пачками, чтобы не превысить ограничение на количество параметров запроса
+                found = {}
+                for book_ids, work_ids in self._id_chunks(books, book_id, work_id):
+                    for row in con.execute(f"SELECT id, book_id, work_id FROM {self.table_book} "
+                                           f"WHERE book_id IN ({', '.join(['?'] * len(book_ids))}) "
+                                           f"OR work_id IN ({', '.join(['?'] * len(work_ids))})", book_ids + work_ids):
+                        found.setdefault(row[0], row)
+                rows = []
+                for i, i_book_id, i_work_id in found.values():
+                    n = by_book_id.get(i_book_id)
+                    if n is None:
+                        n = by_work_id.get(i_work_id)
+                    if n is not None:
+                        rows.append((n, i))
+                if prepend:
+                    # книги находятся в порядке плана запроса, а перед сохраненными ставятся в порядке books,
+                    # как новые прочтения на сайте
+                    rows.sort(key=lambda row: row[0])
+                result = 0
+                if rows:
+                    # строки, сохраненные до появления колонки position, получают место по своему id
+                    con.execute(f"UPDATE {self.table_readbook} SET position=id "
+                                f"WHERE reader_id=? AND position IS NULL", (reader_id,))
+                    first, last = con.execute(f"SELECT min(position), max(position) FROM {self.table_readbook} "
+                                              f"WHERE reader_id=?", (reader_id,)).fetchone()
+                    start = first - len(rows) if prepend and first is not None else (last or 0) + 1
+                    fields = list(read_book_fields) + ['reader_id', 'book_id', 'position']
+                    result = con.executemany(
+                        f"INSERT OR IGNORE INTO {self.table_readbook} ({', '.join(fields)}) "
+                        f"VALUES ({', '.join(['?'] * len(fields))})",
+                        [tuple(read_books[n]) + (reader_id, i, start + k) for k, (n, i) in enumerate(rows)]).rowcount
+        except sqlite3.Error:
+            logging.exception(f'Error while saving {len(books)} books of reader {reader_id} in {self.filename}!',
+                              exc_info=True)
+            raise
+        return result
+
     def table_exists(self, name: str) -> bool:
         """
         Проверяет, существует ли таблица с заданным именем.
@@ -273,7 +786,7 @@ class SQLite3Connection(DBConnection):
         """
         result = False
         try:
-            con = sqlite3.connect(self.filename)
+            con = self._get_connection()
             try:
                 with con:
                     result = con.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?",
@@ -282,7 +795,6 @@ class SQLite3Connection(DBConnection):
             except sqlite3.Error:
                 logging.exception('Error while processing sql!', exc_info=True)
                 raise
-            con.close()
         except sqlite3.Error:
             logging.exception(f'Error while connecting to database in {self.filename} SQLiteConnection! ',
                               exc_info=True)
@@ -303,3 +815,22 @@ class SQLite3Connection(DBConnection):
             return json.dumps(result)
         else:
             return None
+
+
+if __name__ == '__main__':
+    # Разовое заполнение текста рецензий без разметки в базе данных, созданной прошлыми версиями:
+    #     python -m livelib.dbconnection --env .env
+    # Объединение читателей с одинаковым логином, если из-за них не применилась миграция схемы:
+    #     python -m livelib.dbconnection --env .env --merge-readers
+    arg_parser = argparse.ArgumentParser(description='Обслуживание базы данных, созданной прошлыми версиями.')
+    arg_parser.add_argument('--env', default='.env', help='файл конфигурации')
+    arg_parser.add_argument('--batch', type=int, default=500, help='сколько строк обновляется за одну транзакцию')
+    arg_parser.add_argument('--merge-readers', action='store_true',
+                            help='объединить читателей с одинаковым логином и применить миграции схемы')
+    args = arg_parser.parse_args()
+    db_connection = SQLite3Connection(Config(args.env))
+    if args.merge_readers:
+        print('Объединены читатели:', db_connection.merge_duplicate_readers())
+        print('Применены миграции:', db_connection.migrate())
+    else:
+        print('Обновлено рецензий:', db_connection.backfill_review_plain(args.batch))
@@ -4,14 +4,29 @@ import datetime
 import datetime as datetime
 import os.path
 import string
+import typing
 
 import openpyxl
 from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.packaging.relationship import RelationshipList
 from openpyxl.styles import PatternFill, Border, Side, Alignment, Protection, Font
 from .parser import BookDataFormatter, ParserForXLSX
 from .config import Config
 
 
+class _RelationshipList(RelationshipList):
+    """
+    Список связей листа, в который связь добавляется за O(1). RelationshipList из openpyxl при каждом
+    добавлении заново проверяет все связи, и на тысячах ссылок сохранение файла становится квадратичным.
+    """
+
+    def append(self, value):
+        self.Relationship.append(value)
+        if not value.Id:
+            value.Id = "rId{0}".format((len(self.Relationship)))
+
+
 class Export:
     """
     Абстрактный класс для экспорта книг читателя в файл.
@@ -19,11 +34,11 @@ class Export:
     folder: str = ''  # папка, где будут сохраняться экспортируемые файлы
     encoding: str = ''  # кодировка, в которой будут сохраняться экспортируемые файлы
 
-    def create_file(self, books: list, login: str) -> str or None:
+    def create_file(self, books: typing.Iterable, login: str) -> str or None:
         """
         Сохраняет файл с заданными книгами для читателя с заданным логином.
         Логин будет использован в названии файла.
-        :type books: list
+        :type books: typing.Iterable
         :type login: str
         :return: путь к сохраненному файлу
         :rtype str:
@@ -50,11 +65,31 @@ class XLSXExport(Export):
         filename = timestamp + '-' + reader_name + '.xlsx'
         return os.path.join(self.folder, filename).replace('\\', '/')
 
-    def create_file(self, books: list, login: str, parser_xlsx: ParserForXLSX) -> str or None:
+    @staticmethod
+    def _fast_relationships(ws) -> bool:
+        """
+        Служебный метод подменяет список связей писателя листа write_only на _RelationshipList.
+        Писатель создается при добавлении первой строки, связи ссылок он собирает при сохранении.
+        Метод опирается на внутреннее устройство openpyxl 3.1 (см. requirements.txt), если оно изменилось,
+        список не подменяется: файл сохранится так же, но медленнее, об этом пишется в лог.
+        :return: True, если список подменен
+        :rtype: bool
+        """
+        writer = getattr(ws, '_writer', None)
+        if type(getattr(writer, '_rels', None)) is not RelationshipList:
+            logging.warning(f'Can not replace hyperlink relationships of openpyxl {openpyxl.__version__} sheet writer, '
+                            f'export with many hyperlinks will be slow')
+            return False
+        writer._rels = _RelationshipList(writer._rels.Relationship)
+        return True
+
+    def create_file(self, books: typing.Iterable, login: str, parser_xlsx: ParserForXLSX) -> str or None:
         """
         Сохраняет файл с заданными книгами в формате xlsx для читателя с заданным логином.
         Логин будет использован в названии файла.
-        :type books: list
+        Книги могут идти итератором: документ создается в режиме write_only, строки сразу уходят во временный
+        файл, и в памяти до сохранения остаются только общие строки и ссылки документа.
+        :type books: typing.Iterable
         :type login: str
         :return: путь к сохраненному файлу
         :rtype str:
@@ -63,10 +98,9 @@ class XLSXExport(Export):
         properties = BookDataFormatter.all_properties_xlsx()
         # формируем путь и название экспортного файла
         filename = self._create_filename(login)
-        # создаем документ Excel
-        wb = Workbook()
-        ws = wb.active
-        ws.title = 'Прочитанные книги'
+        # создаем документ Excel, в режиме write_only строки только добавляются, а стили задаются ячейкам заранее
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet('Прочитанные книги')
 
         # Задаем ширину столбцов. Она берется из BookDataFormatter
         index = string.ascii_uppercase
@@ -76,34 +110,44 @@ class XLSXExport(Export):
                 ws.column_dimensions[index[i]].width = value['column_width']
                 i += 1
 
-        # Задаем названия столбцов
-        title_row = [i['name'] for i in properties.values()]
-        ws.append(title_row)
-        #  Задаем стиль для первой строки
-        for i in range(1, 1 + len(properties)):
-            ws.cell(ws.max_row, i).style = 'Headline 2'
+        def cell(value, style: str = None, hyperlink: str = None, alignment: Alignment = None) -> WriteOnlyCell:
+            result = WriteOnlyCell(ws, value)
+            if hyperlink is not None:
+                result.hyperlink = hyperlink
+            if style:
+                result.style = style
+            if alignment:
+                result.alignment = alignment
+            return result
+
+        # Задаем названия столбцов и стиль для первой строки
+        ws.append([cell(i['name'], style='Headline 2') for i in properties.values()])
+        self._fast_relationships(ws)
 
         # Вводим данные про все книги
+        # свойства-ссылки вводим как ссылки, если есть рецензия, то делаем вертикальное выравнивание
+        links = {properties[i]['order'] - 1: i for i in ('author_id', 'book_id', 'work_id', 'picture_url', 'review_id')}
+        review_column = properties['review_text']['order'] - 1
+        center = Alignment(vertical='center')
+        wrap = Alignment(wrapText=True, vertical='center')
+        count = 0
         for book in books:
             prepared_book = parser_xlsx.prepare_book_for_xlsx(book)
-            # print(prepared_book)
-            ws.append(list(prepared_book.values()))
-            # свойства-ссылки вводим как ссылки
-            for link_property in ('author_id', 'book_id', 'work_id', 'picture_url', 'review_id'):
-                ws.cell(ws.max_row, properties[link_property]['order']).hyperlink = prepared_book[link_property]
-                ws.cell(ws.max_row, properties[link_property]['order']).style = 'Hyperlink'
-            # если есть рецензия, то делаем вертикальное выравнивание
-            if prepared_book['review_text']:
-                # ws.row_dimensions[ws.max_row].height = 100
-                for i in range(1, 1 + len(properties)):
-                    ws.cell(ws.max_row, i).alignment = Alignment(vertical='center')
-                ws.cell(ws.max_row, properties['review_text']['order']).alignment = Alignment(wrapText=True,
-                                                                                              vertical='center')
+            row = list(prepared_book.values())
+            review = bool(prepared_book['review_text'])
+            if review:
+                row += [None] * (len(properties) - len(row))
+            for n in (range(len(row)) if review else links):
+                link = prepared_book[links[n]] if n in links else None
+                row[n] = cell(row[n], style='Hyperlink' if n in links else None, hyperlink=link,
+                              alignment=(wrap if n == review_column else center) if review else None)
+            ws.append(row)
+            count += 1
         # Сохраняем файл
         try:
             wb.save(filename)
             logging.info(
-                f'Successfully saved! Export file with {len(books)} books in xlsx for reader {login} at {filename}')
+                f'Successfully saved! Export file with {count} books in xlsx for reader {login} at {filename}')
             return filename
         except Exception as exc:
             logging.exception(f'Не удалось сохранить файл c экспортом по адресу {filename}')
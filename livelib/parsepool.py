@@ -0,0 +1,251 @@
+import argparse
+import functools
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict
+
+from .config import Config
+from .dbconnection import SQLite3Connection
+from .parser import ParserFromHTML, BookDataFormatter, BookRecord, get_html_parser
+from .prefetch import read_logins
+from .reader import Reader
+from .webconnection import WebWithCache
+
+"""
+Модуль для параллельного разбора уже полученных страниц в нескольких процессах.
+Разбор страниц нагружает процессор и в одном процессе упирается в одно ядро, поэтому ParsePool раздает
+тексты страниц процессам ProcessPoolExecutor. Между процессами передаются только тексты страниц
+и кортежи со свойствами книг, деревья документов остаются внутри процессов. Страницы из кеша передаются
+байтами: они не декодируются в строку ни при чтении из кеша, ни при передаче процессу, ни при разборе.
+
+Для перезаливки в БД книг читателей из уже заполненного кеша (например, после исправления парсера):
+    python -m livelib.parsepool logins.txt --env .env --workers 16
+В файле logins.txt - по одному логину в строке, как и для livelib.prefetch.
+"""
+
+
+def book_fields(parser_html=ParserFromHTML, formatter=BookDataFormatter) -> List[str]:
+    """
+    Возвращает порядок свойств книги в кортежах, которые возвращают процессы разбора.
+    :param parser_html: класс парсера страниц сайта
+    :type parser_html: cls
+    :param formatter: словарь с перечислением нужных свойств
+    :type formatter: BookDataFormatter
+    :return: список названий свойств
+    :rtype: List[str]
+    """
+    return [i[0] for i in parser_html.extraction_plan(formatter)] + ['month', 'year']
+
+
+def parse_books(parser_html, formatter, features: str, targeted: bool, encoding: str,
+                text: str or bytes) -> List[tuple] or bool or None:
+    """
+    Разбирает текст страницы со списком книг. Выполняется в процессах пула, поэтому принимает и возвращает
+    только то, что дешево передается между процессами.
+    :param encoding: кодировка байтов страницы
+    :type encoding: str
+    :param text: текст страницы или ее байты
+    :type text: str or bytes
+    :return: список кортежей со свойствами книг в порядке book_fields, False для 404 и капчи,
+        None при ошибке разбора
+    :rtype: List[tuple] or bool or None
+    """
+    if (targeted or isinstance(text, bytes)) and (parser_html.check_404_text(text)
+                                                  or parser_html.check_captcha_text(text)):
+        return False
+    document = parser_html.make_document(text, features, targeted, encoding)
+    if parser_html.check_404(document) or parser_html.check_captcha(document):
+        return False
+    try:
+        fields = book_fields(parser_html, formatter)
+        return [tuple(book.get(i) for i in fields) for book in parser_html.all_books_from_page(document, formatter)]
+    except Exception:
+        logging.exception('Error while parsing page with books in worker process.', exc_info=True)
+        return None
+
+
+def parse_paginator(parser_html, features: str, targeted: bool, encoding: str,
+                    text: str or bytes) -> List[int] or None:
+    """
+    Возвращает номера страниц из паджинатора первой страницы, [1] если паджинатора нет,
+    None для 404, капчи или ошибки разбора. Выполняется в процессах пула.
+    """
+    try:
+        if (targeted or isinstance(text, bytes)) and (parser_html.check_404_text(text)
+                                                      or parser_html.check_captcha_text(text)):
+            return None
+        document = parser_html.make_document(text, features, targeted, encoding)
+        if parser_html.check_404(document) or parser_html.check_captcha(document):
+            return None
+        return parser_html.get_paginator(document) or [1]
+    except Exception:
+        logging.exception('Error while parsing paginator in worker process.', exc_info=True)
+        return None
+
+
+class ParsePool:
+    """
+    Пул процессов для разбора страниц со списком книг.
+    :param parser_html: класс парсера страниц сайта
+        defaults to ParserFromHTML
+    :type parser_html: cls
+    :param workers: количество процессов, 0 - по количеству ядер, 1 - разбор в текущем процессе без пула
+        defaults to 0
+    :type workers: int
+    :param features: способ разбора BeautifulSoup
+        defaults to 'lxml'
+    :type features: str
+    :param targeted: разбирать только блоки со списком книг и паджинатором
+        defaults to False
+    :type targeted: bool
+    :param formatter: словарь с перечислением нужных свойств
+        defaults to BookDataFormatter
+    :type formatter: BookDataFormatter
+    :param chunksize: сколько страниц отдается процессу за раз
+        defaults to 1
+    :type chunksize: int
+    :param encoding: кодировка страниц, переданных байтами
+        defaults to 'utf-8'
+    :type encoding: str
+    """
+
+    def __init__(self, parser_html=ParserFromHTML, workers: int = 0, features: str = 'lxml', targeted: bool = False,
+                 formatter=BookDataFormatter, chunksize: int = 1, encoding: str = 'utf-8'):
+        self.parser_html = parser_html
+        self.workers = workers or os.cpu_count() or 1
+        self.features = features
+        self.targeted = targeted
+        self.formatter = formatter
+        self.chunksize = chunksize
+        self.encoding = encoding
+        self.fields = book_fields(parser_html, formatter)
+        self.executor = ProcessPoolExecutor(max_workers=self.workers) if self.workers > 1 else None
+
+    @classmethod
+    def from_config(cls, config: Config, workers: int = None) -> 'ParsePool':
+        """
+        Создает пул по настройкам Config.bs_parser.
+        :param workers: количество процессов, по умолчанию Config.bs_parser.workers
+        :type workers: int
+        """
+        return cls(parser_html=get_html_parser(config),
+                   workers=config.bs_parser.workers if workers is None else workers,
+                   features=config.bs_parser.features, targeted=config.bs_parser.targeted, encoding=config.encoding)
+
+    def parse_texts(self, texts: List[str or bytes or None]) -> List[List[BookRecord] or bool or None]:
+        """
+        Разбирает тексты страниц и возвращает книги с каждой из них в том же порядке, что и тексты,
+        поэтому месяц и год прочтения у книг те же, что и при разборе страниц по одной.
+        Свойства, которые парсер не смог вынуть, в записях книг равны None.
+        :param texts: тексты или байты страниц, None для неполученных страниц
+        :type texts: List[str or bytes or None]
+        :return: для каждой страницы список записей BookRecord, False для неполученной страницы, 404 и капчи,
+            None при ошибке разбора
+        :rtype: List[List[BookRecord] or bool or None]
+        """
+        function = functools.partial(parse_books, self.parser_html, self.formatter, self.features, self.targeted,
+                                     self.encoding)
+        record = self.formatter.record()
+        return [[record.from_row(self.fields, row) for row in rows] if rows else rows
+                for rows in self._map(function, texts, missing=False)]
+
+    def parse_paginators(self, texts: List[str or bytes or None]) -> List[List[int] or None]:
+        """
+        Возвращает номера страниц из паджинатора для каждого текста в том же порядке.
+        :param texts: тексты или байты первых страниц со списком книг, None для неполученных страниц
+        :type texts: List[str or bytes or None]
+        :return: для каждой страницы список номеров, None для неполученной страницы или ошибки
+        :rtype: List[List[int] or None]
+        """
+        function = functools.partial(parse_paginator, self.parser_html, self.features, self.targeted, self.encoding)
+        return self._map(function, texts, missing=None)
+
+    def _map(self, function, texts: List[str or bytes or None], missing) -> list:
+        """
+        Применяет function к текстам в процессах пула и возвращает результаты в порядке текстов,
+        на месте неполученных страниц (None) - missing, такие страницы процессам не передаются.
+        """
+        numbers = [n for n, text in enumerate(texts) if text is not None]
+        if self.executor is not None:
+            pages = self.executor.map(function, [texts[n] for n in numbers], chunksize=self.chunksize)
+        else:
+            pages = map(function, [texts[n] for n in numbers])
+        result = [missing] * len(texts)
+        for n, page in zip(numbers, pages):
+            result[n] = page
+        return result
+
+    def close(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def __enter__(self) -> 'ParsePool':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+
+def reparse_readers(logins: List[str], config: Config, workers: int = None, batch_size: int = 64) -> Dict[str, int]:
+    """
+    Заново заполняет в БД прочитанные книги читателей из страниц в кеше.
+    Читатели обрабатываются пачками: паджинаторы первых страниц и затем все страницы пачки разбираются в пуле разом,
+    так что процессы заняты и на читателях с одной-двумя страницами.
+    :param logins: логины читателей
+    :type logins: List[str]
+    :param config: конфигурация
+    :type config: Config
+    :param workers: количество процессов, по умолчанию Config.bs_parser.workers
+    :type workers: int
+    :param batch_size: сколько читателей разбирается за раз
+    :type batch_size: int
+    :return: {логин: количество сохраненных книг}, для читателей без первой страницы -1
+    :rtype: Dict[str, int]
+    """
+    result = {}
+    web_connection = WebWithCache(config, random_sleep=True)
+    db_connection = SQLite3Connection(config, create_if_not_exist=True)
+    with ParsePool.from_config(config, workers) as pool:
+        for start in range(0, len(logins), batch_size):
+            readers = [Reader(login, web_connection, db_connection, export=None, parser_html=pool.parser_html)
+                       for login in logins[start:start + batch_size]]
+            # страницы из кеша передаются процессам байтами, без декодирования в строку
+            first_pages = web_connection.get_pages_bytes([i.all_books_page for i in readers])
+            urls = []
+            for reader, page_numbers in zip(readers, pool.parse_paginators(first_pages)):
+                if page_numbers is None:
+                    logging.warning(f'First page of reader {reader.login} is not found, reader is skipped.')
+                    result[reader.login] = -1
+                    urls.append([])
+                else:
+                    urls.append([pool.parser_html.reader_read_books_page_by_number(reader.login, i)
+                                 for i in page_numbers])
+            pages = pool.parse_texts(web_connection.get_pages_bytes([url for i in urls for url in i]))
+            position = 0
+            for reader, reader_urls in zip(readers, urls):
+                if not reader_urls:
+                    continue
+                reader.register()
+                reader.delete_read_books()
+                books = reader.save_parsed_pages(reader_urls, pages[position:position + len(reader_urls)])
+                position += len(reader_urls)
+                result[reader.login] = len(books)
+                print(f'Читатель {reader.login}: {len(books)} книг')
+    web_connection.close()
+    db_connection.close()
+    return result
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Перезаливка книг читателей в БД из кеша страниц.')
+    arg_parser.add_argument('logins', help='файл с логинами читателей, по одному в строке')
+    arg_parser.add_argument('--env', default='.env', help='файл конфигурации')
+    arg_parser.add_argument('--workers', type=int, default=None,
+                            help='количество процессов разбора, по умолчанию HTML_PARSE_WORKERS, 0 - по числу ядер')
+    arg_parser.add_argument('--batch', type=int, default=64, help='сколько читателей разбирается за раз')
+    args = arg_parser.parse_args()
+    result = reparse_readers(read_logins(args.logins), Config(args.env), args.workers, args.batch)
+    print('Готово читателей:', len([i for i in result.values() if i >= 0]),
+          ', без первой страницы:', len([i for i in result.values() if i < 0]))
@@ -1,10 +1,14 @@
+import collections.abc
 import logging
 import os
 import re
 
 import bs4
 from bs4 import BeautifulSoup as bs
+import lxml.etree
+import lxml.html
 import typing
+from types import MappingProxyType
 from typing import List, Dict
 from datetime import datetime
 
@@ -34,6 +38,7 @@ class BookDataFormatter(DataFormatter):
                     },
             'xlsx': {   'name': 'Название_колонки_в_xlsx',
                         'method': 'метод_для_форматирования_значения_для_xlsx',
+                        'source': 'свойство_с_уже_отформатированным_значением (необязательно)',
                         'order': 'порядок следования в таблице в формате integer'
                     }
            },
@@ -43,6 +48,12 @@ class BookDataFormatter(DataFormatter):
           поэтому его parser не задан. Они будут вынуты в методе ParserFromHTML.all_books_from_page()
 
           На ЛЛ есть книги со ссылкой вида /book/book_id и произведения со ссылкой вида /work/work_id.
+
+          Свойство review_plain (текст рецензии без разметки) тоже не вынимается из html, а вычисляется
+          из review_text при сохранении книг в БД, см. ParserForDB.create_review_plain().
+
+          Свойство position (место книги в списке прочитанных читателем, как на сайте) задает
+          SQLite3Connection.ingest_read_books() при сохранении, книги читателя выгружаются в его порядке.
     """
 
     common = {
@@ -99,12 +110,19 @@ class BookDataFormatter(DataFormatter):
         'review_text': {'parser': 'get_review_text',
                         'db': {'name': 'review_text', 'type': 'TEXT'},
                         'csv': {'name': 'Рецензия', 'method': 'create_review_text'},
-                        'xlsx': {'name': 'Рецензия', 'method': 'create_review_text', 'order':4, 'column_width':100}
+                        'xlsx': {'name': 'Рецензия', 'method': 'create_review_text', 'source': 'review_plain',
+                                 'order':4, 'column_width':100}
                         },
+        'review_plain': {'parser': 'not_implemented',
+                         'db': {'name': 'review_plain', 'type': 'TEXT'},
+                         },
         'date': {'parser': 'not_implemented',
                  'csv': {'name': 'Дата прочтения', },
                  'xlsx': {'name': 'Дата прочтения', 'order':6, 'column_width':15}
                  },
+        'position': {'parser': 'not_implemented',
+                     'db': {'name': 'position', 'type': 'INTEGER'},
+                     },
         'month': {'parser': 'not_implemented',
                   'db': {'name': 'month', 'type': 'INTEGER'},
                   },
@@ -120,60 +138,199 @@ class BookDataFormatter(DataFormatter):
         'update_time': {'parser': 'not_implemented',
                         'db': {'name': 'update_time', 'type': 'TEXT'},
                         },
+        'full_update_time': {'parser': 'not_implemented',
+                             'db': {'name': 'full_update_time', 'type': 'TEXT'},
+                             },
     }
 
     book_properties_db = ['book_id', 'work_id', 'book_name', 'author_name', 'author_id', 'common_rating', 'picture_url']
-    reader_properties_db = ['livelib_id', 'login', 'update_time']
-    readbook_properties_db = ['review_text', 'review_id', 'tags', 'reader_rating', 'month', 'year']
+    reader_properties_db = ['livelib_id', 'login', 'update_time', 'full_update_time']
+    readbook_properties_db = ['review_text', 'review_id', 'tags', 'reader_rating', 'month', 'year', 'review_plain',
+                              'position']
+
+    # уже построенные представления таблицы common: {(formatter, ключ): (common, представление)}
+    _compiled = {}
+
+    @classmethod
+    def compiled(cls, key: typing.Hashable, build: typing.Callable[[], typing.Any]) -> typing.Any:
+        """
+        Возвращает представление таблицы common, построенное функцией build один раз для formatter и key.
+        Представление строится заново, только если у formatter сменилась таблица common.
+        Если таблицу изменили на месте, кеш нужно сбросить методом invalidate().
+        :param key: ключ представления
+        :type key: typing.Hashable
+        :param build: функция без параметров, строящая представление
+        :type build: typing.Callable
+        :return: представление, его нельзя изменять
+        :rtype: typing.Any
+        """
+        entry = BookDataFormatter._compiled.get((cls, key))
+        if entry is None or entry[0] is not cls.common:
+            entry = (cls.common, build())
+            BookDataFormatter._compiled[(cls, key)] = entry
+        return entry[1]
+
+    @classmethod
+    def invalidate(cls) -> None:
+        """
+        Сбрасывает все построенные представления formatter, например после изменения таблицы common на месте.
+        """
+        for key in [i for i in BookDataFormatter._compiled if i[0] is cls]:
+            del BookDataFormatter._compiled[key]
 
     @classmethod
-    def all_properties_parser(cls):
+    def record(cls) -> type:
+        """
+        Возвращает класс записи книги BookRecord со слотами под все свойства из таблицы common.
+        Класс создается один раз для каждого formatter, дальше он берется из кеша.
+        :return: наследник BookRecord
+        :rtype: type
+        """
+        def build():
+            fields = tuple(cls.common)
+            return type(cls.__name__ + 'Record', (BookRecord,),
+                        {'__slots__': fields, 'fields': fields, '_field_set': frozenset(fields),
+                         'formatter': cls, '__module__': __name__})
+        return cls.compiled('record', build)
+
+    @classmethod
+    def all_properties_parser(cls) -> typing.Mapping[str, str]:
         """
         Преобразует таблицу в удобный для ParserFromHTML словарь.
+        Словарь строится один раз и доступен только для чтения.
         :return: словарь вида {название_поля1: метод_обработки_поля1, название_поля2: метод_обработки_поля2, }
-        :rtype: Dict
+        :rtype: typing.Mapping
         """
-        return {i: j['parser'] for i, j in cls.common.items()}
+        return cls.compiled('parser', lambda: MappingProxyType({i: j['parser'] for i, j in cls.common.items()}))
 
     @classmethod
-    def all_properties_db(cls):
+    def all_properties_db(cls) -> typing.Mapping[str, str]:
         """
         Преобразует таблицу в удобный для DBConnection словарь.
+        Словарь строится один раз и доступен только для чтения.
         :return: словарь вида {'название_поля1':'тип_поля1', 'название_поля2':'тип_поля1', ...}
-        :rtype: Dict
+        :rtype: typing.Mapping
         """
-        result = {}
-        for i in cls.common.values():
-            if i.get('db'):
-                result[i['db']['name']] = i['db']['type']
-        return result
+        def build():
+            result = {}
+            for i in cls.common.values():
+                if i.get('db'):
+                    result[i['db']['name']] = i['db']['type']
+            return MappingProxyType(result)
+        return cls.compiled('db', build)
 
     @classmethod
-    def all_properties_csv(cls):
+    def all_properties_csv(cls) -> typing.Mapping[str, typing.Mapping]:
         """
-        Преобразует таблицу в удобный для CSVConnection словарь
+        Преобразует таблицу в удобный для CSVConnection словарь.
+        Словарь строится один раз и доступен только для чтения.
         :return: словарь вида {'author_id': {'name': 'Cсылка на автора', 'method': 'create_author_link'}, {}, ...}
-        :rtype: Dict
+        :rtype: typing.Mapping
         """
-        result = {}
-        for i, j in cls.common.items():
-            if j.get('csv'):
-                result[i] = j['csv']
-        return result
+        return cls.compiled('csv', lambda: MappingProxyType(
+            {i: MappingProxyType(j['csv']) for i, j in cls.common.items() if j.get('csv')}))
 
     @classmethod
-    def all_properties_xlsx(cls):
+    def all_properties_xlsx(cls) -> typing.Mapping[str, typing.Mapping]:
         """
-        Преобразует таблицу в удобный для XLSXConnection словарь, упорядоченный по заданному порядку
+        Преобразует таблицу в удобный для XLSXConnection словарь, упорядоченный по заданному порядку.
+        Словарь строится и сортируется один раз и доступен только для чтения.
         :return: Словарь вида {'author_id': {'name': 'Cсылка на автора', 'method': 'create_author_link'}, {}, ...}
-        :rtype: Dict
+        :rtype: typing.Mapping
+        """
+        def build():
+            result = {i: j['xlsx'] for i, j in cls.common.items() if j.get('xlsx')}
+            return MappingProxyType({i: MappingProxyType(j) for i, j in
+                                     sorted(result.items(), key=lambda x: x[1]['order'])})
+        return cls.compiled('xlsx', build)
+
+    @classmethod
+    def db_columns(cls, properties: typing.Sequence[str]) -> typing.Tuple[str, ...]:
+        """
+        Возвращает определения колонок для CREATE TABLE вида 'название тип' для заданных свойств.
+        :param properties: названия свойств, например book_properties_db
+        :type properties: typing.Sequence[str]
+        :rtype: typing.Tuple[str, ...]
+        """
+        properties = tuple(properties)
+        return cls.compiled(('db_columns', properties),
+                            lambda: tuple(f'{i} {cls.all_properties_db()[i]}' for i in properties))
+
+
+class BookRecord(collections.abc.MutableMapping):
+    """
+    Запись о книге: вместо словаря на каждую книгу - объект со слотами под свойства из BookDataFormatter.common,
+    он занимает в несколько раз меньше памяти. Классы записей создаются методом BookDataFormatter.record().
+    Запись ведет себя как словарь: book['book_id'], book.get('tags'), items(), сравнение со словарем.
+    Ключи записи - только заданные свойства, незаданное свойство, как и отсутствующий в словаре ключ, дает KeyError.
+    Свойства, которых нет в таблице formatter, в запись добавить нельзя.
+    """
+    __slots__ = ()
+    fields: typing.Tuple[str, ...] = ()
+    _field_set: typing.FrozenSet[str] = frozenset()
+    formatter = None
+
+    def __init__(self, values: typing.Mapping or typing.Iterable = (), **kwargs):
+        for key, value in (values.items() if isinstance(values, collections.abc.Mapping) else values):
+            self[key] = value
+        for key, value in kwargs.items():
+            self[key] = value
+
+    @classmethod
+    def from_row(cls, fields: typing.Sequence[str], row: typing.Sequence) -> 'BookRecord':
+        """
+        Создает запись из строки значений в порядке fields без промежуточного словаря.
         """
-        result = {}
-        for i, j in cls.common.items():
-            if j.get('xlsx'):
-                result[i] = j['xlsx']
-        sorted_result ={i[0]:i[1] for i in sorted(result.items(), key=lambda x: x[1]['order'])}
-        return sorted_result
+        result = cls.__new__(cls)
+        for key, value in zip(fields, row):
+            setattr(result, key, value)
+        return result
+
+    def __getitem__(self, key: str):
+        if key not in self._field_set:
+            raise KeyError(key)
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __setitem__(self, key: str, value) -> None:
+        if key not in self._field_set:
+            raise KeyError(f'{key} is not a property of {type(self).__name__}')
+        setattr(self, key, value)
+
+    def __delitem__(self, key: str) -> None:
+        if key not in self._field_set:
+            raise KeyError(key)
+        try:
+            delattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __iter__(self) -> typing.Iterator[str]:
+        for key in self.fields:
+            if hasattr(self, key):
+                yield key
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({self.to_dict()!r})'
+
+    def __reduce__(self):
+        # сгенерированные классы записей не видны в модуле по имени, поэтому запись собирается заново через formatter
+        return _restore_record, (self.formatter, self.to_dict())
+
+    def to_dict(self) -> Dict:
+        """
+        Возвращает заданные свойства записи в виде обычного словаря, например для сохранения в json.
+        """
+        return {key: getattr(self, key) for key in self}
+
+
+def _restore_record(formatter, values: Dict) -> BookRecord:
+    return formatter.record()(values)
 
 
 class Parser:
@@ -191,6 +348,65 @@ class ParserFromHTML(Parser):
     """
     Класс парсинга страниц сайта. Здесь задаются адресация страниц сайта и поиск данных в его верстке.
     """
+    # id блоков страницы со списком книг, которые нужны парсеру; при частичном разборе строятся только они
+    targeted_regions = ['booklist', 'booklist-pagination']
+    # регулярные выражения компилируются один раз, а не при каждом вызове методов парсера
+    author_id = re.compile(r'(?<=/author/)\d+(?=-)')
+    book_id = re.compile(r'(?<=/book/)\d+(?=-)')
+    work_id = re.compile(r'(?<=/work/)\d+(?=-)')
+    review_id = re.compile(r'(?<=review-)\d+(?=-full)')
+    more_tags = re.compile(r'^Ещё \d+')
+    page_number = re.compile(r'(?<=~)\d+')
+    # признаки 404 и капчи для проверки страницы до построения дерева, для текста и для байтов страницы
+    title_404 = re.compile(r'<title[^>]*>404 @ LiveLib</title>')
+    title_404_bytes = re.compile(title_404.pattern.encode())
+    captcha_marker = 'Please confirm that you and not a robot are sending requests'
+    captcha_marker_bytes = captcha_marker.encode()
+    # узлы блока книги, из которых вынимаются ее свойства: название узла -> (тег, класс);
+    # блок рецензии 'review' ищется по id, поэтому здесь его нет
+    book_nodes = {'author': ('a', 'brow-book-author'), 'book_name': ('a', 'brow-book-name'),
+                  'ratings': ('div', 'brow-ratings'), 'cover': ('div', 'cover-wrapper'), 'tags': ('div', 'brow-tags')}
+    _book_nodes_by_class = {tag_class: node for node, tag_class in book_nodes.items()}
+    # методы парсера, которые при разборе книги заменяются функцией от уже найденного узла:
+    # метод -> (название узла, функция)
+    node_getters = {'get_author_name': ('author', '_link_name'), 'get_author_id': ('author', '_author_id'),
+                    'get_book_name': ('book_name', '_link_name'), 'get_book_id': ('book_name', '_book_id'),
+                    'get_work_id': ('book_name', '_work_id'), 'get_common_rating': ('ratings', '_common_rating'),
+                    'get_reader_rating': ('ratings', '_reader_rating'), 'get_picture_url': ('cover', '_picture_url'),
+                    'get_tags': ('tags', '_tags'), 'get_review_id': ('review', '_review_id'),
+                    'get_review_text': ('review', '_review_text')}
+
+    @staticmethod
+    def make_document(text: str or bytes, features: str = 'lxml', targeted: bool = False,
+                      encoding: str = None) -> bs4.BeautifulSoup:
+        """
+        Строит из текста страницы документ, с которым работают остальные методы парсера.
+        При частичном разборе дерево строится только для блоков targeted_regions (список книг и паджинатор),
+        заголовок, скрипты, боковые колонки и подвал страницы пропускаются. В таком документе
+        check_404 и check_captcha ничего не находят, страницу нужно заранее проверить check_404_text
+        и check_captcha_text.
+        Страница может быть передана байтами: при известной кодировке они декодируются одним вызовом,
+        так как из строки BeautifulSoup строит дерево быстрее, чем из байтов с определением кодировки.
+        :param text: текст страницы или ее байты
+        :type text: str or bytes
+        :param features: способ парсинга BeautifulSoup
+            defaults to 'lxml'
+        :type features: str
+        :param targeted: разбирать ли только блоки targeted_regions
+            defaults to False
+        :type targeted: bool
+        :param encoding: кодировка байтов страницы, для текста не используется
+            defaults to None, тогда кодировка определяется BeautifulSoup
+        :type encoding: str
+        :return: объект BeautifulSoup
+        :rtype: bs4.BeautifulSoup
+        """
+        if encoding and isinstance(text, bytes):
+            text = text.decode(encoding)
+        if targeted:
+            return bs4.BeautifulSoup(text, features=features,
+                                     parse_only=bs4.SoupStrainer(id=ParserFromHTML.targeted_regions))
+        return bs4.BeautifulSoup(text, features=features)
 
     @staticmethod
     def reader_prefix(login: str) -> str:
@@ -256,18 +472,65 @@ class ParserFromHTML(Parser):
             return False
 
     @staticmethod
-    def all_books_from_page(bsoup: bs4.BeautifulSoup, formatter: BookDataFormatter = BookDataFormatter) -> List[Dict]:
+    def check_404_text(text: str or bytes) -> bool:
+        """
+        Быстрая проверка на штатные 404 по заголовку в тексте страницы, без построения дерева BeautifulSoup.
+        :param text: текст страницы или ее байты
+        :type text:  str or bytes
+        :return: True, если 404, False иначе
+        :rtype: Boolean
         """
-        Возвращает ифнормацию о всех книгах на данной странице в виде списка словарей.
-        Словарь формируется с ключами из BookDataFormatter, соответствующие значения вычисляются
+        if isinstance(text, str):
+            return ParserFromHTML.title_404.search(text) is not None
+        return ParserFromHTML.title_404_bytes.search(text) is not None
+
+    @staticmethod
+    def check_captcha_text(text: str or bytes) -> bool:
+        """
+        Быстрая проверка на капчу по тексту страницы, без построения дерева BeautifulSoup.
+        :param text: текст страницы или ее байты
+        :type text:  str or bytes
+        :return: True, если капча, False иначе
+        :rtype: Boolean
+        """
+        if isinstance(text, str):
+            return ParserFromHTML.captcha_marker in text
+        return ParserFromHTML.captcha_marker_bytes in text
+
+    @staticmethod
+    def _parse_read_date(date: str) -> typing.Tuple[int or None, int or None]:
+        """
+        Возвращает месяц и год прочтения из заголовка вида 'Месяц Год' в списке книг.
+        :param date: текст заголовка
+        :type date: str
+        :return: номер месяца и год, None на месте отсутствующих
+        :rtype: Tuple[int or None, int or None]
+        """
+        # вытащим месяц (если он есть, для старых книг его может не быть), переведем его в цифру
+        month = re.search(r'\D+(?= )', date)
+        if month != None:
+            month = month.group()
+            month_numbers = {'январь': 1, 'февраль': 2, 'март': 3, 'апрель': 4, 'май': 5, 'июнь': 6,
+                             'июль': 7, 'август': 8, 'сентябрь': 9, 'октябрь': 10, 'ноябрь': 11, 'декабрь': 12}
+            month = month_numbers.get(month.lower(), None)
+        # вытащим год
+        year = re.search(r'\d+', date)
+        if year != None: year = int(year.group())
+        return month, year
+
+    @classmethod
+    def all_books_from_page(cls, bsoup: bs4.BeautifulSoup, formatter: BookDataFormatter = BookDataFormatter) -> List[BookRecord]:
+        """
+        Возвращает ифнормацию о всех книгах на данной странице в виде списка записей BookRecord.
+        Запись формируется с ключами из BookDataFormatter, соответствующие значения вычисляются
         с помощью функций, указанных там же.
         Исключение - месяц и год прочтения книги формируются в этом методе, это обусловлено версткой.
         :param bsoup: код страницы
         :type bsoup: bs4.BeautifulSoup
         :param formatter:  словарь с перечислением нужных свойств
         :type formatter: BookDataFormatter
-        :return: список словарей по каждой книге вида {'property_name': 'property_value'}
-        :rtype: List[Dict]
+        :return: список записей по каждой книге вида {'property_name': 'property_value'}
+        :rtype: List[BookRecord]
         """
         # в коде страницы внутри блока <div id='booklist'></div>
         # чередуются блоки <div class='brow-h2'>Месяц Год</div> и <div class='book-item-manage'>КНИГА</div>
@@ -278,96 +541,202 @@ class ParserFromHTML(Parser):
         for block in bsoup.find('div', id='booklist').children:
             # если это блок с месяцем и годом, запоминаем его для добавления в информацию по последующим книгам
             if 'brow-h2' in block['class']:
-                date = block.text
-                # вытащим месяц (если он есть, для старых книг его может не быть), переведем его в цифру
-                month = re.search(r'\D+(?= )', date)
-                if month != None:
-                    month = month.group()
-                    month_numbers = {'январь': 1, 'февраль': 2, 'март': 3, 'апрель': 4, 'май': 5, 'июнь': 6,
-                                     'июль': 7, 'август': 8, 'сентябрь': 9, 'октябрь': 10, 'ноябрь': 11, 'декабрь': 12}
-                    month = month_numbers.get(month.lower(), None)
-                # вытащим год
-                year = re.search(r'\d+', date)
-                if year != None: year = int(year.group())
+                month, year = cls._parse_read_date(block.text)
             # если это блок с книгой, парсим ее как книгу и вносим месяц и год прочтения в результат
             elif 'book-item-manage' in block['class']:
-                book = ParserFromHTML.book(block, formatter)
+                book = cls.book(block, formatter)
                 book['month'] = month
                 book['year'] = year
                 result.append(book)
         return result
 
-    @staticmethod
-    def book(bsoup: bs4.BeautifulSoup, formatter: BookDataFormatter = BookDataFormatter) -> Dict[str, str]:
+    @classmethod
+    def extraction_plan(cls, formatter: BookDataFormatter = BookDataFormatter) -> typing.Tuple[tuple, ...]:
+        """
+        Возвращает план разбора блока книги - список кортежей (свойство, метод парсера, узел, функция).
+        Для стандартных методов парсера функция получает узел блока, заранее найденный в _find_book_nodes,
+        для методов, переопределенных в наследниках, узел равен None, и функция получает весь блок.
+        Свойства, для которых у парсера нет метода, в план не попадают.
+        План строится один раз для пары класса парсера и formatter, дальше он берется из кеша formatter.
+        :param formatter: словарь с перечислением нужных свойств
+        :type formatter: BookDataFormatter
+        :return: кортеж кортежей (property_name, parser_function, node, function)
+        :rtype: typing.Tuple[tuple, ...]
+        """
+        def build():
+            plan = []
+            for property_name, parser_function in formatter.all_properties_parser().items():
+                if not hasattr(cls, parser_function):
+                    continue
+                # узел берется из общего прохода, только если метод не переопределен в наследнике
+                owner = next(i for i in cls.__mro__ if parser_function in i.__dict__)
+                if parser_function in cls.node_getters and owner is ParserFromHTML:
+                    node, function = cls.node_getters[parser_function]
+                    plan.append((property_name, parser_function, node, getattr(cls, function)))
+                else:
+                    plan.append((property_name, parser_function, None, getattr(cls, parser_function)))
+            return tuple(plan)
+        return formatter.compiled(('extraction_plan', cls), build)
+
+    @classmethod
+    def book(cls, bsoup: bs4.BeautifulSoup, formatter: BookDataFormatter = BookDataFormatter) -> BookRecord:
         """
-        Возвращает словарь с информацией о книге, представленной в заданном коде.
-        Словарь формируется с ключами из BookDataFormatter, соответствующие значения вычисляются
+        Возвращает запись BookRecord (ведет себя как словарь) с информацией о книге, представленной в заданном коде.
+        Запись формируется с ключами из BookDataFormatter, соответствующие значения вычисляются
         с помощью функций, указанных там же.
+        Узлы, из которых вынимаются свойства, ищутся за один проход по блоку книги, см. extraction_plan.
         Исключение - месяц и год прочтения книги формируются в методе all_books_from_page, это обусловлено версткой.
         :param bsoup: код с информацией о книге
         :type bsoup: bs4.BeautifulSoup
         :param formatter: словарь с перечислением нужных свойств
         :type formatter: BookDataFormatter
-        :return: словарь типа {'property_name': 'property_value'}
-        :rtype: Dict[str,str]
+        :return: запись типа {'property_name': 'property_value'}
+        :rtype: BookRecord
         """
-        result = {}
-        for property_name, parser_function in formatter.all_properties_parser().items():
+        nodes = cls._find_book_nodes(bsoup)
+        result = formatter.record()()
+        for property_name, parser_function, node, function in cls.extraction_plan(formatter):
             try:
-                if hasattr(ParserFromHTML, parser_function):
-                    result[property_name] = getattr(ParserFromHTML, parser_function)(bsoup)
+                setattr(result, property_name, function(nodes[node]) if node else function(bsoup))
             except AttributeError:
                 logging.exception(f'No parser function {parser_function} is found!', exc_info=True)
         return result
 
+    @classmethod
+    def _find_book_node(cls, bsoup: bs4.BeautifulSoup, node: str) -> bs4.Tag or None:
+        """
+        Возвращает первый узел блока книги с заданным названием из book_nodes либо 'review', None если его нет.
+        """
+        if node == 'review':
+            return bsoup.find(id=cls.review_id)
+        name, class_name = cls.book_nodes[node]
+        return bsoup.find(name, class_=class_name)
+
+    @classmethod
+    def _find_book_nodes(cls, bsoup: bs4.BeautifulSoup) -> Dict[str, bs4.Tag or None]:
+        """
+        Находит за один проход по блоку книги все узлы из book_nodes и блок рецензии 'review'.
+        Результат тот же, что у _find_book_node для каждого узла по отдельности.
+        """
+        nodes = dict.fromkeys(cls.book_nodes, None)
+        nodes['review'] = None
+        for tag in bsoup.find_all(True):
+            for class_name in tag.get('class') or ():
+                node = cls._book_nodes_by_class.get((tag.name, class_name))
+                if node and nodes[node] is None:
+                    nodes[node] = tag
+            if nodes['review'] is None and 'id' in tag.attrs and cls.review_id.search(tag['id']):
+                nodes['review'] = tag
+        return nodes
+
     @staticmethod
-    def get_author_name(bsoup: bs4.BeautifulSoup) -> str:
-        result = bsoup.find('a', class_='brow-book-author')
-        if result and bool(result.text):
-            return ParserFromHTML._clear_name(result.text)
-        else:
-            return None
+    def _node_text(node: bs4.Tag) -> str:
+        return node.text
+
+    @classmethod
+    def _link_name(cls, link: bs4.Tag or None) -> str:
+        text = cls._node_text(link) if link is not None else None
+        return cls._clear_name(text) if text else None
 
     @staticmethod
-    def get_author_id(bsoup: bs4.BeautifulSoup) -> str:
-        author_id = re.compile(r'(?<=/author/)\d+(?=-)')
-        link = bsoup.find('a', class_='brow-book-author')
-        if link:
-            result = re.search(author_id, link.get('href'))
+    def _id_from_link(link: bs4.Tag or None, pattern: re.Pattern) -> int or None:
+        if link is not None:
+            result = re.search(pattern, link.get('href'))
             return int(result.group()) if result else None
         else:
             return None
 
-    @staticmethod
-    def get_book_name(bsoup: bs4.BeautifulSoup) -> str:
-        result = bsoup.find('a', class_='brow-book-name')
+    @classmethod
+    def _author_id(cls, link: bs4.Tag or None) -> int or None:
+        return cls._id_from_link(link, cls.author_id)
+
+    @classmethod
+    def _book_id(cls, link: bs4.Tag or None) -> int or None:
+        return cls._id_from_link(link, cls.book_id)
+
+    @classmethod
+    def _work_id(cls, link: bs4.Tag or None) -> int or None:
+        return cls._id_from_link(link, cls.work_id)
+
+    @classmethod
+    def _rating(cls, ratings: bs4.Tag or None, number: int) -> float or None:
+        # если блока с оценками нет, падаем с AttributeError
+        result = ratings.find_all('span', class_='rating-book')[number]
         if result and bool(result.text):
-            return Parser._clear_name(result.text)
+            return float(result.text)
         else:
             return None
 
-    @staticmethod
-    def get_book_id(bsoup: bs4.BeautifulSoup) -> str:
-        book_id = re.compile(r'(?<=/book/)\d+(?=-)')
-        link = bsoup.find('a', class_='brow-book-name')
-        if link:
-            result = re.search(book_id, link.get('href'))
-            return int(result.group()) if result else None
-        else:
-            return None
+    @classmethod
+    def _common_rating(cls, ratings: bs4.Tag or None) -> float or None:
+        return cls._rating(ratings, 1)
 
-    @staticmethod
-    def get_work_id(bsoup: bs4.BeautifulSoup) -> str:
-        book_id = re.compile(r'(?<=/work/)\d+(?=-)')
-        link = bsoup.find('a', class_='brow-book-name')
-        if link:
-            result = re.search(book_id, link.get('href'))
-            return int(result.group()) if result else None
+    @classmethod
+    def _reader_rating(cls, ratings: bs4.Tag or None) -> float or None:
+        return cls._rating(ratings, 0)
+
+    @classmethod
+    def _picture_url(cls, cover: bs4.Tag or None) -> str or None:
+        img = cover.find('img')
+        result = img.get('data-pagespeed-lazy-src')
+        if result:
+            return result
         else:
-            return None
+            result = img.get('src')
+            return result if result else None
 
-    @staticmethod
-    def get_common_rating(bsoup: bs4.BeautifulSoup) -> float:
+    @classmethod
+    def _tags(cls, tags: bs4.Tag or None) -> str:
+        result = []
+        if tags != None:
+            # необходимо проверить, не является ли тег ссылкой на расширенный список тегов (вида 'Еще NN тегов')
+            # Если он - ссылка, то пропускаем его.
+            # даже если теги скрыты, мы все равно их вытащим из кода страницы.
+            for i in tags.find_all('a', class_='label-tag'):
+                if re.match(cls.more_tags, i.text) == None:
+                    result.append(i.text)
+        return ';'.join(result)
+
+    @classmethod
+    def _review_id(cls, div: bs4.Tag or None) -> int or None:
+        if div is not None:
+            return int(re.search(cls.review_id, div.get('id')).group())
+        return None
+
+    @classmethod
+    def _review_text(cls, div: bs4.Tag or None) -> str or None:
+        result = None
+        if div != None:
+            # сохраняем текст рецензии
+            body = ''.join([str(p) for p in div.find('div', itemprop='reviewBody').contents])
+            # ищем и сохраняем
+            events = div.find('div', class_='event-pad')
+            extra = ''.join([str(p) for p in events.contents]) if events != None else ''
+            result = body + extra
+        return result
+
+    @classmethod
+    def get_author_name(cls, bsoup: bs4.BeautifulSoup) -> str:
+        return cls._link_name(cls._find_book_node(bsoup, 'author'))
+
+    @classmethod
+    def get_author_id(cls, bsoup: bs4.BeautifulSoup) -> int:
+        return cls._author_id(cls._find_book_node(bsoup, 'author'))
+
+    @classmethod
+    def get_book_name(cls, bsoup: bs4.BeautifulSoup) -> str:
+        return cls._link_name(cls._find_book_node(bsoup, 'book_name'))
+
+    @classmethod
+    def get_book_id(cls, bsoup: bs4.BeautifulSoup) -> int:
+        return cls._book_id(cls._find_book_node(bsoup, 'book_name'))
+
+    @classmethod
+    def get_work_id(cls, bsoup: bs4.BeautifulSoup) -> int:
+        return cls._work_id(cls._find_book_node(bsoup, 'book_name'))
+
+    @classmethod
+    def get_common_rating(cls, bsoup: bs4.BeautifulSoup) -> float:
         """
         Возвращает общую оценку книги.
         :param bsoup: код, вмещающий информацию о книге
@@ -375,14 +744,10 @@ class ParserFromHTML(Parser):
         :return: число
         :rtype: float
         """
-        result = bsoup.find('div', class_='brow-ratings').find_all('span', class_='rating-book')[1]
-        if result and bool(result.text):
-            return float(result.text)
-        else:
-            return None
+        return cls._common_rating(cls._find_book_node(bsoup, 'ratings'))
 
-    @staticmethod
-    def get_picture_url(bsoup: bs4.BeautifulSoup) -> str:
+    @classmethod
+    def get_picture_url(cls, bsoup: bs4.BeautifulSoup) -> str:
         """
         Возвращает ссылку на картинку с обложкой книги.
         :param bsoup: код, вмещающий информацию о книге
@@ -390,15 +755,10 @@ class ParserFromHTML(Parser):
         :return: абсолютную ссылку
         :rtype: str
         """
-        result = bsoup.find('div', class_='cover-wrapper').find('img').get('data-pagespeed-lazy-src')
-        if result:
-            return result
-        else:
-            result = bsoup.find('div', class_='cover-wrapper').find('img').get('src')
-            return result if result else None
+        return cls._picture_url(cls._find_book_node(bsoup, 'cover'))
 
-    @staticmethod
-    def get_reader_rating(bsoup: bs4.BeautifulSoup) -> float:
+    @classmethod
+    def get_reader_rating(cls, bsoup: bs4.BeautifulSoup) -> float:
         """
         Возвращает оценку книги читателем.
         :param bsoup: код, вмещающий информацию о книге
@@ -406,48 +766,19 @@ class ParserFromHTML(Parser):
         :return: число
         :rtype: float
         """
-        result = bsoup.find('div', class_='brow-ratings').find_all('span', class_='rating-book')[0]
-        if result and bool(result.text):
-            return float(result.text)
-        else:
-            return None
+        return cls._reader_rating(cls._find_book_node(bsoup, 'ratings'))
 
-    @staticmethod
-    def get_tags(bsoup: bs4.BeautifulSoup):
-        tags = bsoup.find('div', class_='brow-tags')
-        result = []
-        if tags != None:
-            # необходимо проверить, не является ли тег ссылкой на расширенный список тегов (вида 'Еще NN тегов')
-            # Если он - ссылка, то пропускаем его.
-            # даже если теги скрыты, мы все равно их вытащим из кода страницы.
-            more = re.compile(r'^Ещё \d+')
-            for i in tags.find_all('a', class_='label-tag'):
-                if re.match(more, i.text) == None:
-                    result.append(i.text)
-        return ';'.join(result)
+    @classmethod
+    def get_tags(cls, bsoup: bs4.BeautifulSoup) -> str:
+        return cls._tags(cls._find_book_node(bsoup, 'tags'))
 
-    @staticmethod
-    def get_review_id(bsoup: bs4.BeautifulSoup) -> int:
-        result = None
-        review_id = re.compile(r'(?<=review-)\d+(?=-full)')
-        div = bsoup.find(id=review_id)
-        if div != None:
-            result = int(re.search(review_id, div['id']).group())
-        return result
+    @classmethod
+    def get_review_id(cls, bsoup: bs4.BeautifulSoup) -> int:
+        return cls._review_id(cls._find_book_node(bsoup, 'review'))
 
-    @staticmethod
-    def get_review_text(bsoup: bs4.BeautifulSoup) -> str:
-        result = None
-        review_id = re.compile(r'(?<=review-)\d+(?=-full)')
-        div = bsoup.find(id=review_id)
-        if div != None:
-            # сохраняем текст рецензии
-            body = ''.join([str(p) for p in div.find('div', itemprop='reviewBody').contents])
-            # ищем и сохраняем
-            events = div.find('div', class_='event-pad')
-            extra = ''.join([str(p) for p in events.contents]) if events != None else ''
-            result = body + extra
-        return result
+    @classmethod
+    def get_review_text(cls, bsoup: bs4.BeautifulSoup) -> str:
+        return cls._review_text(cls._find_book_node(bsoup, 'review'))
 
     @staticmethod
     def get_paginator(bsoup: bs4.BeautifulSoup) -> List[int]:
@@ -469,7 +800,7 @@ class ParserFromHTML(Parser):
             last_page = paginator.find('a', title='Последняя страница')
             # если не все страницы представлены, но есть ссылка на самую последнюю страницу
             if last_page:
-                last_number = int(re.search(r'(?<=~)\d+', last_page['href']).group())
+                last_number = int(re.search(ParserFromHTML.page_number, last_page['href']).group())
                 result = [i for i in range(1, last_number + 1)]
             # если все страницы умещаются в низу страницы (их мало, до пяти штук)
             else:
@@ -477,6 +808,301 @@ class ParserFromHTML(Parser):
             return result
 
 
+def _has_class(name: str) -> str:
+    """
+    Служебная функция, возвращает условие XPath на наличие класса name в атрибуте class элемента.
+    """
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+class ParserFromLXML(ParserFromHTML):
+    """
+    Класс парсинга страниц сайта, работающий напрямую с деревом lxml.html вместо BeautifulSoup.
+    Интерфейс и результаты совпадают с ParserFromHTML, но поиск данных ведется заранее скомпилированными
+    выражениями XPath, что в несколько раз быстрее обхода дерева BeautifulSoup.
+    Методы принимают документ, построенный make_document, либо элементы этого документа.
+    """
+    # выражения XPath, по одному на каждый поиск из ParserFromHTML
+    xpath_title_404 = lxml.etree.XPath("//title[. = '404 @ LiveLib']")
+    xpath_captcha = lxml.etree.XPath("//text()[. = 'Please confirm that you and not a robot are sending requests']")
+    xpath_booklist = lxml.etree.XPath("(.//div[@id = 'booklist'])[1]")
+    xpath_author = lxml.etree.XPath(f"(.//a[{_has_class('brow-book-author')}])[1]")
+    xpath_book_name = lxml.etree.XPath(f"(.//a[{_has_class('brow-book-name')}])[1]")
+    xpath_ratings = lxml.etree.XPath(f"(.//div[{_has_class('brow-ratings')}])[1]")
+    xpath_rating_book = lxml.etree.XPath(f".//span[{_has_class('rating-book')}]")
+    xpath_cover_img = lxml.etree.XPath(f"(.//div[{_has_class('cover-wrapper')}])[1]")
+    xpath_img = lxml.etree.XPath("(.//img)[1]")
+    xpath_tags = lxml.etree.XPath(f"(.//div[{_has_class('brow-tags')}])[1]")
+    xpath_tag = lxml.etree.XPath(f".//a[{_has_class('label-tag')}]")
+    xpath_review = lxml.etree.XPath(r"(.//*[re:test(@id, 'review-\d+-full')])[1]",
+                                    namespaces={'re': 'http://exslt.org/regular-expressions'})
+    xpath_review_body = lxml.etree.XPath("(.//div[@itemprop = 'reviewBody'])[1]")
+    xpath_event_pad = lxml.etree.XPath(f"(.//div[{_has_class('event-pad')}])[1]")
+    xpath_paginator = lxml.etree.XPath("(.//div[@id = 'booklist-pagination'])[1]")
+    xpath_last_page = lxml.etree.XPath("(.//a[@title = 'Последняя страница'])[1]")
+    # выражения для поиска узлов блока книги по отдельности, см. ParserFromHTML.book_nodes
+    node_xpaths = {'author': xpath_author, 'book_name': xpath_book_name, 'ratings': xpath_ratings,
+                   'cover': xpath_cover_img, 'tags': xpath_tags, 'review': xpath_review}
+    # атрибуты, значения которых BeautifulSoup хранит списком и при выводе склеивает через один пробел
+    multi_valued_attributes = {'class', 'accesskey', 'dropzone', 'rel', 'rev', 'headers', 'accept-charset',
+                               'archive', 'sizes', 'sandbox', 'for'}
+    # элементы, в которых BeautifulSoup не сокращает пробельные текстовые узлы
+    preserve_whitespace_elements = {'pre', 'textarea'}
+    # пробельные символы, по которым BeautifulSoup определяет пробельные текстовые узлы
+    ascii_spaces = '\x20\x0a\x09\x0c\x0d'
+    # элементы, которые BeautifulSoup выводит без закрывающего тега, вида <br/>
+    void_elements = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'keygen', 'link', 'menuitem',
+                     'meta', 'param', 'source', 'track', 'wbr', 'basefont', 'bgsound', 'command', 'frame',
+                     'image', 'isindex', 'nextid', 'spacer'}
+
+    @staticmethod
+    def make_document(text: str or bytes, features: str = None, targeted: bool = False,
+                      encoding: str = None) -> lxml.etree._ElementTree:
+        """
+        Строит из текста страницы дерево lxml.html.
+        Дерево lxml строится целиком: оно и так компактное, а частичный разбор в lxml не быстрее полного.
+        Байты страницы lxml разбирает сам, без декодирования в строку Python.
+        :param text: текст страницы или ее байты
+        :type text: str or bytes
+        :param features: не используется, оставлен для совместимости с ParserFromHTML
+            defaults to None
+        :type features: str
+        :param targeted: не используется, оставлен для совместимости с ParserFromHTML
+            defaults to False
+        :type targeted: bool
+        :param encoding: кодировка байтов страницы, для текста не используется
+            defaults to None, тогда кодировка берется из объявления в странице
+        :type encoding: str
+        :return: дерево документа
+        :rtype: lxml.etree._ElementTree
+        """
+        if not text.strip():
+            text = '<html></html>'
+        if isinstance(text, bytes):
+            parser = lxml.html.HTMLParser(encoding=encoding) if encoding else None
+            root = lxml.html.document_fromstring(text, parser=parser)
+        else:
+            try:
+                root = lxml.html.document_fromstring(text)
+            except ValueError:
+                # строки с объявлением кодировки внутри lxml разбирает только в виде байтов
+                root = lxml.html.document_fromstring(text.encode('utf-8'))
+        # возвращаем дерево, а не корневой элемент, так как элементы lxml при проверке на истинность
+        # смотрят на количество потомков, а страницы везде проверяются как if page
+        return root.getroottree()
+
+    @classmethod
+    def _find(cls, xpath: lxml.etree.XPath, element) -> lxml.html.HtmlElement or None:
+        # как и у BeautifulSoup, поиск внутри ненайденного элемента падает с AttributeError
+        if element is None:
+            raise AttributeError("'NoneType' object has no attribute 'find'")
+        result = xpath(element)
+        return result[0] if result else None
+
+    @staticmethod
+    def _string(text: str) -> str:
+        """
+        Приводит текстовый узел к тому виду, в котором его хранит BeautifulSoup:
+        узел только из пробельных символов заменяется на перевод строки, если он в нем есть, иначе на пробел.
+        """
+        if text.strip(ParserFromLXML.ascii_spaces):
+            return text
+        return '\n' if '\n' in text else ' '
+
+    @classmethod
+    def _text(cls, element: lxml.html.HtmlElement) -> str:
+        """
+        Возвращает текст элемента со всеми потомками так же, как .text у объекта BeautifulSoup.
+        """
+        if element.tag in cls.preserve_whitespace_elements:
+            return str(element.text_content())
+        result = [cls._string(element.text)] if element.text else []
+        for child in element:
+            if isinstance(child.tag, str):
+                result.append(cls._text(child))
+            if child.tail:
+                result.append(cls._string(child.tail))
+        return ''.join(result)
+
+    @classmethod
+    def _strings(cls, node, preserve: bool = False) -> typing.Iterator[str]:
+        """
+        Перебирает текстовые узлы элемента так же, как .strings у объекта BeautifulSoup:
+        без комментариев и содержимого script и style.
+        """
+        preserve = preserve or node.tag in cls.preserve_whitespace_elements
+        string = str if preserve else cls._string
+        if node.text and node.tag not in ('script', 'style'):
+            yield string(node.text)
+        for child in node:
+            if isinstance(child.tag, str):
+                yield from cls._strings(child, preserve)
+            if child.tail:
+                yield string(child.tail)
+
+    @classmethod
+    def _escape(cls, text: str) -> str:
+        return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+    @classmethod
+    def _serialize(cls, node, preserve: bool = False) -> str:
+        """
+        Выводит элемент в том же виде, что и str() у соответствующего объекта BeautifulSoup.
+        """
+        if isinstance(node, lxml.etree._Comment):
+            return f'<!--{node.text or ""}-->'
+        if not isinstance(node.tag, str):
+            return ''
+        attributes = ''
+        # BeautifulSoup выводит атрибуты в алфавитном порядке
+        for name, value in sorted(node.attrib.items()):
+            if name in cls.multi_valued_attributes:
+                value = ' '.join(value.split())
+            value = cls._escape(value)
+            if '"' in value:
+                if "'" in value:
+                    value = '"' + value.replace('"', '&quot;') + '"'
+                else:
+                    value = "'" + value + "'"
+            else:
+                value = '"' + value + '"'
+            attributes += f' {name}={value}'
+        if node.tag in cls.void_elements and not len(node) and not node.text:
+            return f'<{node.tag}{attributes}/>'
+        return f'<{node.tag}{attributes}>{cls._serialize_contents(node, preserve)}</{node.tag}>'
+
+    @classmethod
+    def _serialize_contents(cls, node, preserve: bool = False) -> str:
+        """
+        Выводит содержимое элемента так же, как ''.join(str(p) for p in bsoup.contents).
+        """
+        # содержимое script и style BeautifulSoup выводит без экранирования
+        escape = cls._escape if node.tag not in ('script', 'style') else str
+        # в pre и textarea пробельные узлы BeautifulSoup не сокращает
+        preserve = preserve or node.tag in cls.preserve_whitespace_elements
+        string = str if preserve else cls._string
+        result = [escape(string(node.text))] if node.text else []
+        for child in node:
+            result.append(cls._serialize(child, preserve))
+            if child.tail:
+                result.append(escape(string(child.tail)))
+        return ''.join(result)
+
+    @staticmethod
+    def check_404(document) -> bool:
+        return bool(ParserFromLXML.xpath_title_404(document))
+
+    @staticmethod
+    def check_captcha(document) -> bool:
+        return bool(ParserFromLXML.xpath_captcha(document))
+
+    @classmethod
+    def all_books_from_page(cls, document, formatter: BookDataFormatter = BookDataFormatter) -> List[BookRecord]:
+        result = []
+        month = None
+        year = None
+        # то же, что в ParserFromHTML.all_books_from_page: даты прочтения чередуются с книгами
+        for block in cls._find(cls.xpath_booklist, document).iterchildren('*'):
+            block_class = block.get('class', '').split()
+            if 'brow-h2' in block_class:
+                month, year = cls._parse_read_date(cls._text(block))
+            elif 'book-item-manage' in block_class:
+                book = cls.book(block, formatter)
+                book['month'] = month
+                book['year'] = year
+                result.append(book)
+        return result
+
+    @classmethod
+    def _find_book_node(cls, element, node: str) -> lxml.html.HtmlElement or None:
+        return cls._find(cls.node_xpaths[node], element)
+
+    @classmethod
+    def _find_book_nodes(cls, element) -> Dict[str, lxml.html.HtmlElement or None]:
+        nodes = dict.fromkeys(cls.book_nodes, None)
+        nodes['review'] = None
+        if isinstance(element, lxml.etree._ElementTree):
+            element = element.getroot()
+        for tag in element.iterdescendants(lxml.etree.Element):
+            for class_name in tag.get('class', '').split():
+                node = cls._book_nodes_by_class.get((tag.tag, class_name))
+                if node and nodes[node] is None:
+                    nodes[node] = tag
+            if nodes['review'] is None and cls.review_id.search(tag.get('id', '')):
+                nodes['review'] = tag
+        return nodes
+
+    @classmethod
+    def _node_text(cls, node: lxml.html.HtmlElement) -> str:
+        return cls._text(node)
+
+    @classmethod
+    def _rating(cls, ratings, number: int) -> float or None:
+        # если блока с оценками нет, падаем с AttributeError, как и ParserFromHTML
+        if ratings is None:
+            raise AttributeError("'NoneType' object has no attribute 'find_all'")
+        result = cls.xpath_rating_book(ratings)[number]
+        if cls._text(result):
+            return float(cls._text(result))
+        else:
+            return None
+
+    @classmethod
+    def _picture_url(cls, cover) -> str or None:
+        img = cls._find(cls.xpath_img, cover)
+        result = img.get('data-pagespeed-lazy-src')
+        if result:
+            return result
+        else:
+            result = img.get('src')
+            return result if result else None
+
+    @classmethod
+    def _tags(cls, tags) -> str:
+        result = []
+        if tags is not None:
+            for i in cls.xpath_tag(tags):
+                text = cls._text(i)
+                if re.match(cls.more_tags, text) == None:
+                    result.append(text)
+        return ';'.join(result)
+
+    @classmethod
+    def _review_text(cls, div) -> str or None:
+        if div is None:
+            return None
+        body = cls._serialize_contents(cls._find(cls.xpath_review_body, div))
+        events = cls._find(cls.xpath_event_pad, div)
+        extra = cls._serialize_contents(events) if events is not None else ''
+        return body + extra
+
+    @staticmethod
+    def get_paginator(document) -> List[int]:
+        paginator = ParserFromLXML._find(ParserFromLXML.xpath_paginator, document)
+        if paginator is None:
+            return []
+        last_page = ParserFromLXML._find(ParserFromLXML.xpath_last_page, paginator)
+        if last_page is not None:
+            last_number = int(re.search(ParserFromLXML.page_number, last_page.get('href')).group())
+            return [i for i in range(1, last_number + 1)]
+        else:
+            return [int(i) for i in ParserFromLXML._text(paginator).split()]
+
+
+def get_html_parser(config) -> type[ParserFromHTML]:
+    """
+    Возвращает класс парсера страниц сайта, заданный в Config.bs_parser.parser:
+    'bs4' - ParserFromHTML, 'lxml' - ParserFromLXML.
+    :param config: конфигурация
+    :type config: Config
+    :rtype: type[ParserFromHTML]
+    """
+    parsers = {'bs4': ParserFromHTML, 'lxml': ParserFromLXML}
+    if config.bs_parser.parser not in parsers:
+        raise ValueError(f'Unknown html parser {config.bs_parser.parser}, expected one of {list(parsers)}')
+    return parsers[config.bs_parser.parser]
+
+
 class ParserForDB(Parser):
     @staticmethod
     def _prepare_book_for_db(book: Dict, formatter=BookDataFormatter) -> List:
@@ -492,12 +1118,21 @@ class ParserForDB(Parser):
         :rtype: Dict
         """
         new_book = {}
-        for property in formatter.all_properties_db().keys():
+        for property, name in ParserForDB.db_plan(formatter):
             value = book.get(property, None)
             if value == None: value = ''
-            new_book[formatter.common[property]['db']['name']] = value
+            new_book[name] = value
         return new_book
 
+    @staticmethod
+    def db_plan(formatter=BookDataFormatter) -> typing.Tuple[typing.Tuple[str, str], ...]:
+        """
+        Возвращает план подготовки книги для БД - кортеж пар (свойство, колонка в БД).
+        План строится один раз для formatter, дальше он берется из его кеша.
+        """
+        return formatter.compiled('db_plan', lambda: tuple((i, formatter.common[i]['db']['name'])
+                                                           for i in formatter.all_properties_db()))
+
     @staticmethod
     def prepare_books_for_db(books: List[Dict], formatter=BookDataFormatter) -> List:
         """
@@ -516,6 +1151,25 @@ class ParserForDB(Parser):
             result.append(ParserForDB._prepare_book_for_db(book, formatter=formatter))
         return result
 
+    @staticmethod
+    def create_review_plain(text: str or None) -> str or None:
+        """
+        Возвращает текст рецензии без разметки для сохранения в БД рядом с html рецензии.
+        Результат тот же, что у ParserForXLSX.create_review_text, но html разбирается напрямую lxml,
+        а при экспорте готовый текст берется из БД без повторного разбора.
+        :param text: html рецензии
+        :type text: str or None
+        :return: текст рецензии, None если рецензии нет
+        :rtype: str or None
+        """
+        if not text:
+            return text
+        root = lxml.html.fragment_fromstring(text, create_parent='div')
+        # как и BeautifulSoup, пробелы в начале документа пропускаем
+        if root.text:
+            root.text = root.text.lstrip(ParserFromLXML.ascii_spaces)
+        return '\n'.join(ParserFromLXML._strings(root)).replace('\n\n', '\n')
+
 
 class ParserForCSV(Parser):
     @staticmethod
@@ -548,13 +1202,15 @@ class ParserForXLSX(Parser):
         :rtype: Dict
         """
         new_book = {}
-        for property in formatter.all_properties_xlsx().keys():
-            method = formatter.all_properties_xlsx()[property].get('method', None)
+        for property, source, converter in ParserForXLSX.xlsx_plan(formatter):
             value = book.get(property, None)
-            if value == None:
+            # если в книге уже есть отформатированное значение (например, текст рецензии без разметки), берем его
+            if source and book.get(source, None) is not None:
+                value = book[source]
+            elif value == None:
                 value = ''
-            elif method and hasattr(ParserForXLSX, method):
-                value = getattr(ParserForXLSX,method)(value)
+            elif converter:
+                value = converter(value)
             new_book[property] = value
         # отдельно формируем дату из свойств month и year
         month_numbers = {1:'январь', 2:'февраль', 3:'март', 4:'апрель', 5:'май', 6:'июнь',
@@ -563,6 +1219,23 @@ class ParserForXLSX(Parser):
         new_book['date'] = " ".join((str(book['year']), month ))
         return new_book
 
+    @staticmethod
+    def xlsx_plan(formatter=BookDataFormatter) -> typing.Tuple[tuple, ...]:
+        """
+        Возвращает план подготовки книги для XLSX - кортеж (свойство, источник готового значения, функция
+        форматирования) для каждой колонки в порядке колонок. Функция равна None, если метод форматирования
+        не задан или его нет у ParserForXLSX.
+        План строится один раз для formatter, дальше он берется из его кеша.
+        """
+        def build():
+            result = []
+            for property, spec in formatter.all_properties_xlsx().items():
+                method = spec.get('method', None)
+                converter = getattr(ParserForXLSX, method) if method and hasattr(ParserForXLSX, method) else None
+                result.append((property, spec.get('source', None), converter))
+            return tuple(result)
+        return formatter.compiled('xlsx_plan', build)
+
     @staticmethod
     def create_author_link(id):
         return 'https://livelib.ru/author/'+str(id)
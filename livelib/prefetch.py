@@ -0,0 +1,167 @@
+import argparse
+import json
+import logging
+import os
+from typing import List
+
+from .config import Config
+from .parser import ParserFromHTML, get_html_parser
+from .webconnection import WebConnection, AsyncWebWithCache, RateLimiter
+
+"""
+Модуль для заполнения кеша страниц заранее, без интерактивного запуска model.py.
+Для каждого читателя из списка по паджинатору первой страницы определяется количество страниц
+с прочитанными книгами, и все страницы /reader/<login>/read/~N сохраняются в кеше WebWithCache.
+Ход работы сохраняется в файл, при повторном запуске уже обработанные читатели пропускаются.
+
+Запуск:
+    python -m livelib.prefetch logins.txt --env .env --progress prefetch.json --rate 6
+В файле logins.txt - по одному логину в строке, пустые строки и строки, начинающиеся с #, пропускаются.
+"""
+
+
+def read_logins(filename: str) -> List[str]:
+    """
+    Читает список логинов из файла, по одному логину в строке.
+    :param filename: путь к файлу
+    :type filename: str
+    :return: список логинов
+    :rtype: List[str]
+    """
+    with open(filename, mode='r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip() and not line.strip().startswith('#')]
+
+
+class Prefetcher:
+    """
+    Заполняет кеш страниц с прочитанными книгами для списка читателей.
+    Все запросы идут через одно соединение, поэтому для всех читателей действует общий ограничитель частоты запросов.
+    :param web_connection: соединение с кешем, в котором сохраняются страницы
+    :type web_connection: WebConnection
+    :param progress_file: файл для сохранения хода работы, пустая строка - не сохранять
+        defaults to ''
+    :type progress_file: str
+    :param parser_html: класс парсера страниц сайта
+        defaults to ParserFromHTML
+    :type parser_html: cls
+    """
+
+    def __init__(self, web_connection: WebConnection, progress_file: str = '', parser_html=ParserFromHTML):
+        self.web_connection = web_connection
+        self.progress_file = progress_file
+        self.parser_html = parser_html
+        self.logger = logging.getLogger()
+        self.progress = self._load_progress()
+
+    def _load_progress(self) -> dict:
+        """
+        Загружает ход работы из файла: {'done': {логин: количество страниц}, 'failed': {логин: [страницы]}}.
+        :rtype: dict
+        """
+        progress = {'done': {}, 'failed': {}}
+        if self.progress_file and os.path.isfile(self.progress_file):
+            try:
+                with open(self.progress_file, mode='r', encoding='utf-8') as f:
+                    progress.update(json.load(f))
+            except Exception:
+                self.logger.exception(f'Can not load prefetch progress from {self.progress_file}', exc_info=True)
+        return progress
+
+    def _save_progress(self) -> None:
+        if not self.progress_file:
+            return
+        # пишем во временный файл и подменяем им старый, чтобы прерванный запуск не испортил ход работы
+        tmp_file = self.progress_file + '.tmp'
+        with open(tmp_file, mode='w', encoding='utf-8') as f:
+            json.dump(self.progress, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_file, self.progress_file)
+
+    def _should_retry(self, url: str) -> bool:
+        breaker = self.web_connection.circuit_breaker
+        return breaker is not None and breaker.should_retry(url)
+
+    def get_reader_pages(self, login: str) -> List[str]:
+        """
+        Возвращает адреса всех страниц с прочитанными книгами читателя, первая страница при этом попадает в кеш.
+        :param login: логин читателя
+        :type login: str
+        :return: список адресов страниц, пустой, если первую страницу получить не удалось
+        :rtype: List[str]
+        """
+        first_page = self.parser_html.reader_read_books_page(login)
+        page = self.web_connection.get_page_bs(first_page, self.parser_html)
+        while not page and self._should_retry(first_page):
+            page = self.web_connection.get_page_bs(first_page, self.parser_html)
+        if not page:
+            return []
+        page_numbers = self.parser_html.get_paginator(page)
+        if page_numbers == []:
+            page_numbers = [1]
+        return [first_page] + [self.parser_html.reader_read_books_page_by_number(login, i) for i in page_numbers]
+
+    def prefetch_reader(self, login: str) -> int:
+        """
+        Сохраняет в кеше все страницы с прочитанными книгами читателя.
+        Страницы, не полученные из-за капчи или ошибки сайта, запрашиваются снова, пока это разрешает предохранитель.
+        :param login: логин читателя
+        :type login: str
+        :return: количество страниц, которые не удалось получить, -1 если не удалось получить первую страницу
+        :rtype: int
+        """
+        pages = self.get_reader_pages(login)
+        if not pages:
+            self.logger.warning(f'Can not prefetch pages of reader {login}, first page is not found.')
+            return -1
+        queue = pages[1:]
+        failed = []
+        while queue:
+            chunk, queue = queue[:self.web_connection.concurrency], queue[self.web_connection.concurrency:]
+            for url, text in zip(chunk, self.web_connection.get_pages_text(chunk)):
+                if text is None or self.parser_html.check_captcha_text(text):
+                    if self._should_retry(url):
+                        queue.append(url)
+                    else:
+                        failed.append(url)
+        if failed:
+            self.progress['failed'][login] = failed
+        else:
+            self.progress['failed'].pop(login, None)
+            self.progress['done'][login] = len(pages)
+        self.logger.info(f'Prefetched {len(pages) - len(failed)} of {len(pages)} pages of reader {login}.')
+        return len(failed)
+
+    def run(self, logins: List[str]) -> dict:
+        """
+        Заполняет кеш для всех читателей из списка, пропуская уже обработанных в прошлых запусках.
+        :param logins: список логинов
+        :type logins: List[str]
+        :return: ход работы {'done': {логин: количество страниц}, 'failed': {логин: [страницы]}}
+        :rtype: dict
+        """
+        for number, login in enumerate(logins, start=1):
+            if login in self.progress['done']:
+                self.logger.debug(f'Reader {login} is already prefetched.')
+                continue
+            print(f'Читатель {login} ({number} из {len(logins)})')
+            if self.prefetch_reader(login) == -1:
+                self.progress['failed'][login] = [self.parser_html.reader_read_books_page(login)]
+            self._save_progress()
+        return self.progress
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Заполнение кеша страниц для списка читателей.')
+    arg_parser.add_argument('logins', help='файл с логинами читателей, по одному в строке')
+    arg_parser.add_argument('--env', default='.env', help='файл конфигурации')
+    arg_parser.add_argument('--progress', default='prefetch.json', help='файл для сохранения хода работы')
+    arg_parser.add_argument('--rate', type=float, default=None,
+                            help='общее ограничение запросов к сайту в минуту, по умолчанию RATE_PER_MINUTE')
+    args = arg_parser.parse_args()
+    config = Config(args.env)
+    if args.rate:
+        config.web_connection.requests_per_minute = args.rate
+    web_connection = AsyncWebWithCache(config, random_sleep=True, rate_limiter=RateLimiter.from_config(config))
+    progress = Prefetcher(web_connection, progress_file=args.progress,
+                          parser_html=get_html_parser(config)).run(read_logins(args.logins))
+    web_connection.close()
+    print('Готово читателей:', len(progress['done']), ', с ошибками:', len(progress['failed']))
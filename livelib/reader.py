@@ -1,3 +1,4 @@
+import collections
 import datetime
 import re
 import typing
@@ -20,7 +21,8 @@ class Reader:
     Класс для работы с конкретным пользователем livelib.
     :param login: логин читателя на сайте
     :type login: str
-    :param web_connection: объект Connection для связи с сайтом
+    :param web_connection: объект Connection для связи с сайтом,
+        оборачивается в MemoWeb, чтобы одна и та же страница не запрашивалась и не разбиралась дважды
     :type web_connection: Сonnection
     :param parser_html: класс парсера, который будет применяться к страницам html,
         defaults to Parser
@@ -28,6 +30,9 @@ class Reader:
     :param parser_db: класс парсера, который будет применяться для работы с БД,
         defaults to ParserForDB
     :type parser_db: cls
+    :param parse_pool: пул процессов для параллельного разбора страниц с книгами, None - разбор в текущем процессе,
+        defaults to None
+    :type parse_pool: ParsePool
     """
 
     def __init__(self,
@@ -37,7 +42,8 @@ class Reader:
                  export: Export,
                  parser_html: type[Parser] = ParserFromHTML,
                  parser_db: type[Parser] = ParserForDB,
-                 parser_xlsx: type[Parser] = ParserForXLSX):
+                 parser_xlsx: type[Parser] = ParserForXLSX,
+                 parse_pool=None):
         self.login = login
 
         self.web_connection = web_connection
@@ -46,9 +52,18 @@ class Reader:
         self.parser_html = parser_html
         self.parser_db = parser_db
         self.parser_xlsx = parser_xlsx
+        self.parse_pool = parse_pool
 
         self.id = None
 
+    @property
+    def web_connection(self) -> WebConnection:
+        return self._web_connection
+
+    @web_connection.setter
+    def web_connection(self, value: WebConnection) -> None:
+        self._web_connection = value if isinstance(value, MemoWeb) or value is None else MemoWeb(value)
+
     @property
     def prefix(self) -> str:
         """
@@ -143,6 +158,8 @@ class Reader:
         try:
             # вызовем первую страницу со всеми книгами, чтобы забрать оттуда из паджинатора список страниц с книгами
             page = self.web_connection.get_page_bs(self.all_books_page, self.parser_html)
+            while not page and self._should_retry(self.all_books_page):
+                page = self.web_connection.get_page_bs(self.all_books_page, self.parser_html)
             page_numbers = self.parser_html.get_paginator(page)
             # если у читателя меньше 20 книг, то паджинатора нет, но есть 1 страница с прочитанным
             if page_numbers == []: page_numbers = [1]
@@ -150,23 +167,40 @@ class Reader:
             pages = []
             for i in page_numbers:
                 pages.append(self.parser_html.reader_read_books_page_by_number(self.login, i))
-            for i in pages:
-                books = []
-                if re.search(r'\d+$', i):
-                    page_number = re.search(r'\d+$', i).group()
-                else:
-                    page_number = 1
-                print('Скачиваем книги со страницы ', page_number, ' из ', len(page_numbers))
-                try:
-                    books = self._get_read_books_from_page(i)
-                    # print(books)
-                    # сохраняем порцию книг в базе данных
-                    num = self._save_read_books_in_db(books)
-                    # print(f'Saving {num} books to DB')
-                    logging.info(f'Saving {num} books to DB')
-                except Exception:
-                    logging.exception(f'Error while getting and saving portion of books for reader {self.login}  at page {i}  .', exc_info=True)
-                result = result + books
+            # асинхронные соединения получают страницы пачками по concurrency штук, обычные - по одной,
+            # с пулом разбора пачка не меньше количества процессов, чтобы все они были заняты
+            concurrency = self.web_connection.concurrency
+            if self.parse_pool is not None:
+                concurrency = max(concurrency, self.parse_pool.workers)
+            queue = collections.deque(pages)
+            while queue:
+                chunk = [queue.popleft() for _ in range(min(concurrency, len(queue)))]
+                failed = []
+                for i, page_bs in zip(chunk, self._get_pages(chunk)):
+                    # страницу, не полученную из-за капчи или ошибки сайта, ставим в очередь снова,
+                    # соединение само выждет паузу перед следующим запросом
+                    if page_bs is False and self._should_retry(i):
+                        logging.warning(f'Page {i} for reader {self.login} is put back in queue.')
+                        failed.append(i)
+                        continue
+                    books = []
+                    if re.search(r'\d+$', i):
+                        page_number = re.search(r'\d+$', i).group()
+                    else:
+                        page_number = 1
+                    print('Скачиваем книги со страницы ', page_number, ' из ', len(page_numbers))
+                    try:
+                        books = self._get_read_books_from_bs(page_bs, i)
+                        # print(books)
+                        # сохраняем порцию книг в базе данных
+                        num = self._save_read_books_in_db(books)
+                        # print(f'Saving {num} books to DB')
+                        logging.info(f'Saving {num} books to DB')
+                    except Exception:
+                        logging.exception(f'Error while getting and saving portion of books for reader {self.login}  at page {i}  .', exc_info=True)
+                    if books:
+                        result = result + books
+                queue.extendleft(reversed(failed))
             # помечаем время последнего обновления книг в таблице читателей
             self.fill_update_time()
             return result
@@ -174,6 +208,28 @@ class Reader:
             logging.exception(f'The page with read books for reader {self.login} is not found! ', exc_info=True)
             return False
 
+    def _should_retry(self, url: str) -> bool:
+        """
+        Проверяет, стоит ли повторно запросить страницу, которую не удалось получить из-за капчи или ошибки сайта.
+        :param url: адрес страницы
+        :type url: str
+        :rtype: bool
+        """
+        breaker = self.web_connection.circuit_breaker
+        return breaker is not None and breaker.should_retry(url)
+
+    def _get_pages(self, urls: List[str]) -> List:
+        """
+        Возвращает страницы для _get_read_books_from_bs в том же порядке, что и адреса: документы страниц,
+        а при заданном пуле разбора - уже вынутые в других процессах списки книг. Неполученные страницы - False.
+        :param urls: адреса страниц
+        :type urls: List[str]
+        :rtype: List
+        """
+        if self.parse_pool is None:
+            return self.web_connection.get_pages_bs(urls, self.parser_html)
+        return self.parse_pool.parse_texts(self.web_connection.get_pages_text(urls))
+
     def _get_read_books_from_page(self, url: str) -> List or bool:
         """
         Получает список книг с заданной страницы
@@ -183,6 +239,21 @@ class Reader:
         :rtype: list or bool
         """
         page = self.web_connection.get_page_bs(url, self.parser_html)
+        return self._get_read_books_from_bs(page, url)
+
+    def _get_read_books_from_bs(self, page: bs4.BeautifulSoup or bool, url: str) -> List or bool:
+        """
+        Получает список книг из уже полученной страницы
+        :param page: объект BeautifulSoup страницы, уже разобранный пулом список книг
+            либо False, если страницу получить не удалось
+        :type page: bs4.BeautifulSoup or list or bool
+        :param url: адрес страницы, нужен для логов
+        :type url: str
+        :return: список книг либо False, если страница не найдена
+        :rtype: list or bool
+        """
+        if isinstance(page, list):
+            return page
         if page:
             books = self.parser_html.all_books_from_page(page)
             return books
@@ -191,48 +262,68 @@ class Reader:
             logging.warning(f'Page with books at {url} is not found or 404, or captcha.')
             return False
 
-    def _save_read_books_in_db(self, books : list[dict]) -> int or None:
+    def save_parsed_pages(self, urls: List[str], pages: List) -> List:
+        """
+        Сохраняет в БД книги с уже разобранных страниц (см. ParsePool.parse_texts) и помечает время обновления.
+        :param urls: адреса страниц, нужны для логов
+        :type urls: List[str]
+        :param pages: для каждой страницы список книг либо False или None, если ее не удалось получить или разобрать
+        :type pages: List
+        :return: список всех сохраненных книг
+        :rtype: list
+        """
+        result = []
+        for url, page in zip(urls, pages):
+            books = self._get_read_books_from_bs(page, url)
+            if not books:
+                continue
+            try:
+                num = self._save_read_books_in_db(books)
+                logging.info(f'Saving {num} books to DB')
+                result.extend(books)
+            except Exception:
+                logging.exception(f'Error while saving portion of books for reader {self.login} at page {url}.',
+                                  exc_info=True)
+        self.fill_update_time()
+        return result
+
+    def _save_read_books_in_db(self, books : list[dict], stored: dict = None) -> int or None:
         """
         Сохраняем книги в БД
-        :param books: список словарей с данными о книгах. Словари будут обработаны с помощью BookDataFormatter
+        :param books: список записей BookRecord или словарей с данными о книгах.
+            Они будут обработаны с помощью BookDataFormatter
         :type books: list[dict]
+        :param stored: сохраненные в БД книги читателя (см. _get_stored_books) при обновлении: книги, которые в них
+            есть, обновляются на месте, остальные ставятся перед сохраненными, как новые прочтения на сайте;
+            None - книги только добавляются
+        :type stored: dict
         :return: количество добавленных в БД строк, None, если ничего не было добавлено
         :rtype: int or None
         """
-        # prepared_books = self.parser_db.prepare_books_for_db(books)
-        # сохраняем книги в таблице Book
+        # книги и связи читателя с ними сохраняются одной транзакцией,
+        # строки передаются списками значений без промежуточных словарей
         book_properties = BookDataFormatter.book_properties_db
-        # print('всего книг ',len(books))
-
-        for book in books:
-            self.db_connection.insert_values('Book', [{key:book[key] for key in book_properties},])
-        # сохраняем связи между читателем и книгами в таблице ReadBook вместе с его оценкой и рецензией
-        # узнаем id добавленных книг
-        new_books = [book['book_id'] for book in books if book['book_id']]
-        new_works = [book['work_id'] for book in books if book['work_id']]
-        # print('всего books ', len(new_books))
-        # print('всего works ', len(new_works))
-        new_ids = self.db_connection.run_single_sql(f"SELECT id, book_id, work_id FROM Book where book_id in ({','.join(['?']*len(new_books))})"
-                                                    f" OR work_id in ({','.join(['?']*len(new_works))}) ",
-                                                    new_books+new_works)
-        # print('всего new_ids ', len(new_ids))
-        # разбираем новые id, формируем список строк для занесения в ReadBook
-        readbook_rows = []
-        readbook_properties = BookDataFormatter.readbook_properties_db
-        for i in new_ids:
-            # находим соответствующую запись в общем массиве books
-            if i['book_id']:
-                entry = [item for item in books if item['book_id']==i['book_id']][0]
-            elif i['work_id']:
-                entry = [item for item in books if item['work_id']==i['work_id']][0]
-            # добавляем в новую запись нужные для таблицы свойства
-            new_entry = {key:value for key,value in entry.items() if key in readbook_properties}
-            new_entry['reader_id'] = self.id
-            new_entry['book_id'] = i['id']
-            readbook_rows.append(new_entry)
-        # добавляем новые значения в таблицу ReadBook
-        result = self.db_connection.insert_values('ReadBook', readbook_rows)
-        logging.info(f'Added new {result} entries to ReadBook for Reader {self.id} {self.login}')
+        # место книги в списке читателя задает БД при сохранении
+        readbook_properties = [i for i in BookDataFormatter.readbook_properties_db
+                               if i not in ('review_plain', 'position')]
+
+        def readbook_row(book) -> list:
+            # текст рецензии без разметки готовим сразу, чтобы экспорт не разбирал html рецензий каждый раз
+            return [book.get(key) for key in readbook_properties] + \
+                [self.parser_db.create_review_plain(book.get('review_text'))]
+
+        updated = []
+        if stored is not None:
+            updated = [readbook_row(i) + [stored[self._book_key(i)]['id']]
+                       for i in books if self._book_key(i) in stored]
+            books = [i for i in books if self._book_key(i) not in stored]
+        book_rows = [[book[key] for key in book_properties] for book in books]
+        readbook_rows = [readbook_row(book) for book in books]
+        result = self.db_connection.ingest_read_books(self.id, book_rows, book_properties, readbook_rows,
+                                                      readbook_properties + ['review_plain'],
+                                                      updated=updated, prepend=stored is not None)
+        logging.info(f'Added new {result} entries to ReadBook for Reader {self.id} {self.login}'
+                     + (f', updated {len(updated)} entries' if updated else ''))
         return result
 
     def fill_update_time(self) -> str:
@@ -271,24 +362,165 @@ class Reader:
     def get_read_books_from_db(self) -> list:
         """
         Возвращает книги, прочитанные читателем, из БД.
-        :return:
-        :rtype: list[dict]
-        """
-        result = self.db_connection.run_single_sql("SELECT  *, Book.book_id as book_id FROM Book INNER JOIN ReadBook ON Book.id=ReadBook.book_id WHERE ReadBook.reader_id=?", (self.id,))
-        # нужно удалить reader_id и id из полученного ответа
-        # для прохождения юнит тестов с динамически генерируемыми пользователями
-        for i in result:
-            del i["reader_id"]
-            del i["id"]
-        # print(result)
+        :return: список записей BookRecord, которые ведут себя как словари
+        :rtype: list[BookRecord]
+        """
+        return list(self.iter_read_books_from_db())
+
+    # сколько прочитанных книг читать из БД за один раз при обходе итератором
+    db_batch_size: int = 1000
+
+    def iter_read_books_from_db(self, batch_size: int = None) -> typing.Iterator:
+        """
+        Возвращает итератор по книгам, прочитанным читателем, из БД, в порядке их мест в списке читателя.
+        Книги читаются из БД пачками по batch_size, поэтому вся библиотека читателя в памяти не держится.
+        :param batch_size: сколько книг читать из БД за один раз, None - db_batch_size
+        :type batch_size: int
+                defaults to None
+        :return: итератор по записям BookRecord, которые ведут себя как словари
+        :rtype: typing.Iterator[BookRecord]
+        """
+        # колонки перечисляются явно: служебные id, reader_id и position в записи не нужны,
+        # а book_id у ReadBook - это ссылка на строку Book, а не id книги на сайте
+        columns = [f'Book.{i}' for i in BookDataFormatter.book_properties_db] + \
+                  [f'ReadBook.{i}' for i in BookDataFormatter.readbook_properties_db if i != 'position']
+        # книги идут по местам в списке читателя (см. SQLite3Connection.ingest_read_books),
+        # индекс idx_readbook_position отдает их уже в этом порядке
+        sql = (f"SELECT {', '.join(columns)} FROM Book INNER JOIN ReadBook ON Book.id=ReadBook.book_id "
+               f"WHERE ReadBook.reader_id=? ORDER BY ReadBook.position, ReadBook.id")
+        return self.db_connection.iter_sql(sql, (self.id,), batch_size or self.db_batch_size,
+                                           record=BookDataFormatter.record())
+
+    # свойства прочитанной книги, изменение которых на сайте переносится в БД при обновлении
+    sync_properties = ('reader_rating', 'review_id', 'review_text', 'tags')
+
+    def update_books(self, full: bool = False, full_after_days: float = 0) -> List or bool:
+        """
+        Обновляет прочитанные читателем книги в БД.
+        Полное обновление удаляет все связи книг и читателя в ReadBook, затем скачивает из сети все страницы заново.
+        Иначе обновление инкрементальное (см. _update_books_incremental): скачиваются только первые страницы,
+        пока на них есть новые или измененные книги. Удаленные читателем с сайта книги при этом остаются в БД,
+        их убирает только полное обновление.
+        :param full: обновить все книги полностью
+            defaults to False
+        :type full: bool
+        :param full_after_days: сколько дней может пройти с последнего полного обновления, после чего обновление
+            делается полным, 0 - только по full
+            defaults to 0
+        :type full_after_days: float
+        :return: при полном обновлении все книги читателя, при инкрементальном - новые и измененные книги,
+            False, если страницы с книгами не найдены
+        :rtype: list or bool
+        """
+        if not full and full_after_days:
+            last_full = self.get_full_update_time()
+            full = last_full is None or datetime.datetime.now() - datetime.datetime.strptime(
+                last_full, '%Y-%m-%d  %H:%M:%S') > datetime.timedelta(days=full_after_days)
+        stored = {} if full else self._get_stored_books()
+        if not stored:
+            self.delete_read_books()
+            result = self.get_read_books_from_web()
+            if result is not False:
+                self._fill_full_update_time()
+            return result
+        return self._update_books_incremental(stored)
+
+    def _update_books_incremental(self, stored: dict) -> List or bool:
+        """
+        Livelib показывает прочитанные книги от новых к старым, поэтому страницы обходятся с первой,
+        новые и измененные книги сохраняются в БД, а обход останавливается на первой странице,
+        все книги которой уже есть в БД с теми же свойствами sync_properties.
+        Измененные книги обновляются на месте, новые ставятся перед сохраненными, все - одной транзакцией.
+        Если следующая страница не прочиталась, найденные книги сохраняются, но время обновления не отмечается.
+        :param stored: сохраненные в БД книги читателя (см. _get_stored_books)
+        :type stored: dict
+        :return: новые и измененные книги либо False, если первая страница не найдена
+        :rtype: list or bool
+        """
+        result = []
+        seen = set()
+        last_page = 1
+        page_number = 1
+        complete = True
+        while page_number <= last_page:
+            url = self.parser_html.reader_read_books_page_by_number(self.login, page_number)
+            page = self._get_pages([url])[0]
+            if page is False and self._should_retry(url):
+                logging.warning(f'Page {url} for reader {self.login} is requested again.')
+                continue
+            if page_number == 1:
+                if page is False:
+                    logging.warning(f'The page with read books for reader {self.login} is not found!')
+                    return False
+                if not isinstance(page, list):
+                    last_page = max(self.parser_html.get_paginator(page) or [1])
+            books = self._get_read_books_from_bs(page, url)
+            if not books:
+                if page_number > 1:
+                    # без этой страницы обновление неполное, время обновления не отмечаем
+                    logging.warning(f'Page {url} for reader {self.login} has no books, update is not finished.')
+                    complete = False
+                break
+            changed = []
+            for i in books:
+                # у перечитанной книги в БД хранится самое новое прочтение, более старые пропускаем
+                if self._book_key(i) not in seen:
+                    seen.add(self._book_key(i))
+                    if self._book_changed(i, stored):
+                        changed.append(i)
+            if changed:
+                print('Обновляем книги со страницы ', page_number)
+                result = result + changed
+            else:
+                logging.info(f'Page {url} has no new books for reader {self.login}, update is finished.')
+                break
+            page_number += 1
+        if result:
+            # измененные связи обновляются на месте, новые ставятся перед сохраненными, все одной транзакцией
+            num = self._save_read_books_in_db(result, stored)
+            logging.info(f'Updating {len(result)} books in DB for reader {self.login}, {num} of them are new')
+        if complete:
+            self.fill_update_time()
         return result
 
-    def update_books(self):
+    @staticmethod
+    def _book_key(book: dict) -> tuple:
+        return ('book', book['book_id']) if book.get('book_id') else ('work', book.get('work_id'))
+
+    def _book_changed(self, book: dict, stored: dict) -> bool:
+        """
+        Проверяет, что книги нет среди уже сохраненных или у нее изменились свойства sync_properties.
+        """
+        old = stored.get(self._book_key(book))
+        return old is None or any(old[i] != book.get(i) for i in self.sync_properties)
+
+    def _get_stored_books(self) -> dict:
         """
-        Обновляет прочитанные читателем книги в БД. Удаляет все связи книг и читателя в ReadBook, затем скачивает из сети новые.
+        Возвращает сохраненные в БД прочитанные книги читателя.
+        :return: словарь {ключ книги: {'id': id строки ReadBook, свойства sync_properties}}
+        :rtype: dict
         """
-        self.delete_read_books()
-        self.get_read_books_from_web()
+        rows = self.db_connection.run_single_sql(
+            f"SELECT ReadBook.id AS id, Book.book_id AS book_id, Book.work_id AS work_id, "
+            f"{', '.join('ReadBook.' + i for i in self.sync_properties)} "
+            f"FROM ReadBook INNER JOIN Book ON Book.id=ReadBook.book_id WHERE ReadBook.reader_id=?", (self.id,))
+        return {self._book_key(i): i for i in rows or []}
+
+    def _fill_full_update_time(self) -> None:
+        new_time = datetime.datetime.now().strftime('%Y-%m-%d  %H:%M:%S')
+        self.db_connection.run_single_sql("UPDATE Reader SET full_update_time=? WHERE login=?", (new_time, self.login,))
+
+    def get_full_update_time(self) -> str or None:
+        """
+        Возвращает дату последнего полного обновления книг читателя в строковом формате '2023-05-13 10:14:10'
+        или None, если полного обновления еще не было.
+        :rtype: str or None
+        """
+        result = self.db_connection.run_single_sql("SELECT full_update_time FROM Reader WHERE login=?", (self.login,))
+        if result:
+            return result[0]['full_update_time']
+        else:
+            return None
 
     def create_export_xlsx_file(self) -> str or None:
         """
@@ -296,7 +528,7 @@ class Reader:
         :return:
         :rtype: str or None
         """
-        books = self.get_read_books_from_db()
-        # print(books[0])
+        # книги передаются в экспорт итератором и читаются из БД по мере записи в файл
+        books = self.iter_read_books_from_db()
         f = self.export.create_file(books = books, login = self.login, parser_xlsx = self.parser_xlsx)
         return f
\ No newline at end of file
@@ -0,0 +1,262 @@
+import os, sys
+
+# скрипт для правильной отработки в github.actions
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import argparse
+import datetime
+import json
+import platform
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+from livelib import Config, WebWithCache, Reader, SQLite3Connection, XLSXExport
+from livelib.parser import ParserFromHTML, ParserFromLXML, ParserForDB, ParserForXLSX, BookDataFormatter
+
+"""
+Набор бенчмарков для горячих мест пакета на сохраненных страницах из тестовых данных:
+    get_page_bs - получение страницы из кеша и построение документа
+    all_books_from_page - разбор страницы со списком книг
+    book_per_function, book_plan - разбор одной книги вызовом каждого метода парсера и по плану
+    prepare_books_for_db - подготовка книг для БД
+    save_read_books_in_db - Reader._save_read_books_in_db в новую базу данных
+    create_file - XLSXExport.create_file
+Последние три меряются на книгах со страниц тестовых данных, размноженных до заданного количества (--sizes).
+Каждый замер повторяется --repeat раз, в отчет идет медиана: лучшее время из нескольких запусков слишком сильно
+зависит от случайно удачного запуска.
+Результат сохраняется в json-отчет (--report) и сравнивается с базовым отчетом (--baseline): замеры, ставшие
+медленнее базовых больше, чем на --tolerance, и при этом больше, чем на --min-difference секунд, считаются
+регрессией, и скрипт завершается с кодом 1. Короткие замеры в несколько миллисекунд на общей машине гуляют
+в разы, поэтому без абсолютного порога они давали бы ложные регрессии.
+Базовый отчет снимается на той же машине, где потом проверяются изменения, со всеми размерами (--update-baseline).
+Запуск:
+    python livelib/tests/benchmark.py --sizes 1000 10000 --report report.json
+    python livelib/tests/benchmark.py --sizes 1000 10000 100000 --update-baseline
+"""
+
+TESTS_FOLDER = os.path.dirname(os.path.abspath(__file__))
+CACHE_FOLDER = os.path.join(TESTS_FOLDER, 'data', 'sample', 'test_reader', 'get_read_books_from_web', 'cache')
+BASELINE_FILE = os.path.join(TESTS_FOLDER, 'data', 'benchmark', 'baseline.json')
+PARSERS = (ParserFromHTML, ParserFromLXML)
+
+
+def measure(function: Callable, repeat: int = 5, setup: Callable = None) -> List[float]:
+    """
+    Возвращает времена repeat выполнений function в секундах.
+    Если задан setup, он вызывается перед каждым замером, и его время не учитывается.
+    """
+    result = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        function()
+        result.append(time.perf_counter() - start)
+    return result
+
+
+def book_per_function(parser, block, formatter=BookDataFormatter) -> dict:
+    """
+    Разбор книги так, как он делался до появления плана: словарь formatter строится заново для каждой книги,
+    каждый метод парсера сам ищет в блоке нужные ему узлы.
+    """
+    result = {}
+    for property_name, parser_function in formatter.all_properties_parser().items():
+        try:
+            if hasattr(parser, parser_function):
+                result[property_name] = getattr(parser, parser_function)(block)
+        except AttributeError:
+            pass
+    return result
+
+
+def book_blocks(parser, document) -> list:
+    if parser is ParserFromLXML:
+        return document.getroot().find_class('book-item-manage')
+    return document.find_all('div', class_='book-item-manage')
+
+
+def fixture_urls() -> List[str]:
+    """
+    Возвращает адреса всех страниц со списками книг, сохраненных в кеше тестовых данных.
+    Страницы ~0 нужны читателю только ради паджинатора и в замеры не входят.
+    """
+    result = []
+    reader_folder = os.path.join(CACHE_FOLDER, 'reader')
+    for login in sorted(os.listdir(reader_folder)):
+        for filename in sorted(os.listdir(os.path.join(reader_folder, login, 'read'))):
+            if filename.startswith('~0.'):
+                continue
+            result.append(f'/reader/{login}/read/{os.path.splitext(filename)[0]}')
+    return result
+
+
+def scale_books(books: List[Dict], size: int) -> List[Dict]:
+    """
+    Размножает книги до size штук. Копии получают свои book_id и work_id, чтобы в БД они были отдельными книгами.
+    """
+    result = []
+    for n in range(size):
+        book = dict(books[n % len(books)])
+        copy = n // len(books)
+        if copy:
+            for key in ('book_id', 'work_id'):
+                if book.get(key):
+                    book[key] = book[key] + copy * 10 ** 10
+        result.append(book)
+    return result
+
+
+class Benchmark:
+    """
+    Набор замеров на тестовых данных.
+    :param sizes: количества книг для замеров на размноженных данных
+    :type sizes: List[int]
+    :param repeat: количество повторов, берется медиана
+    :type repeat: int
+    """
+
+    def __init__(self, sizes: List[int] = (1000, 10000), repeat: int = 5):
+        self.sizes = list(sizes)
+        self.repeat = repeat
+        self.config = Config(os.path.join(TESTS_FOLDER, '.env.reader'))
+        self.config.web_connection.cache_folder = CACHE_FOLDER
+        self.folder = tempfile.mkdtemp(prefix='livelib-benchmark-')
+        self.results = {}
+
+    def _add(self, name: str, items: int, times: List[float]) -> None:
+        seconds = statistics.median(times)
+        self.results[name] = {'items': items, 'seconds': round(seconds, 6), 'best': round(min(times), 6),
+                              'per_item_us': round(seconds / items * 1e6, 3)}
+        print(f'{name:55} {items:>8} {seconds:10.4f} с {seconds / items * 1e6:12.1f} мкс/шт')
+
+    def _run(self, name: str, items: int, function: Callable, setup: Callable = None) -> None:
+        try:
+            self._add(name, items, measure(function, self.repeat, setup))
+        except Exception as exc:
+            self.results[name] = {'items': items, 'error': repr(exc)}
+            print(f'{name:55} {items:>8} ошибка: {exc!r}')
+
+    def bench_pages(self) -> List[Dict]:
+        """
+        Замеры на страницах: получение из кеша, разбор страницы и разбор книг. Возвращает книги со всех страниц.
+        """
+        urls = fixture_urls()
+        web_connection = WebWithCache(self.config)
+        texts = [web_connection.get_page_text(i) for i in urls]
+        books = []
+        for parser in PARSERS:
+            documents = [parser.make_document(i) for i in texts]
+            blocks = [block for document in documents for block in book_blocks(parser, document)]
+            self._run(f'get_page_bs[{parser.__name__}]', len(urls),
+                      lambda: [web_connection.get_page_bs(i, parser) for i in urls])
+            self._run(f'all_books_from_page[{parser.__name__}]', len(urls),
+                      lambda: [parser.all_books_from_page(i) for i in documents])
+            self._run(f'book_per_function[{parser.__name__}]', len(blocks),
+                      lambda: [book_per_function(parser, i) for i in blocks])
+            self._run(f'book_plan[{parser.__name__}]', len(blocks), lambda: [parser.book(i) for i in blocks])
+            if not books:
+                books = [book for document in documents for book in parser.all_books_from_page(document)]
+        web_connection.close()
+        return books
+
+    def _new_reader(self) -> Reader:
+        self.config.db.sqlite_db = os.path.join(self.folder, 'benchmark.db')
+        if os.path.isfile(self.config.db.sqlite_db):
+            os.remove(self.config.db.sqlite_db)
+        reader = Reader('benchmark', None, SQLite3Connection(self.config, create_if_not_exist=True), None)
+        reader.register()
+        return reader
+
+    def bench_books(self, books: List[Dict]) -> None:
+        """
+        Замеры на книгах, размноженных до заданных количеств: подготовка для БД, сохранение в БД и экспорт.
+        """
+        self.config.export.xlsx.folder = self.folder
+        export = XLSXExport(self.config)
+        for size in self.sizes:
+            scaled = scale_books(books, size)
+            self._run(f'prepare_books_for_db@{size}', size, lambda: ParserForDB.prepare_books_for_db(scaled))
+            state = {}
+            self._run(f'save_read_books_in_db@{size}', size,
+                      lambda: state['reader']._save_read_books_in_db(scaled),
+                      setup=lambda: state.update(reader=self._new_reader()))
+            # в экспорт книги попадают из БД, где текст рецензии без разметки уже готов
+            rows = [dict(i, review_plain=ParserForDB.create_review_plain(i.get('review_text'))) for i in scaled]
+            self._run(f'create_file@{size}', size,
+                      lambda: export.create_file(rows, 'benchmark', parser_xlsx=ParserForXLSX))
+
+    def run(self) -> dict:
+        """
+        Выполняет все замеры и возвращает отчет.
+        :return: {'meta': {...}, 'results': {название замера: {'items', 'seconds', 'best', 'per_item_us'}}},
+            seconds и per_item_us - по медиане замеров, best - лучшее время
+        :rtype: dict
+        """
+        try:
+            self.bench_books(self.bench_pages())
+        finally:
+            shutil.rmtree(self.folder, ignore_errors=True)
+        return {'meta': {'date': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                         'python': platform.python_version(), 'platform': platform.platform(),
+                         'sqlite': sqlite3.sqlite_version, 'repeat': self.repeat, 'sizes': self.sizes},
+                'results': self.results}
+
+
+def compare(report: dict, baseline: dict, tolerance: float = 0.5, min_difference: float = 0.05) -> List[str]:
+    """
+    Сравнивает отчет с базовым по времени на одну единицу и возвращает список регрессий.
+    Замеры, которых нет в одном из отчетов, не сравниваются; замер, упавший с ошибкой, считается регрессией.
+    :param tolerance: допустимое замедление, 0.5 - на 50%
+    :type tolerance: float
+    :param min_difference: замедление всего замера в секундах, меньше которого регрессии нет при любом tolerance
+    :type min_difference: float
+    :return: строки с описанием регрессий
+    :rtype: List[str]
+    """
+    result = []
+    for name, base in baseline['results'].items():
+        current = report['results'].get(name)
+        if current is None or 'per_item_us' not in base:
+            continue
+        if 'error' in current:
+            result.append(f'{name}: ошибка {current["error"]}')
+        elif (current['per_item_us'] > base['per_item_us'] * (1 + tolerance) and
+              (current['per_item_us'] - base['per_item_us']) * current['items'] / 1e6 > min_difference):
+            result.append(f'{name}: {current["per_item_us"]} мкс/шт против {base["per_item_us"]} '
+                          f'({current["per_item_us"] / base["per_item_us"]:.2f}x)')
+    return result
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Бенчмарки разбора страниц, сохранения в БД и экспорта.')
+    arg_parser.add_argument('--sizes', type=int, nargs='*', default=[1000, 10000],
+                            help='количества книг для замеров на размноженных данных, например 1000 10000 100000')
+    arg_parser.add_argument('--repeat', type=int, default=5, help='количество повторов, берется медиана')
+    arg_parser.add_argument('--report', default='', help='файл для сохранения json-отчета')
+    arg_parser.add_argument('--baseline', default=BASELINE_FILE, help='базовый отчет для сравнения')
+    arg_parser.add_argument('--tolerance', type=float, default=0.5, help='допустимое замедление, 0.5 - на 50%%')
+    arg_parser.add_argument('--min-difference', type=float, default=0.05,
+                            help='замедление замера в секундах, меньше которого регрессии нет')
+    arg_parser.add_argument('--update-baseline', action='store_true', help='сохранить отчет как базовый')
+    args = arg_parser.parse_args()
+    report = Benchmark(args.sizes, args.repeat).run()
+    if args.report:
+        with open(args.report, mode='w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=1)
+    if args.update_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, mode='w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=1)
+        print('Базовый отчет сохранен в', args.baseline)
+    elif os.path.isfile(args.baseline):
+        with open(args.baseline, mode='r', encoding='utf-8') as f:
+            regressions = compare(report, json.load(f), args.tolerance, args.min_difference)
+        for i in regressions:
+            print('Регрессия:', i)
+        print('Регрессий нет' if not regressions else f'Регрессий: {len(regressions)}')
+        sys.exit(1 if regressions else 0)
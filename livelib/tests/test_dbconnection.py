@@ -9,8 +9,9 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 from utils import get_correct_filename, CustomUnitTest, remove_file, create_logger_for_tests
 
 import sqlite3
+import threading
 import unittest
-from livelib import SQLite3Connection, Config, WebWithCache, BookDataFormatter, ParserFromHTML
+from livelib import SQLite3Connection, Config, WebWithCache, BookDataFormatter, ParserFromHTML, ParserForXLSX
 import logging
 
 
@@ -108,6 +109,214 @@ class TestDBConnection(CustomUnitTest):
         # удаляем тестовую базу данных
         remove_file(special_config.db.sqlite_db, 'Remove test database', 'Can not remove test database')
 
+    def test_update_db(self):
+        special_config = copy.deepcopy(self.config)
+        special_config.db.sqlite_db = get_correct_filename('update_db.db', self.test_folder)
+        # база данных прошлой версии, без колонок review_plain и position
+        old_formatter = type('OldFormatter', (BookDataFormatter,),
+                             {'readbook_properties_db': ['review_text', 'review_id', 'tags', 'reader_rating',
+                                                         'month', 'year']})
+        sqlite3.connect(special_config.db.sqlite_db).close()
+        old = SQLite3Connection(special_config)
+        # у прошлой версии и миграций было меньше
+        old.migrations = SQLite3Connection.migrations[:1]
+        old.create_db(old_formatter)
+        review = '<p>Первый абзац</p>\n<p>Второй <b>абзац</b></p>'
+        old.run_single_sql('INSERT INTO ReadBook (book_id, reader_id, review_text) VALUES (1, 1, ?)', (review,))
+        old.run_single_sql('INSERT INTO ReadBook (book_id, reader_id, review_text) VALUES (2, 1, NULL)')
+        with self.subTest('Testing new columns are added on connection'):
+            con = SQLite3Connection(special_config)
+            columns = [i['name'] for i in con.run_single_sql('PRAGMA table_info (ReadBook)')]
+            self.assertIn('review_plain', columns)
+            self.assertIn('position', columns)
+            self.assertEqual([], con.update_db(BookDataFormatter))
+        with self.subTest('Testing backfill of plain reviews'):
+            self.assertEqual(1, con.backfill_review_plain(batch_size=1))
+            rows = con.run_single_sql('SELECT review_plain FROM ReadBook ORDER BY book_id')
+            self.assertEqual([ParserForXLSX.create_review_text(review), None], [i['review_plain'] for i in rows])
+            self.assertEqual(0, con.backfill_review_plain())
+        remove_file(special_config.db.sqlite_db, 'Remove test database', 'Can not remove test database')
+
+    def test_ingest_read_books(self):
+        special_config = copy.deepcopy(self.config)
+        special_config.db.sqlite_db = get_correct_filename('ingest.db', self.test_folder)
+        with SQLite3Connection(special_config, create_if_not_exist=True) as con:
+            # маленькое ограничение, чтобы книги искались несколькими пачками
+            con.max_variables = 5
+            fields = ['book_id', 'work_id', 'book_name']
+            books = [[1, None, 'a'], [2, 20, 'b'], [None, 30, 'c'], [3, None, 'd'], [1, None, 'a again'],
+                     [None, 40, 'e'], [4, 50, 'f']]
+            read_books = [[n] for n in range(len(books))]
+            with self.subTest('Testing books and links are saved'):
+                self.assertEqual(6, con.ingest_read_books(1, books, fields, read_books, ['reader_rating']))
+                rows = con.run_single_sql('SELECT Book.book_id, Book.work_id, Book.book_name, reader_rating '
+                                          'FROM ReadBook JOIN Book ON Book.id = ReadBook.book_id ORDER BY reader_rating')
+                self.assertEqual([(1, None, 'a', 0), (2, 20, 'b', 1), (None, 30, 'c', 2), (3, None, 'd', 3),
+                                  (None, 40, 'e', 5), (4, 50, 'f', 6)], [tuple(i.values()) for i in rows])
+            with self.subTest('Testing saved books and links are not duplicated'):
+                self.assertEqual(0, con.ingest_read_books(1, books, fields, read_books, ['reader_rating']))
+                self.assertEqual(6, con.ingest_read_books(2, books, fields, read_books, ['reader_rating']))
+                self.assertEqual([{'n': 6}], con.run_single_sql('SELECT count(*) AS n FROM Book'))
+            with self.subTest('Testing nothing to save'):
+                self.assertEqual(0, con.ingest_read_books(3, [], fields, [], ['reader_rating']))
+            with self.subTest('Testing new books are prepended in their order'):
+                # книги 1 и 2 уже есть в Book у других читателей, поэтому запрос находит их первыми
+                sql = 'SELECT Book.book_id FROM ReadBook JOIN Book ON Book.id = ReadBook.book_id ' \
+                      'WHERE reader_id=? ORDER BY position, ReadBook.id'
+                stored = [[60, None, 'g'], [70, None, 'h']]
+                con.ingest_read_books(4, stored, fields, [[0]] * len(stored), ['reader_rating'])
+                new = [[9, None, 'i'], [2, 20, 'b'], [8, None, 'j'], [1, None, 'a']]
+                self.assertEqual(4, con.ingest_read_books(4, new, fields, [[0]] * len(new), ['reader_rating'],
+                                                          prepend=True))
+                self.assertEqual([{'book_id': i} for i in (9, 2, 8, 1, 60, 70)], con.run_single_sql(sql, (4,)))
+        remove_file(special_config.db.sqlite_db, 'Remove test database', 'Can not remove test database')
+
+    def test_connection_lifecycle(self):
+        special_config = copy.deepcopy(self.config)
+        special_config.db.sqlite_db = get_correct_filename('lifecycle.db', self.test_folder)
+        with SQLite3Connection(special_config, create_if_not_exist=True) as con:
+            with self.subTest('Testing one connection is reused by all queries of a thread'):
+                connection = con._get_connection()
+                con.run_single_sql("CREATE TABLE Foo (col1 INTEGER)")
+                con.insert_values('Foo', [{'col1': 1}, {'col1': 2}])
+                self.assertTrue(con.table_exists('Foo'))
+                self.assertIs(connection, con._get_connection())
+            with self.subTest('Testing other threads get their own connections'):
+                result = []
+                thread = threading.Thread(target=lambda: result.append(
+                    (con._get_connection(), con.run_single_sql('SELECT count(*) AS n FROM Foo'))))
+                thread.start()
+                thread.join()
+                self.assertIsNot(connection, result[0][0])
+                self.assertEqual([{'n': 2}], result[0][1])
+            with self.subTest('Testing failed query does not leave a transaction open'):
+                self.assertIsNone(con.run_single_sql('INSERT INTO Bar VALUES (1)'))
+                self.assertFalse(connection.in_transaction)
+        with self.subTest('Testing connections are closed on exit and reopened on the next query'):
+            with self.assertRaises(sqlite3.ProgrammingError):
+                connection.execute('SELECT 1')
+            self.assertEqual([{'n': 2}], con.run_single_sql('SELECT count(*) AS n FROM Foo'))
+            con.close()
+        remove_file(special_config.db.sqlite_db, 'Remove test database', 'Can not remove test database')
+
+    def test_profile(self):
+        special_config = copy.deepcopy(self.config)
+        special_config.db.sqlite_db = get_correct_filename('profile.db', self.test_folder)
+        pragmas = ['journal_mode', 'synchronous', 'cache_size', 'mmap_size', 'temp_store', 'busy_timeout']
+
+        def current_pragmas(con):
+            return {i: list(con.run_single_sql(f'PRAGMA {i}')[0].values())[0] for i in pragmas}
+
+        with self.subTest('Testing journal mode is not changed by default and by export profile'):
+            self.assertEqual('none', self.config.db.profile)
+            for profile in ('none', 'export'):
+                special_config.db.profile = profile
+                with SQLite3Connection(special_config, create_if_not_exist=True) as con:
+                    self.assertEqual('delete', current_pragmas(con)['journal_mode'])
+                remove_file(special_config.db.sqlite_db, 'Remove test database', 'Can not remove test database')
+        with self.subTest('Testing crawler profile'):
+            special_config.db.profile = 'crawler'
+            with SQLite3Connection(special_config, create_if_not_exist=True) as con:
+                self.assertEqual({'journal_mode': 'wal', 'synchronous': 1, 'cache_size': -64000,
+                                  'mmap_size': 268435456, 'temp_store': 2, 'busy_timeout': 5000}, current_pragmas(con))
+        with self.subTest('Testing profile values are replaced from config'):
+            special_config.db.profile = 'export'
+            special_config.db.pragmas = {'synchronous': 'FULL', 'mmap_size': '0'}
+            with SQLite3Connection(special_config) as con:
+                result = current_pragmas(con)
+                self.assertEqual((2, 0, -262144), (result['synchronous'], result['mmap_size'], result['cache_size']))
+        with self.subTest('Testing unknown profile and pragmas'):
+            with self.assertRaises(ValueError):
+                SQLite3Connection.get_pragmas('fastest')
+            with self.assertRaises(ValueError):
+                SQLite3Connection.get_pragmas('none', {'journal_mode': 'OFF; DROP TABLE Book'})
+            with self.assertRaises(ValueError):
+                SQLite3Connection.get_pragmas('none', {'foreign_keys': 'ON'})
+        remove_file(special_config.db.sqlite_db, 'Remove test database', 'Can not remove test database')
+
+    def test_migrate(self):
+        special_config = copy.deepcopy(self.config)
+        special_config.db.sqlite_db = get_correct_filename('migrate.db', self.test_folder)
+        # база данных, созданная до появления миграций: индексов и таблицы версий в ней нет,
+        # и у читателя old_reader есть второй экземпляр со своими книгами
+        SQLite3Connection(special_config, create_if_not_exist=True).close()
+        with sqlite3.connect(special_config.db.sqlite_db) as old:
+            for sql in ('DROP INDEX idx_reader_login', 'DROP INDEX idx_readbook_reader',
+                        'DROP INDEX idx_readbook_position', 'DROP TABLE SchemaVersion'):
+                old.execute(sql)
+            books = [old.execute('INSERT INTO Book (book_id) VALUES (?)', (i,)).lastrowid for i in (1, 2)]
+            login = 'old_reader'
+            reader_id = old.execute('INSERT INTO Reader (login) VALUES (?)', (login,)).lastrowid
+            duplicate_id = old.execute('INSERT INTO Reader (login) VALUES (?)', (login,)).lastrowid
+            old.executemany('INSERT INTO ReadBook (book_id, reader_id, tags) VALUES (?, ?, ?)',
+                            [(books[0], reader_id, 'first'), (books[0], duplicate_id, 'second'),
+                             (books[1], duplicate_id, 'second')])
+        old.close()
+
+        def plan(sql, params=()):
+            return [i['detail'] for i in con.run_single_sql(f'EXPLAIN QUERY PLAN {sql}', params)]
+
+        with SQLite3Connection(special_config) as con:
+            with self.subTest('Testing migration is not applied over duplicate logins'):
+                self.assertEqual(0, con.get_schema_version())
+                with self.assertRaisesRegex(ValueError, login):
+                    con.migrate()
+                self.assertEqual(3, con.run_single_sql('SELECT count(*) AS n FROM ReadBook')[0]['n'])
+            with self.subTest('Testing duplicate readers are merged with their books'):
+                self.assertEqual({login: 1}, con.merge_duplicate_readers())
+                self.assertEqual([{'id': reader_id}],
+                                 con.run_single_sql('SELECT id FROM Reader WHERE login=?', (login,)))
+                self.assertEqual([{'book_id': books[0], 'tags': 'first'}, {'book_id': books[1], 'tags': 'second'}],
+                                 con.run_single_sql('SELECT book_id, tags FROM ReadBook WHERE reader_id=? ORDER BY id',
+                                                    (reader_id,)))
+            with self.subTest('Testing database is migrated in place'):
+                self.assertEqual([1, 2], con.migrate())
+                self.assertEqual(len(SQLite3Connection.migrations), con.get_schema_version())
+                indexes = {i['name'] for i in con.run_single_sql("SELECT name FROM sqlite_master WHERE type='index'")}
+                self.assertTrue({'idx_reader_login', 'idx_readbook_reader', 'idx_readbook_position'} <= indexes)
+                with self.assertRaises(sqlite3.IntegrityError), sqlite3.connect(special_config.db.sqlite_db) as new:
+                    new.execute('INSERT INTO Reader (login) VALUES (?)', (login,))
+                new.close()
+            with self.subTest('Testing query plans use indexes'):
+                details = plan('SELECT * FROM Reader WHERE login=?', (login,))
+                self.assertTrue(any('idx_reader_login' in i for i in details), details)
+                queries = ('SELECT Book.book_id, ReadBook.tags FROM Book '
+                           'INNER JOIN ReadBook ON Book.id=ReadBook.book_id '
+                           'WHERE ReadBook.reader_id=? ORDER BY ReadBook.position, ReadBook.id',
+                           'SELECT ReadBook.id AS id, Book.book_id AS book_id, Book.work_id AS work_id '
+                           'FROM ReadBook INNER JOIN Book ON Book.id=ReadBook.book_id WHERE ReadBook.reader_id=?',
+                           'DELETE FROM ReadBook WHERE reader_id=?')
+                for sql in queries:
+                    details = plan(sql, (reader_id,))
+                    self.assertTrue(any('idx_readbook_' in i for i in details), details)
+                    self.assertFalse(any(i.startswith('SCAN') or 'TEMP B-TREE' in i for i in details), details)
+            with self.subTest('Testing migrations are applied once'):
+                self.assertEqual([], con.migrate())
+        with self.subTest('Testing new database is created with indexes'):
+            remove_file(special_config.db.sqlite_db, 'Remove test database', 'Can not remove test database')
+            with SQLite3Connection(special_config, create_if_not_exist=True) as con:
+                self.assertEqual(len(SQLite3Connection.migrations), con.get_schema_version())
+                self.assertEqual([], con.migrate())
+        remove_file(special_config.db.sqlite_db, 'Remove test database', 'Can not remove test database')
+
+    def test_iter_sql(self):
+        special_config = copy.deepcopy(self.config)
+        special_config.db.sqlite_db = get_correct_filename('iter_sql.db', self.test_folder)
+        with SQLite3Connection(special_config, create_if_not_exist=True) as con:
+            con.insert_values('Book', [(i, f'Книга {i}') for i in range(1, 26)], ['book_id', 'book_name'])
+            sql = 'SELECT book_id, book_name FROM Book ORDER BY book_id'
+            with self.subTest('Testing rows are read in batches'):
+                self.assertEqual(con.run_single_sql(sql), list(con.iter_sql(sql, batch_size=10)))
+            with self.subTest('Testing rows are collected in records'):
+                record = BookDataFormatter.record()
+                rows = list(con.iter_sql('SELECT id, book_id, book_name FROM Book WHERE book_id > ? ORDER BY book_id',
+                                         (20,), batch_size=2, record=record))
+                self.assertEqual([record(book_id=i, book_name=f'Книга {i}') for i in range(21, 26)], rows)
+            with self.subTest('Testing errors are raised'):
+                with self.assertRaises(sqlite3.Error):
+                    list(con.iter_sql('SELECT * FROM NoTable'))
+        remove_file(special_config.db.sqlite_db, 'Remove test database', 'Can not remove test database')
+
     def test_table_exists(self):
         special_config = copy.deepcopy(self.config)
         special_config.db.sqlite_db = get_correct_filename('db.db', '/data/sample/test_sqlite3/table_exists/')
@@ -9,6 +9,8 @@ from utils import get_correct_filename, CustomUnitTest, remove_file, create_logg
 import unittest
 import logging
 import random
+import re
+import zipfile
 import openpyxl
 from livelib import *
 
@@ -85,3 +87,35 @@ class TestXLSXExport(CustomUnitTest):
             my_reader.delete_read_books()
             # удаляем файл экспорта
             remove_file(output_filename)
+
+    def test_create_file_hyperlinks(self):
+        # ссылок в файле больше, чем строк, их связи собирает подмененный список _RelationshipList
+        with self.subTest('Testing relationships of openpyxl sheet writer are replaced'):
+            ws = openpyxl.Workbook(write_only=True).create_sheet()
+            ws.append(['title'])
+            self.assertTrue(XLSXExport._fast_relationships(ws))
+            ws.close()
+        books = []
+        for i in range(300):
+            book = {key: None for key in BookDataFormatter.all_properties_db()}
+            book.update(book_id=1000 + i, author_id=i, book_name=f'Книга {i}', picture_url=f'https://img/{i}.jpg',
+                        review_id=i if i % 2 else None, month=1, year=2020)
+            books.append(book)
+        filename = self.export.create_file(iter(books), 'hyperlinks', parser_xlsx=ParserForXLSX)
+        properties = BookDataFormatter.all_properties_xlsx()
+        links = ('author_id', 'book_id', 'work_id', 'picture_url', 'review_id')
+        wb = openpyxl.load_workbook(filename)
+        ws = wb.active
+        with self.subTest('Testing hyperlinks are saved for every book'):
+            for row, book in enumerate(books, start=2):
+                prepared_book = ParserForXLSX.prepare_book_for_xlsx(book)
+                for i in links:
+                    hyperlink = ws.cell(row, properties[i]['order']).hyperlink
+                    self.assertEqual(prepared_book[i] or None, hyperlink.target if hyperlink else None)
+        wb.close()
+        with self.subTest('Testing relationship ids are unique'):
+            with zipfile.ZipFile(filename) as f:
+                ids = re.findall(r'Id="(rId\d+)"', f.read('xl/worksheets/_rels/sheet1.xml.rels').decode('utf-8'))
+            self.assertEqual(3 * len(books) + len(books) // 2, len(ids))
+            self.assertEqual(len(ids), len(set(ids)))
+        remove_file(filename)
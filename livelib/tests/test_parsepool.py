@@ -0,0 +1,83 @@
+import os, sys
+
+# скрипт для правильной отработки тестов в github.actions
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils import get_correct_filename, create_logger_for_tests, load_reader_pages
+
+import shutil
+import tempfile
+import unittest
+from bs4 import BeautifulSoup as bs
+from livelib import Config, ParserFromHTML, ParserFromLXML, Reader, WebWithCache, SQLite3Connection
+from livelib.parsepool import ParsePool, book_fields, reparse_readers
+
+
+class TestParsePool(unittest.TestCase):
+    config_file: str = '.env.reader'
+    cache_folder: str = 'data/sample/test_reader/get_read_books_from_web/cache'
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        create_logger_for_tests('test_parsepool.log')
+        cls.config = Config(get_correct_filename(cls.config_file, ''))
+        cls.config.web_connection.cache_folder = get_correct_filename('', cls.cache_folder)
+        # тест пишет в базу данных книги нескольких читателей, поэтому работает с копией тестовой БД
+        cls.temp_folder = tempfile.mkdtemp(prefix='livelib-parsepool-')
+        shutil.copyfile(get_correct_filename(cls.config.db.sqlite_db, ''), os.path.join(cls.temp_folder, 'main.db'))
+        cls.config.db.sqlite_db = os.path.join(cls.temp_folder, 'main.db')
+        cls.pages = list(load_reader_pages().values())
+        with open(get_correct_filename('captcha.html', 'data/sample/test_parser/captcha'), encoding='utf-8') as f:
+            cls.captcha = f.read()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        shutil.rmtree(cls.temp_folder, ignore_errors=True)
+
+    def test_parse_texts(self):
+        texts = [self.pages[1], None, self.captcha, self.pages[2], self.pages[3]]
+        for parser in (ParserFromHTML, ParserFromLXML):
+            fields = book_fields(parser)
+            with ParsePool(parser, workers=2) as pool:
+                result = pool.parse_texts(texts)
+            with self.subTest(f'Testing pages are returned in order by {parser.__name__}'):
+                for number, page in ((0, 1), (3, 2), (4, 3)):
+                    expected = [{i: book.get(i) for i in fields}
+                                for book in parser.all_books_from_page(parser.make_document(self.pages[page]))]
+                    self.assertEqual(expected, result[number])
+            with self.subTest(f'Testing missing and captcha pages by {parser.__name__}'):
+                self.assertIs(False, result[1])
+                self.assertIs(False, result[2])
+            with self.subTest(f'Testing pages passed as bytes by {parser.__name__}'):
+                with ParsePool(parser, workers=2) as pool:
+                    self.assertEqual(result, pool.parse_texts([i.encode('utf-8') if i else i for i in texts]))
+
+    def test_parse_paginators(self):
+        with ParsePool(workers=2) as pool:
+            self.assertEqual([[1, 2, 3], None, None], pool.parse_paginators([self.pages[0], None, self.captcha]))
+
+    def test_reader_with_pool(self):
+        # книги, разобранные в пуле, те же, что и при разборе в текущем процессе
+        db_connection = SQLite3Connection(self.config)
+        web_connection = WebWithCache(self.config)
+        expected = Reader('Humming_Bird', web_connection, db_connection, None)
+        expected.register()
+        expected.delete_read_books()
+        books = expected.get_read_books_from_web()
+        books_in_db = expected.get_read_books_from_db()
+        with ParsePool(workers=2) as pool:
+            reader = Reader('Humming_Bird', web_connection, db_connection, None, parse_pool=pool)
+            reader.register()
+            reader.delete_read_books()
+            self.assertEqual(books, reader.get_read_books_from_web())
+        with self.subTest('Testing reparse of readers from cache'):
+            result = reparse_readers(['Humming_Bird', 'Eugenia_Novik'], self.config, workers=2, batch_size=1)
+            self.assertEqual(len(books), result['Humming_Bird'])
+            self.assertEqual(books_in_db, reader.get_read_books_from_db())
+            self.assertLess(0, result['Eugenia_Novik'])
+        web_connection.close()
+        db_connection.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
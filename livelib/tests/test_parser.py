@@ -4,13 +4,16 @@ import os, sys
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 import unittest
+import copy
 import json
+import pickle
 import bs4
 from bs4 import BeautifulSoup as bs
 import logging
 
 from utils import get_correct_filename, CustomUnitTest, create_logger_for_tests
-from livelib import Parser, ParserFromHTML, WebWithCache, Config
+from livelib import Parser, ParserFromHTML, ParserFromLXML, WebWithCache, Config
+from livelib.parser import get_html_parser, BookDataFormatter, ParserForDB, ParserForXLSX
 
 class TestParser(CustomUnitTest):
     pass
@@ -42,15 +45,14 @@ class TestParserfromHTML(TestParser):
             cases = json.load(f)
             for i in cases:
                 with self.subTest(f'Test with {i["html"]}'):
-                    text = bs(self.web_connection.get_page_text(self.parser.reader_read_books_page(i["html"])), 'lxml')
+                    text = self._str_to_bs(self.web_connection.get_page_text(self.parser.reader_read_books_page(i["html"])))
                     self.assertEqual(i["404_status"], self.parser.check_404(text))
 
     def test_check_captcha(self):
         def check_captcha_from_file(filename):
             filename = get_correct_filename(filename, os.path.join(self.test_folder, 'captcha'))
-            config = Config(get_correct_filename(self.config_file, ''))
             with open(filename, mode = 'r', encoding='utf-8') as f:
-                bsoup = bs4.BeautifulSoup(f, features=config.bs_parser.features)
+                bsoup = self._str_to_bs(f.read())
             return self.object.check_captcha(bsoup)
 
         with self.subTest('Testing captcha page'):
@@ -107,8 +109,162 @@ class TestParserfromHTML(TestParser):
     def test_get_review_id(self):
         self.process_html_compare_to_json('get_review_id', 'review_id')
 
+    def test_targeted_parse(self):
+        # частичный разбор страницы дает те же книги и паджинатор, что и полный
+        folder = get_correct_filename('', 'data/sample/test_reader/get_read_books_from_web/cache/reader/humming_bird/read')
+        for i in range(1, 4):
+            with self.subTest(f'Testing page ~{i}'):
+                with open(os.path.join(folder, f'~{i}.html'), encoding='utf-8') as f:
+                    text = f.read()
+                full = self.object.make_document(text, 'lxml')
+                targeted = self.object.make_document(text, 'lxml', targeted=True)
+                self.assertEqual(self.object.all_books_from_page(full), self.object.all_books_from_page(targeted))
+                self.assertEqual(self.object.get_paginator(full), self.object.get_paginator(targeted))
+
+    def test_check_text(self):
+        with self.subTest('Testing 404 by title'):
+            self.assertTrue(self.object.check_404_text('<html><head><title id="title-head">404 @ LiveLib</title>'))
+            self.assertFalse(self.object.check_404_text('<title id="title-head">Humming_Bird прочитала</title>'))
+        with self.subTest('Testing captcha by text'):
+            filename = get_correct_filename('captcha.html', os.path.join(self.test_folder, 'captcha'))
+            with open(filename, mode='r', encoding='utf-8') as f:
+                self.assertTrue(self.object.check_captcha_text(f.read()))
+
+    def test_extraction_plan(self):
+        # разбор книги по плану дает то же, что и вызов каждого метода парсера по отдельности
+        folder = get_correct_filename('', 'data/sample/test_reader/get_read_books_from_web/cache/reader/humming_bird/read')
+        with open(os.path.join(folder, '~1.html'), encoding='utf-8') as f:
+            document = self._str_to_bs(f.read())
+        formatter_parser = BookDataFormatter.all_properties_parser()
+        blocks = self._book_blocks(document)
+        with self.subTest('Testing plan against parser functions'):
+            for block in blocks:
+                expected = {i: getattr(self.object, j)(block) for i, j in formatter_parser.items()
+                            if hasattr(self.object, j)}
+                self.assertEqual(expected, self.object.book(block))
+        with self.subTest('Testing plan is cached'):
+            self.assertIs(self.object.extraction_plan(), self.object.extraction_plan(BookDataFormatter))
+        with self.subTest('Testing overridden parser function is used'):
+            parser = type('ParserWithTags', (self.object,), {'get_tags': staticmethod(lambda x: 'tag')})
+            self.assertEqual('tag', parser.book(blocks[0])['tags'])
+            self.assertEqual(self.object.book(blocks[0])['book_id'], parser.book(blocks[0])['book_id'])
+
+    def _book_blocks(self, document) -> list:
+        return document.find_all('div', class_='book-item-manage')
+
+
+class TestParserFromLXML(TestParserfromHTML):
+    """
+    Те же тесты, что и для ParserFromHTML, на тех же данных, но страницы разбираются ParserFromLXML.
+    """
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        super().setUpClass()
+        cls.parser = ParserFromLXML
+        cls.object = ParserFromLXML
+
+    def _str_to_bs(self, x: str):
+        return ParserFromLXML.make_document(x)
+
+    def _book_blocks(self, document) -> list:
+        return document.getroot().find_class('book-item-manage')
+
+    def test_reader_pages(self):
+        # на полных страницах читателя результаты обоих парсеров совпадают
+        folder = get_correct_filename('', 'data/sample/test_reader/get_read_books_from_web/cache/reader/humming_bird/read')
+        for i in range(1, 4):
+            with self.subTest(f'Testing page ~{i}'):
+                with open(os.path.join(folder, f'~{i}.html'), encoding='utf-8') as f:
+                    text = f.read()
+                self.assertEqual(ParserFromHTML.all_books_from_page(bs(text, 'lxml')),
+                                 ParserFromLXML.all_books_from_page(ParserFromLXML.make_document(text)))
+
+    def test_get_html_parser(self):
+        config = Config(get_correct_filename(self.config_file, ''))
+        with self.subTest('Testing default parser'):
+            self.assertIs(ParserFromHTML, get_html_parser(config))
+        with self.subTest('Testing lxml parser'):
+            config.bs_parser.parser = 'lxml'
+            self.assertIs(ParserFromLXML, get_html_parser(config))
+        with self.subTest('Testing web connection builds document with parser'):
+            config.web_connection.cache_folder = get_correct_filename(
+                '', 'data/sample/test_reader/get_read_books_from_web/cache')
+            page = WebWithCache(config).get_page_bs('/reader/Humming_Bird/read/~0', ParserFromLXML)
+            self.assertEqual([1, 2, 3], ParserFromLXML.get_paginator(page))
+
+
+class TestBookDataFormatter(unittest.TestCase):
+
+    def test_compiled_views(self):
+        formatter = type('Formatter', (BookDataFormatter,), {'common': dict(BookDataFormatter.common)})
+        xlsx = formatter.all_properties_xlsx()
+        with self.subTest('Testing views are built once and read only'):
+            self.assertIs(xlsx, formatter.all_properties_xlsx())
+            self.assertIs(formatter.all_properties_db(), formatter.all_properties_db())
+            self.assertEqual(sorted(i['order'] for i in xlsx.values()), [i['order'] for i in xlsx.values()])
+            with self.assertRaises(TypeError):
+                xlsx['tags'] = {}
+            with self.assertRaises(TypeError):
+                xlsx['tags']['order'] = 1
+        with self.subTest('Testing views are rebuilt for new common'):
+            formatter.common = {i: j for i, j in formatter.common.items() if i != 'tags'}
+            self.assertNotIn('tags', formatter.all_properties_xlsx())
+            self.assertNotIn('tags', formatter.record().fields)
+        with self.subTest('Testing invalidate after change in place'):
+            self.assertIn('book_name', formatter.all_properties_db())
+            del formatter.common['book_name']
+            self.assertIn('book_name', formatter.all_properties_db())
+            formatter.invalidate()
+            self.assertNotIn('book_name', formatter.all_properties_db())
+            self.assertNotIn('book_name', [i[0] for i in ParserForXLSX.xlsx_plan(formatter)])
+        with self.subTest('Testing column definitions'):
+            self.assertEqual(('book_id INTEGER', 'tags TEXT'), BookDataFormatter.db_columns(['book_id', 'tags']))
+
+
+class TestBookRecord(unittest.TestCase):
+
+    def test_record(self):
+        record = BookDataFormatter.record()
+        book = record({'book_id': 1, 'book_name': 'Книга'}, tags='')
+        with self.subTest('Testing record class is cached'):
+            self.assertIs(record, BookDataFormatter.record())
+        with self.subTest('Testing record behaves like dict'):
+            self.assertEqual({'book_id': 1, 'book_name': 'Книга', 'tags': ''}, book)
+            self.assertEqual(['book_id', 'book_name', 'tags'], sorted(book))
+            self.assertIsNone(book.get('review_text'))
+            self.assertNotIn('review_text', book)
+            with self.assertRaises(KeyError):
+                book['review_text']
+            book['review_text'] = None
+            self.assertIn('review_text', book)
+            self.assertEqual(4, len(book))
+        with self.subTest('Testing unknown property'):
+            with self.assertRaises(KeyError):
+                book['unknown'] = 1
+        with self.subTest('Testing record from row, copy and pickle'):
+            self.assertEqual(book, record.from_row(list(book.keys()), list(book.values())))
+            self.assertEqual(book.to_dict(), pickle.loads(pickle.dumps(book)))
+            self.assertEqual(book, copy.deepcopy(book))
+        with self.subTest('Testing record is smaller than dict'):
+            values = {i: None for i in BookDataFormatter.all_properties_parser()}
+            self.assertLess(sys.getsizeof(record(values)), sys.getsizeof(values))
+
+
 class TestParserForDB(unittest.TestCase):
-    pass
+
+    def test_create_review_plain(self):
+        # текст рецензии, сохраняемый в БД, совпадает с тем, что экспорт раньше получал из html
+        folder = get_correct_filename('', 'data/sample/test_parser/review_text')
+        for i in sorted(os.listdir(folder)):
+            with self.subTest(f'Testing review {i}'):
+                with open(os.path.join(folder, i, 'correct_output.json'), encoding='utf-8') as f:
+                    text = json.load(f)
+                if text is not None:
+                    self.assertEqual(ParserForXLSX.create_review_text(text), ParserForDB.create_review_plain(text))
+        with self.subTest('Testing empty review'):
+            self.assertIsNone(ParserForDB.create_review_plain(None))
+            self.assertEqual('', ParserForDB.create_review_plain(''))
 
 if __name__ == '__main__':
     unittest.main()
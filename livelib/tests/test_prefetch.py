@@ -0,0 +1,78 @@
+import os, sys
+
+# скрипт для правильной отработки тестов в github.actions
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils import get_correct_filename, create_logger_for_tests, FakeSession, FakeResponse, load_reader_pages, \
+    fake_reader_responses
+
+import shutil
+import unittest
+from livelib import WebWithCache, CircuitBreaker, Config, ParserFromHTML
+from livelib.prefetch import Prefetcher
+
+
+class TestPrefetcher(unittest.TestCase):
+    config_file: str = '.env.webconnection'
+    reader_name: str = 'Humming_Bird'
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        create_logger_for_tests('test_prefetch.log')
+        cls.config_file = get_correct_filename(filename=cls.config_file, folder='')
+        cls.test_folder = Config(cls.config_file).web_connection.cache_folder
+        cls.progress_file = cls.test_folder + '/prefetch.json'
+        with open(get_correct_filename('captcha.html', 'data/sample/test_parser/captcha'), encoding='utf-8') as f:
+            cls.captcha = f.read()
+        cls.pages = load_reader_pages(cls.reader_name)
+
+    def tearDown(self) -> None:
+        if os.path.isdir(self.test_folder):
+            shutil.rmtree(self.test_folder)
+
+    def _create_web(self, responses: dict) -> WebWithCache:
+        web = WebWithCache(Config(self.config_file),
+                           circuit_breaker=CircuitBreaker(base_delay=0.01, max_delay=0.01, max_retries=1))
+        web.web.session = FakeSession(responses)
+        return web
+
+    def test_run(self):
+        os.makedirs(self.test_folder, exist_ok=True)
+        captcha_url = f'http://www.livelib.ru/reader/{self.reader_name}/read/~3'
+        responses = {url: FakeResponse(text) for url, text in self.pages.items()}
+        responses[captcha_url] = FakeResponse(self.captcha)
+        web = self._create_web(responses)
+        with self.subTest('Testing pages are saved in cache'):
+            progress = Prefetcher(web, self.progress_file).run([self.reader_name])
+            self.assertEqual({}, progress['done'])
+            self.assertEqual([f'/reader/{self.reader_name}/read/~3'], progress['failed'][self.reader_name])
+            for i in range(3):
+                self.assertTrue(web.storage.contains(f'/reader/humming_bird/read/~{i}'))
+        with self.subTest('Testing failed reader is prefetched again from cache'):
+            web = self._create_web({captcha_url: FakeResponse(self.pages[captcha_url])})
+            progress = Prefetcher(web, self.progress_file).run([self.reader_name])
+            self.assertEqual({self.reader_name: 4}, progress['done'])
+            self.assertEqual({}, progress['failed'])
+            self.assertEqual([captcha_url], [i[0] for i in web.web.session.requests])
+        with self.subTest('Testing prefetched reader is skipped'):
+            web = self._create_web({})
+            Prefetcher(web, self.progress_file).run([self.reader_name])
+            self.assertEqual([], web.web.session.requests)
+
+    def test_parser_html(self):
+        # капча определяется парсером, переданным в Prefetcher
+        os.makedirs(self.test_folder, exist_ok=True)
+        blocked_text = self.pages[f'http://www.livelib.ru/reader/{self.reader_name}/read/~2']
+
+        class BlockingParser(ParserFromHTML):
+            @staticmethod
+            def check_captcha_text(text: str or bytes) -> bool:
+                return text == blocked_text or ParserFromHTML.check_captcha_text(text)
+
+        web = self._create_web(fake_reader_responses(self.reader_name))
+        progress = Prefetcher(web, self.progress_file, parser_html=BlockingParser).run([self.reader_name])
+        self.assertEqual([f'/reader/{self.reader_name}/read/~2'], progress['failed'][self.reader_name])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -13,7 +13,8 @@ from livelib import *
 import logging
 import datetime
 
-from utils import get_correct_filename, CustomUnitTest, remove_file, create_logger_for_tests
+from utils import get_correct_filename, CustomUnitTest, remove_file, create_logger_for_tests, FakeSession, \
+    FakeResponse, fake_reader_responses
 
 
 class TestReader(CustomUnitTest):
@@ -172,6 +173,91 @@ class TestReader(CustomUnitTest):
         with self.subTest(f'Checking new update time for {reader_name}'):
             self.assertNotEqual(old_update_time, r.get_update_time())
 
+    def test_update_books_incremental(self):
+        reader_name = 'Ilaritagli'
+        special_config = copy.deepcopy(self.config)
+        special_config.web_connection.cache_folder = get_correct_filename('', 'data/sample/test_reader/update_books/cache')
+
+        def new_reader():
+            r = Reader(reader_name, WebWithCache(special_config), self.db_connection, self.export)
+            r.register()
+            return r
+
+        r = new_reader()
+        books = r.update_books(full=True)
+        expected = r.get_read_books_from_db()
+        with self.subTest('Testing full update'):
+            self.assertGreater(len(books), 20)
+            self.assertIsNotNone(r.get_full_update_time())
+        with self.subTest('Testing nothing changed: only first page is requested'):
+            r = new_reader()
+            self.assertEqual([], r.update_books())
+            self.assertEqual(1, r.web_connection.get_stats()['text_misses'])
+            self.assertEqual(expected, r.get_read_books_from_db())
+        with self.subTest('Testing new and changed books on first page'):
+            first, second = books[0], books[1]
+            self.db_connection.run_single_sql('DELETE FROM ReadBook WHERE reader_id=? AND book_id IN '
+                                              '(SELECT id FROM Book WHERE book_id=?)', (r.id, first['book_id']))
+            self.db_connection.run_single_sql('UPDATE ReadBook SET reader_rating=1, tags=? WHERE reader_id=? AND '
+                                              'book_id IN (SELECT id FROM Book WHERE book_id=?)',
+                                              ('old', r.id, second['book_id']))
+            r = new_reader()
+            updated = r.update_books()
+            self.assertEqual([first['book_id'], second['book_id']], [i['book_id'] for i in updated])
+            self.assertEqual(2, r.web_connection.get_stats()['text_misses'])
+            # новая книга встает перед сохраненными, измененная остается на своем месте
+            self.assertEqual([i for i in expected if i['book_id'] == first['book_id']] +
+                             [i for i in expected if i['book_id'] != first['book_id']], r.get_read_books_from_db())
+        with self.subTest('Testing several new books keep the order of the first page'):
+            # книги на странице идут не по возрастанию id, в котором их находит запрос к Book
+            new = books[2:5]
+            keys = [r._book_key(i) for i in new]
+            self.assertNotEqual(sorted(keys), keys)
+            stored = [i for i in r.get_read_books_from_db() if r._book_key(i) not in keys]
+            for book in new:
+                self.db_connection.run_single_sql('DELETE FROM ReadBook WHERE reader_id=? AND book_id IN '
+                                                  '(SELECT id FROM Book WHERE book_id=? OR work_id=?)',
+                                                  (r.id, book['book_id'], book['work_id']))
+            # у последней книги строка в Book остается, как будто ее сохранил другой читатель,
+            # остальные сохраняются в Book заново
+            for book in new[:-1]:
+                self.db_connection.run_single_sql('DELETE FROM Book WHERE (book_id=? OR work_id=?) AND '
+                                                  'id NOT IN (SELECT book_id FROM ReadBook)',
+                                                  (book['book_id'], book['work_id']))
+            r = new_reader()
+            self.assertEqual(keys, [r._book_key(i) for i in r.update_books()])
+            self.assertEqual(keys + [r._book_key(i) for i in stored],
+                             [r._book_key(i) for i in r.get_read_books_from_db()])
+        with self.subTest('Testing update with unreadable next page is not marked as finished'):
+            self.db_connection.run_single_sql('UPDATE ReadBook SET tags=? WHERE reader_id=? AND '
+                                              'book_id IN (SELECT id FROM Book WHERE book_id=?)',
+                                              ('old', r.id, second['book_id']))
+            self.db_connection.run_single_sql('UPDATE Reader SET update_time=? WHERE login=?',
+                                              ('2023-05-13  10:14:10', reader_name))
+            r = new_reader()
+            second_page = r.parser_html.reader_read_books_page_by_number(reader_name, 2)
+
+            def without_second_page(page, url, parse=r._get_read_books_from_bs):
+                return [] if url == second_page else parse(page, url)
+
+            r._get_read_books_from_bs = without_second_page
+            self.assertEqual([second['book_id']], [i['book_id'] for i in r.update_books()])
+            self.assertEqual('2023-05-13  10:14:10', r.get_update_time())
+            self.assertEqual(second['tags'], [i['tags'] for i in r.get_read_books_from_db()
+                                              if i['book_id'] == second['book_id']][0])
+        with self.subTest('Testing deleted books are removed by periodic full update'):
+            extra = {key: None for key in BookDataFormatter.all_properties_db()}
+            extra.update(book_id=1, book_name='Удаленная книга')
+            r._save_read_books_in_db([extra])
+            r = new_reader()
+            r.update_books(full_after_days=1)
+            self.assertEqual(len(expected) + 1, len(r.get_read_books_from_db()))
+            self.db_connection.run_single_sql('UPDATE Reader SET full_update_time=? WHERE login=?',
+                                              ('2023-05-13  10:14:10', reader_name))
+            r.update_books(full_after_days=1)
+            self.assertEqual(expected, r.get_read_books_from_db())
+        r.delete_read_books()
+
     def test_get_read_books_from_db(self):
         # 1. Создаем нового читателя
         reader_name = 'Reader' + str(random.randint(100_000, 100_000_000))
@@ -190,6 +276,10 @@ class TestReader(CustomUnitTest):
         with self.subTest('Testing getting books from db'):
             self.process_json_compare_to_json('get_read_books_from_db', 'get_read_books_from_db', 'output', 'input',
                                               False)
+        with self.subTest('Testing iterating over books from db in batches'):
+            books_iterator = self.object.iter_read_books_from_db(batch_size=100)
+            self.assertNotIsInstance(books_iterator, list)
+            self.assertEqual(saved_books, list(books_iterator))
 
         # 5. Удаляем книги читателя
         self.object.delete_read_books()
@@ -209,6 +299,51 @@ class TestReader(CustomUnitTest):
         # 3. Удаляем книги читателя
         self.object.delete_read_books()
 
+    def test_get_read_books_from_web_async(self):
+        # то же, что и test_get_read_books_from_web, но страницы запрашиваются пачками параллельно
+        reader_name = 'Humming_Bird'
+        special_config = copy.deepcopy(self.config)
+        special_config.web_connection.cache_folder = get_correct_filename('', 'data/sample/test_reader/get_read_books_from_web/cache')
+        self.object = Reader(reader_name, AsyncWebWithCache(special_config), self.db_connection, self.export)
+        self.process_json_compare_to_json('get_read_books_from_web', 'get_read_books_from_web', 'output', 'input',
+                                          False)
+        self.object.delete_read_books()
+
+    def test_get_read_books_from_web_captcha(self):
+        # сайт выдает капчу на одной из страниц, страница должна быть запрошена еще раз, а не пропущена
+        reader_name = 'Humming_Bird'
+        with open(get_correct_filename('captcha.html', 'data/sample/test_parser/captcha'), encoding='utf-8') as f:
+            captcha = f.read()
+        responses = fake_reader_responses(reader_name)
+        captcha_url = f'http://www.livelib.ru/reader/{reader_name}/read/~2'
+        responses[captcha_url] = [FakeResponse(captcha), responses[captcha_url]]
+        web_connection = SimpleWeb(self.config, circuit_breaker=CircuitBreaker(base_delay=0.01, max_delay=0.01))
+        web_connection.session = FakeSession(responses)
+        self.object = Reader(reader_name, web_connection, self.db_connection, self.export)
+        self.process_json_compare_to_json('get_read_books_from_web', 'get_read_books_from_web', 'output', 'input',
+                                          False)
+        with self.subTest('Testing captcha page was requested again'):
+            self.assertEqual(2, [i[0] for i in web_connection.session.requests].count(captcha_url))
+        with self.subTest('Testing breaker is closed after all'):
+            self.assertEqual('closed', web_connection.circuit_breaker.get_state()['state'])
+        self.object.delete_read_books()
+
+    def test_first_page_is_fetched_once(self):
+        # exists и get_read_books_from_web обращаются к одной и той же первой странице, она запрашивается один раз
+        reader_name = 'Humming_Bird'
+        web_connection = SimpleWeb(self.config)
+        web_connection.session = FakeSession(fake_reader_responses(reader_name))
+        self.object = Reader(reader_name, web_connection, self.db_connection, self.export)
+        self.assertTrue(self.object.exists())
+        self.object.register()
+        self.assertTrue(self.object.get_read_books_from_web())
+        first_page = f'http://www.livelib.ru/reader/{reader_name}/read/~0'
+        with self.subTest('Testing first page is requested once'):
+            self.assertEqual(1, [i[0] for i in web_connection.session.requests].count(first_page))
+        with self.subTest('Testing first page is parsed once'):
+            self.assertEqual(1, self.object.web_connection.get_stats()['soup_hits'])
+        self.object.delete_read_books()
+
     def test__save_read_books_in_db(self):
         # 1. Создаем нового читателя
         reader_name = 'Reader' + str(random.randint(100_000, 100_000_000))
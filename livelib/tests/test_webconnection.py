@@ -3,14 +3,18 @@ import os, sys
 # скрипт для правильной отработки тестов в github.actions
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from utils import get_correct_filename, create_logger_for_tests
+from utils import get_correct_filename, create_logger_for_tests, FakeSession, FakeResponse
 
 import shutil
+import threading
+import time
 import unittest
 import logging
 import bs4
 import livelib
-from livelib import SimpleWeb, WebWithCache, Config
+from livelib import SimpleWeb, WebWithCache, AsyncWeb, AsyncWebWithCache, MemoWeb, RateLimiter, CircuitBreaker, \
+    RetryablePageError, Config, FileTreeStorage, SQLiteStorage, ParserFromHTML, ParserFromLXML
+from livelib.cachestorage import migrate_file_tree, PageCodec, CacheManager
 
 
 class TestSimpleWeb(unittest.TestCase):
@@ -70,6 +74,19 @@ class TestSimpleWeb(unittest.TestCase):
                     # сайт не существует
                     self.assertEqual(None, con._get_page_bs(i[0]))
 
+    def test_session_pool(self):
+        config = Config(self.config_file)
+        config.web_connection.pool_size = 3
+        con = SimpleWeb(config)
+        adapter = con.session.get_adapter('http://www.livelib.ru')
+        with self.subTest('Testing pool size from config'):
+            self.assertEqual(3, adapter._pool_maxsize)
+        with self.subTest('Testing the same session is used for all requests'):
+            self.assertIs(adapter, con.session.get_adapter('http://www.livelib.ru/reader/feana'))
+        with self.subTest('Testing timeouts from config'):
+            self.assertEqual((config.web_connection.connect_timeout, config.web_connection.read_timeout), con.timeout)
+        con.close()
+
     def test_get_page_bs(self):
         test_values = [
             ['http://www.example.com', True],
@@ -142,6 +159,15 @@ class TestWebWithCache(unittest.TestCase):
             with self.subTest(msg=f'Okey with {i[0]}'):
                 self.assertEqual(i[1], con._parse_url_in_filepath_and_filename(i[0]))
 
+    def test_web_is_reused(self):
+        con = WebWithCache(Config(self.config_file))
+        web = con.web
+        con.random_sleep = True
+        with self.subTest('Testing fallback connection is created once'):
+            self.assertIs(web, con.web)
+        with self.subTest('Testing random_sleep is passed to fallback connection'):
+            self.assertTrue(con.web.random_sleep)
+
     def test_create_file(self):
         con = WebWithCache(Config(self.config_file))
         for i in self.values_path:
@@ -150,6 +176,27 @@ class TestWebWithCache(unittest.TestCase):
                 self.assertEqual(True, os.path.isfile(i[1][0] + i[1][1]))
                 new_file.close()
 
+    def test_revalidate(self):
+        url = 'http://www.livelib.ru/reader/foo/read/~1'
+        con = WebWithCache(Config(self.config_file), revalidate=True)
+        con.web.session = FakeSession({url: [FakeResponse('<html>old</html>', headers={'ETag': '"v1"'}),
+                                             FakeResponse('', 304),
+                                             FakeResponse('<html>new</html>', headers={'ETag': '"v2"'})]})
+        with self.subTest('Testing page is saved with validators'):
+            self.assertEqual('<html>old</html>', con.get_page_text(url))
+            self.assertEqual('"v1"', con.storage.get_validators(con._get_key(url))['etag'])
+        with self.subTest('Testing not modified page is taken from cache'):
+            self.assertEqual('<html>old</html>', con.get_page_text(url))
+            self.assertEqual({'If-None-Match': '"v1"'}, con.web.session.requests[-1][1])
+        with self.subTest('Testing modified page is saved again'):
+            self.assertEqual('<html>new</html>', con.get_page_text(url))
+            self.assertEqual('"v2"', con.storage.get_validators(con._get_key(url))['etag'])
+            self.assertEqual(3, len(con.web.session.requests))
+        with self.subTest('Testing cache without revalidation does not make requests'):
+            con.revalidate = False
+            self.assertEqual('<html>new</html>', con.get_page_text(url))
+            self.assertEqual(3, len(con.web.session.requests))
+
     def _test__get_page_bs(self):
         # тестовые данные вида [подпапка, сайт, адрес_страницы, ожидается_ли_ответ]
         # подпапки нужны так как в тестовых данных встречаются разные сайты и их нужно разделить
@@ -168,5 +215,385 @@ class TestWebWithCache(unittest.TestCase):
                     self.assertEqual(con._get_page_bs(i[2]), None, msg=f'BeautifulSoup should not be found! {i[0]}')
 
 
+    def test_targeted_page_bs(self):
+        config = Config(self.config_file)
+        config.bs_parser.targeted = True
+        url = 'http://www.livelib.ru/reader/foo/read/~1'
+        captcha_url = 'http://www.livelib.ru/reader/foo/read/~2'
+        with open(get_correct_filename('~1.html', 'data/sample/test_reader/get_read_books_from_web/cache/reader/'
+                                                  'humming_bird/read'), encoding='utf-8') as f:
+            page = f.read()
+        with open(get_correct_filename('captcha.html', 'data/sample/test_parser/captcha'), encoding='utf-8') as f:
+            captcha = f.read()
+        con = WebWithCache(config)
+        con.web.session = FakeSession({url: FakeResponse(page), captcha_url: FakeResponse(captcha)})
+        con.web.circuit_breaker = CircuitBreaker(base_delay=0.01, max_delay=0.01)
+        with self.subTest('Testing only booklist and paginator are parsed'):
+            bsoup = con.get_page_bs(url)
+            self.assertIsNone(bsoup.find('title'))
+            self.assertEqual(['booklist', 'booklist-pagination'], [i['id'] for i in bsoup.find_all(id=True,
+                                                                                                  recursive=False)])
+        with self.subTest('Testing captcha is found without full parse'):
+            self.assertEqual(False, con.get_page_bs(captcha_url))
+        with self.subTest('Testing 404 is found without full parse'):
+            self.assertEqual(False, con._page_bs_from_text('<title>404 @ LiveLib</title>', url))
+
+
+class TestCacheStorage(unittest.TestCase):
+    config_file: str = '.env.webconnection'
+    cache_folder: str = 'data/sample/test_reader/get_read_books_from_web/cache'
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.config_file = get_correct_filename(filename=cls.config_file, folder='')
+        cls.cache_folder = get_correct_filename('', cls.cache_folder)
+        cls.test_folder = Config(cls.config_file).web_connection.cache_folder
+        cls.db_file = cls.test_folder + '/pages.sqlite3'
+
+    def tearDown(self) -> None:
+        if os.path.isdir(self.test_folder):
+            shutil.rmtree(self.test_folder)
+
+    def test_sqlite_storage(self):
+        storage = SQLiteStorage(self.db_file, batch_size=2)
+        storage.put('/reader/foo/read/~1', '<html>1</html>', {'etag': '"v1"', 'fetch_time': 1.0})
+        with self.subTest('Testing writes are batched'):
+            self.assertEqual(1, storage.pending)
+            storage.put('/reader/foo/read/~2', '<html>2</html>')
+            self.assertEqual(0, storage.pending)
+        with self.subTest('Testing page and validators are read back'):
+            self.assertEqual('<html>1</html>', storage.get('/reader/foo/read/~1'))
+            self.assertEqual({'etag': '"v1"', 'fetch_time': 1.0}, storage.get_validators('/reader/foo/read/~1'))
+            self.assertEqual(None, storage.get('/reader/foo/read/~3'))
+            self.assertEqual({}, storage.get_validators('/reader/foo/read/~3'))
+        storage.put_validators('/reader/foo/read/~2', {'last_modified': 'Mon, 01 Jan 2024 00:00:00 GMT'})
+        storage.close()
+        with self.subTest('Testing pages are saved to file on close'):
+            storage = SQLiteStorage(self.db_file)
+            self.assertEqual(['/reader/foo/read/~1', '/reader/foo/read/~2'], sorted(storage.keys()))
+            self.assertEqual({'last_modified': 'Mon, 01 Jan 2024 00:00:00 GMT'},
+                             storage.get_validators('/reader/foo/read/~2'))
+            storage.delete('/reader/foo/read/~1')
+            self.assertFalse(storage.contains('/reader/foo/read/~1'))
+            storage.close()
+
+    def test_migrate_file_tree(self):
+        source = FileTreeStorage(self.cache_folder)
+        target = SQLiteStorage(self.db_file)
+        with self.subTest('Testing all pages are migrated'):
+            self.assertEqual(len(source.keys()), migrate_file_tree(source, target))
+            self.assertEqual(sorted(source.keys()), sorted(target.keys()))
+        with self.subTest('Testing WebWithCache reads the same pages from both storages'):
+            config = Config(self.config_file)
+            config.web_connection.cache_folder = self.cache_folder
+            file_con = WebWithCache(config)
+            sqlite_con = WebWithCache(config, storage=target)
+            for i in range(4):
+                url = f'/reader/Humming_Bird/read/~{i}'
+                self.assertEqual(file_con.get_page_text(url), sqlite_con.get_page_text(url))
+        target.close()
+
+    def test_page_bytes(self):
+        config = Config(self.config_file)
+        config.web_connection.cache_folder = self.cache_folder
+        con = WebWithCache(config)
+        urls = [f'/reader/Humming_Bird/read/~{i}' for i in range(1, 4)]
+        with self.subTest('Testing pages from cache are returned as bytes'):
+            for url in urls:
+                self.assertEqual(con.get_page_text(url).encode('utf-8'), con.get_page_bytes(url))
+        for parser in (ParserFromHTML, ParserFromLXML):
+            with self.subTest(f'Testing pages parsed from bytes by {parser.__name__} are the same'):
+                for url in urls:
+                    expected = parser.all_books_from_page(con._page_bs_from_text(con.get_page_text(url), url, parser))
+                    self.assertEqual(expected, parser.all_books_from_page(con.get_page_bs(url, parser)))
+        with self.subTest('Testing 404 and captcha are found in bytes without parse'):
+            with open(get_correct_filename('captcha.html', 'data/sample/test_parser/captcha'), mode='rb') as f:
+                captcha = f.read()
+            self.assertEqual(False, con._page_bs_from_text(captcha, urls[0]))
+            self.assertEqual(False, con._page_bs_from_text(b'<title>404 @ LiveLib</title>', urls[0]))
+
+    def test_compression(self):
+        source = FileTreeStorage(self.cache_folder)
+        key = '/reader/humming_bird/read/~1'
+        text = source.get(key)
+        storages = [FileTreeStorage(self.test_folder, codec=PageCodec('zlib')),
+                    SQLiteStorage(self.db_file, codec=PageCodec('zlib'))]
+        for storage in storages:
+            with self.subTest(f'Testing {type(storage).__name__} with zlib'):
+                storage.put(key, text)
+                self.assertEqual(text, storage.get(key))
+                self.assertGreater(storage.compression_ratio(), 3)
+                self.assertEqual(text.encode('utf-8'), storage.get_bytes(key))
+            with self.subTest(f'Testing {type(storage).__name__} reads old uncompressed pages'):
+                storage.codec = PageCodec('none')
+                storage.put('/index', 'x^<html>\r\n</html>')
+                storage.codec = PageCodec('zlib')
+                self.assertEqual('x^<html>\n</html>' if isinstance(storage, FileTreeStorage)
+                                 else 'x^<html>\r\n</html>', storage.get('/index'))
+                self.assertEqual(b'x^<html>\n</html>' if isinstance(storage, FileTreeStorage)
+                                 else b'x^<html>\r\n</html>', storage.get_bytes('/index'))
+                self.assertEqual(text, storage.get(key))
+            storage.close()
+        with self.subTest('Testing unknown compression'):
+            with self.assertRaises(ValueError):
+                PageCodec('bz2')
+
+    def _age_page(self, storage: FileTreeStorage, key: str, stored_days_ago: float, accessed_days_ago: float):
+        filename = storage._get_filename(key)
+        now = time.time()
+        os.utime(filename, (now - accessed_days_ago * CacheManager.day, now - stored_days_ago * CacheManager.day))
+
+    def test_cache_manager_ttl(self):
+        storage = FileTreeStorage(self.test_folder)
+        manager = CacheManager(storage, ttl_rules={'/read/': 7, '/book/': 365}, default_ttl=30)
+        for key, days in [('/reader/foo/read/~1', 10), ('/book/1', 10), ('/reader/foo', 40)]:
+            storage.put(key, '<html></html>')
+            self._age_page(storage, key, days, days)
+        with self.subTest('Testing TTL rules'):
+            self.assertEqual(7 * CacheManager.day, manager.get_ttl('/reader/foo/read/~1'))
+            self.assertEqual(30 * CacheManager.day, manager.get_ttl('/index'))
+            self.assertTrue(manager.is_expired('/reader/foo/read/~1'))
+            self.assertFalse(manager.is_expired('/book/1'))
+            self.assertTrue(manager.is_expired('/reader/foo'))
+        with self.subTest('Testing expired pages are evicted'):
+            self.assertEqual(2, manager.evict())
+            self.assertEqual(['/book/1'], storage.keys())
+
+    def test_cache_manager_lru(self):
+        storage = SQLiteStorage(self.db_file)
+        page = 'x' * 1000
+        for i in range(5):
+            storage.put(f'/reader/foo/read/~{i}', page)
+        for i in (0, 3, 1, 4):
+            time.sleep(0.01)
+            storage.get(f'/reader/foo/read/~{i}')
+        manager = CacheManager(storage, max_size=3500, check_every=5)
+        with self.subTest('Testing cache is checked after check_every saved pages'):
+            for i in range(4):
+                manager.page_saved()
+            self.assertEqual(5, len(storage.keys()))
+            manager.page_saved()
+        with self.subTest('Testing least recently used pages are evicted'):
+            self.assertEqual(['/reader/foo/read/~1', '/reader/foo/read/~3', '/reader/foo/read/~4'],
+                             sorted(storage.keys()))
+        storage.close()
+
+    def test_web_with_cache_expired_and_refresh(self):
+        url = 'http://www.livelib.ru/reader/foo/read/~1'
+        config = Config(self.config_file)
+        config.web_connection.cache_ttl_rules = {'/read/': 1}
+        con = WebWithCache(config)
+        con.web.session = FakeSession({url: [FakeResponse('<html>1</html>'), FakeResponse('<html>2</html>'),
+                                             FakeResponse('<html>3</html>')]})
+        self.assertEqual('<html>1</html>', con.get_page_text(url))
+        with self.subTest('Testing fresh page is taken from cache'):
+            self.assertEqual('<html>1</html>', con.get_page_text(url))
+            self.assertEqual(1, len(con.web.session.requests))
+        with self.subTest('Testing expired page is requested again'):
+            self._age_page(con.storage, con._get_key(url), 2, 2)
+            self.assertEqual('<html>2</html>', con.get_page_text(url))
+        with self.subTest('Testing force refresh'):
+            self.assertEqual('<html>3</html>', con.refresh_page(url))
+            self.assertEqual('<html>3</html>', con.get_page_text(url))
+            self.assertEqual(3, len(con.web.session.requests))
+
+
+class TestMemoWeb(unittest.TestCase):
+    config_file: str = '.env.webconnection'
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.config_file = get_correct_filename(filename=cls.config_file, folder='')
+
+    def _create_memo_web(self, responses: dict, max_pages: int = 32) -> MemoWeb:
+        web = SimpleWeb(Config(self.config_file))
+        web.session = FakeSession(responses)
+        return MemoWeb(web, max_pages=max_pages)
+
+    def test_get_page_bs(self):
+        url = 'http://www.livelib.ru/reader/foo/read/~1'
+        other = 'http://www.livelib.ru/reader/foo/read/~2'
+        con = self._create_memo_web({url: FakeResponse('<html><body>1</body></html>'),
+                                     other: FakeResponse('<html><body>2</body></html>')})
+        page = con.get_page_bs(url)
+        with self.subTest('Testing page is requested and parsed once'):
+            self.assertIs(page, con.get_page_bs(url))
+            self.assertEqual('<html><body>1</body></html>', con.get_page_text(url))
+            self.assertEqual(1, len(con.web.session.requests))
+        with self.subTest('Testing hit and miss counters'):
+            self.assertEqual({'text_hits': 1, 'text_misses': 1, 'soup_hits': 1, 'soup_misses': 1}, con.get_stats())
+        with self.subTest('Testing batch uses remembered pages'):
+            pages = con.get_pages_bs([url, other])
+            self.assertIs(page, pages[0])
+            self.assertEqual('2', pages[1].body.text)
+            self.assertEqual(2, len(con.web.session.requests))
+
+    def test_lru(self):
+        urls = [f'http://www.livelib.ru/reader/foo/read/~{i}' for i in range(3)]
+        con = self._create_memo_web({url: FakeResponse(url) for url in urls}, max_pages=2)
+        for url in urls:
+            con.get_page_text(url)
+        con.get_page_text(urls[2])
+        con.get_page_text(urls[0])
+        self.assertEqual([url for url in urls] + [urls[0]], [i[0] for i in con.web.session.requests])
+
+    def test_captcha_is_not_remembered(self):
+        url = 'http://www.livelib.ru/reader/foo/read/~1'
+        with open(get_correct_filename('captcha.html', 'data/sample/test_parser/captcha'), encoding='utf-8') as f:
+            captcha = f.read()
+        con = self._create_memo_web({url: [FakeResponse(captcha, 200), FakeResponse('<html>1</html>')]})
+        con.web.circuit_breaker = CircuitBreaker(base_delay=0.01, max_delay=0.01)
+        self.assertEqual(False, con.get_page_bs(url))
+        self.assertEqual('<html>1</html>', con.get_page_text(url))
+
+    def test_delegation(self):
+        con = self._create_memo_web({})
+        con.random_sleep = True
+        self.assertTrue(con.web.random_sleep)
+        self.assertIs(con.web.rate_limiter, con.rate_limiter)
+        self.assertEqual(1, con.concurrency)
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def test_acquire(self):
+        limiter = RateLimiter(requests_per_minute=600, burst=2)
+        with self.subTest('Testing burst requests do not wait'):
+            self.assertEqual(0, limiter.acquire('www.livelib.ru'))
+            self.assertEqual(0, limiter.acquire('www.livelib.ru'))
+        with self.subTest('Testing other hosts have their own bucket'):
+            self.assertEqual(0, limiter.acquire('www.example.com'))
+        with self.subTest('Testing request over the budget waits'):
+            start = time.monotonic()
+            self.assertGreater(limiter.acquire('www.livelib.ru'), 0)
+            self.assertGreaterEqual(time.monotonic() - start, 0.05)
+
+    def test_feedback(self):
+        limiter = RateLimiter(requests_per_minute=60, burst=1, min_requests_per_minute=10, slow_latency=5)
+        host = 'www.livelib.ru'
+        with self.subTest('Testing error halves the rate'):
+            limiter.feedback(host, 1, ok=False)
+            self.assertEqual(30, limiter.rate(host))
+        with self.subTest('Testing slow answer halves the rate'):
+            limiter.feedback(host, 6)
+            self.assertEqual(15, limiter.rate(host))
+        with self.subTest('Testing rate does not fall below minimum'):
+            limiter.feedback(host, 1, ok=False)
+            self.assertEqual(10, limiter.rate(host))
+        with self.subTest('Testing fast answer increases the rate'):
+            limiter.feedback(host, 1)
+            self.assertAlmostEqual(11, limiter.rate(host))
+        with self.subTest('Testing rate does not exceed maximum'):
+            for i in range(100):
+                limiter.feedback(host, 1)
+            self.assertAlmostEqual(60, limiter.rate(host))
+
+    def test_cache_hits_do_not_consume_budget(self):
+        config = Config(get_correct_filename(filename='.env.webconnection', folder=''))
+        config.web_connection.cache_folder = get_correct_filename('', 'data/sample/test_reader/get_read_books_from_web/cache')
+        config.web_connection.requests_per_minute = 0.01
+        config.web_connection.burst = 1
+        con = WebWithCache(config, random_sleep=True)
+        host = 'www.livelib.ru'
+        start = time.monotonic()
+        for i in range(4):
+            con.get_page_text(f'/reader/Humming_Bird/read/~{i}')
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual(1, con.rate_limiter.tokens(host))
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    config_file: str = '.env.webconnection'
+
+    def test_states(self):
+        breaker = CircuitBreaker(base_delay=0.1, max_delay=1, max_retries=2, jitter=0.5)
+        url = '/reader/foo/read/~1'
+        with self.subTest('Testing new breaker is closed'):
+            self.assertEqual('closed', breaker.get_state()['state'])
+            self.assertEqual(0, breaker.before_request())
+        with self.subTest('Testing failure opens breaker'):
+            delay = breaker.record_failure(url, 'captcha')
+            self.assertTrue(0.1 <= delay <= 0.15)
+            state = breaker.get_state()
+            self.assertEqual('open', state['state'])
+            self.assertEqual({url: 1}, state['retries'])
+            self.assertEqual('captcha', state['last_reason'])
+            self.assertTrue(breaker.should_retry(url))
+        with self.subTest('Testing breaker pauses requests and becomes half-open'):
+            self.assertGreater(breaker.before_request(), 0)
+            self.assertEqual('half-open', breaker.get_state()['state'])
+        with self.subTest('Testing backoff grows exponentially'):
+            self.assertTrue(0.2 <= breaker.record_failure(url, 'status 503') <= 0.3)
+            self.assertTrue(0.4 <= breaker.record_failure(url, 'status 503') <= 0.6)
+        with self.subTest('Testing page is not retried after max_retries'):
+            self.assertFalse(breaker.should_retry(url))
+        with self.subTest('Testing success closes breaker'):
+            breaker.record_success(url)
+            state = breaker.get_state()
+            self.assertEqual('closed', state['state'])
+            self.assertEqual(0, state['failures'])
+            self.assertFalse(breaker.should_retry(url))
+
+    def test_simple_web_opens_breaker(self):
+        config = Config(get_correct_filename(filename=self.config_file, folder=''))
+        with open(get_correct_filename('captcha.html', 'data/sample/test_parser/captcha'), encoding='utf-8') as f:
+            captcha = f.read()
+        con = SimpleWeb(config, circuit_breaker=CircuitBreaker(base_delay=0.01, max_delay=0.01))
+        con.session = FakeSession({'http://www.livelib.ru/captcha': FakeResponse(captcha),
+                                   'http://www.livelib.ru/busy': FakeResponse('', 503),
+                                   'http://www.livelib.ru/ok': FakeResponse('<html></html>')})
+        for url in ['/captcha', '/busy']:
+            with self.subTest(f'Testing {url} opens breaker'):
+                with self.assertRaises(RetryablePageError):
+                    con.get_page_text(url)
+                self.assertEqual(False, con.get_page_bs(url))
+                self.assertEqual('open', con.circuit_breaker.get_state()['state'])
+                self.assertTrue(con.circuit_breaker.should_retry(url))
+        with self.subTest('Testing good page closes breaker'):
+            self.assertEqual('<html></html>', con.get_page_text('/ok'))
+            self.assertEqual('closed', con.circuit_breaker.get_state()['state'])
+
+
+class TestAsyncWeb(unittest.TestCase):
+    config_file: str = '.env.webconnection'
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.config_file = get_correct_filename(filename=cls.config_file, folder='')
+
+    def test_concurrency_limit(self):
+        # подменяем получение страницы, чтобы проверить, сколько запросов идет одновременно, не обращаясь к сети
+        class CountingWeb(AsyncWeb):
+            running = 0
+            max_running = 0
+            lock = threading.Lock()
+
+            def get_page_text(self, url):
+                with self.lock:
+                    self.running += 1
+                    self.max_running = max(self.max_running, self.running)
+                time.sleep(0.05)
+                with self.lock:
+                    self.running -= 1
+                return url
+
+        config = Config(self.config_file)
+        config.web_connection.concurrency = 3
+        con = CountingWeb(config)
+        urls = [f'/reader/foo/read/~{i}' for i in range(10)]
+        with self.subTest('Testing order of pages'):
+            self.assertEqual(urls, con.get_pages_text(urls))
+        with self.subTest('Testing pages are requested concurrently within the limit'):
+            self.assertEqual(3, con.max_running)
+
+    def test_get_pages_text_from_cache(self):
+        config = Config(self.config_file)
+        config.web_connection.cache_folder = get_correct_filename('', 'data/sample/test_reader/get_read_books_from_web/cache')
+        urls = [f'/reader/Humming_Bird/read/~{i}' for i in range(4)]
+        sync_con = WebWithCache(config)
+        async_con = AsyncWebWithCache(config)
+        self.assertEqual([sync_con.get_page_text(i) for i in urls], async_con.get_pages_text(urls))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -51,6 +51,61 @@ def create_logger_for_tests(filename: str) -> None:
     mylogger = logging.getLogger()
     mylogger.addHandler(logging.FileHandler(log_filename, mode='a'))
 
+class FakeResponse:
+    """
+    Служебный класс, заменяет requests.Response в тестах, которым не нужна сеть.
+    """
+
+    def __init__(self, text: str = '', status_code: int = 200, headers: dict = None):
+        self.text = text
+        self.status_code = status_code
+        self.headers = headers if headers else {}
+        self.encoding = None
+
+
+class FakeSession:
+    """
+    Служебный класс, заменяет requests.Session в SimpleWeb для тестов, которым не нужна сеть.
+    Для каждого адреса задается ответ либо список ответов, которые будут выданы по очереди
+    (последний ответ повторяется). На неизвестные адреса отдается 404.
+    Все запросы запоминаются в списке requests в виде (адрес, заголовки).
+    """
+
+    def __init__(self, responses: dict):
+        self.responses = {url: list(value) if isinstance(value, list) else [value] for url, value in responses.items()}
+        self.requests = []
+
+    def get(self, url: str, timeout=None, headers: dict = None) -> FakeResponse:
+        self.requests.append((url, headers))
+        answers = self.responses.get(url)
+        if not answers:
+            return FakeResponse('', 404)
+        return answers.pop(0) if len(answers) > 1 else answers[0]
+
+    def close(self):
+        pass
+
+
+def load_reader_pages(login: str = 'Humming_Bird') -> dict:
+    """
+    Служебная функция, возвращает сохраненные в тестовых данных страницы ~0..~3 с прочитанными книгами
+    читателя Humming_Bird вида {адрес страницы для логина login: текст страницы}.
+    """
+    folder = get_correct_filename('', 'data/sample/test_reader/get_read_books_from_web/cache/reader/humming_bird/read')
+    result = {}
+    for i in range(4):
+        with open(os.path.join(folder, f'~{i}.html'), encoding='utf-8') as f:
+            result[f'http://www.livelib.ru/reader/{login}/read/~{i}'] = f.read()
+    return result
+
+
+def fake_reader_responses(login: str = 'Humming_Bird') -> dict:
+    """
+    Служебная функция, возвращает ответы для FakeSession со страницами из load_reader_pages.
+    """
+    return {url: FakeResponse(text) for url, text in load_reader_pages(login).items()}
+
+
 class CustomUnitTest(unittest.TestCase):
     object: Any
     config: Config
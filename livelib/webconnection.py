@@ -1,13 +1,265 @@
 import _io
+import asyncio
+import collections
+import urllib.parse
 import bs4
 import requests
 import os
 import re
 import logging
+import threading
+import typing
 from typing import List
 from .parser import ParserFromHTML
-import time, random
+import time
+import random
 from .config import Config
+from .cachestorage import CacheStorage, CacheManager, create_cache_storage
+
+
+class RateLimiter:
+    """
+    Ограничитель частоты запросов к сайту по алгоритму token bucket, отдельное ведро для каждого хоста.
+    Частота подстраивается под сайт по схеме AIMD: после успешного быстрого ответа она понемногу растет
+    до requests_per_minute, после ошибки или медленного ответа уменьшается вдвое, но не ниже min_requests_per_minute.
+    Объект потокобезопасен, поэтому его можно разделять между соединениями и потоками.
+    :param requests_per_minute: максимальное количество запросов к одному хосту в минуту
+    :type requests_per_minute: float
+    :param burst: сколько запросов можно сделать подряд без ожидания
+    :type burst: int
+    :param min_requests_per_minute: минимальная частота запросов в минуту, до которой опускается ограничитель
+    :type min_requests_per_minute: float
+    :param slow_latency: время ответа в секундах, начиная с которого ответ считается медленным
+    :type slow_latency: float
+    """
+    # во сколько раз уменьшается частота при ошибке
+    decrease_factor: float = 0.5
+    # на сколько запросов в минуту увеличивается частота после удачного ответа
+    increase_step: float = 1
+
+    def __init__(self, requests_per_minute: float = 6, burst: int = 2, min_requests_per_minute: float = 0.5,
+                 slow_latency: float = 10):
+        self.max_rate = requests_per_minute / 60
+        self.min_rate = min(min_requests_per_minute, requests_per_minute) / 60
+        self.burst = max(burst, 1)
+        self.slow_latency = slow_latency
+        self.lock = threading.Lock()
+        # для каждого хоста храним [количество жетонов, время последнего пополнения, текущую частоту в секунду]
+        self.buckets = {}
+        self.logger = logging.getLogger()
+
+    @classmethod
+    def from_config(cls, config: Config) -> 'RateLimiter':
+        """
+        Создает ограничитель по настройкам из Config.web_connection.
+        :param config: конфигурация
+        :type config: Config
+        :rtype: RateLimiter
+        """
+        return cls(requests_per_minute=config.web_connection.requests_per_minute,
+                   burst=config.web_connection.burst,
+                   min_requests_per_minute=config.web_connection.min_requests_per_minute,
+                   slow_latency=config.web_connection.slow_latency)
+
+    def _get_bucket(self, host: str) -> list:
+        if host not in self.buckets:
+            self.buckets[host] = [float(self.burst), time.monotonic(), self.max_rate]
+        return self.buckets[host]
+
+    def rate(self, host: str) -> float:
+        """
+        Возвращает текущую разрешенную частоту запросов к хосту в минуту.
+        :param host: хост
+        :type host: str
+        :rtype: float
+        """
+        with self.lock:
+            return self._get_bucket(host)[2] * 60
+
+    def tokens(self, host: str) -> float:
+        """
+        Возвращает количество жетонов, оставшихся в ведре хоста (без учета пополнения с момента последнего запроса).
+        :param host: хост
+        :type host: str
+        :rtype: float
+        """
+        with self.lock:
+            return self._get_bucket(host)[0]
+
+    def acquire(self, host: str) -> float:
+        """
+        Забирает жетон на один запрос к хосту, при необходимости дожидаясь его появления.
+        :param host: хост
+        :type host: str
+        :return: сколько секунд пришлось ждать
+        :rtype: float
+        """
+        waited = 0.0
+        while True:
+            with self.lock:
+                bucket = self._get_bucket(host)
+                now = time.monotonic()
+                bucket[0] = min(float(self.burst), bucket[0] + (now - bucket[1]) * bucket[2])
+                bucket[1] = now
+                if bucket[0] >= 1:
+                    bucket[0] -= 1
+                    return waited
+                time_to_sleep = (1 - bucket[0]) / bucket[2]
+            self.logger.debug(f'Rate limit for {host}: sleep for {time_to_sleep:.1f} seconds.')
+            time.sleep(time_to_sleep)
+            waited += time_to_sleep
+
+    def feedback(self, host: str, latency: float, ok: bool = True) -> None:
+        """
+        Подстраивает частоту запросов к хосту по результату очередного запроса.
+        :param host: хост
+        :type host: str
+        :param latency: время ответа в секундах
+        :type latency: float
+        :param ok: успешен ли запрос (False при ошибке соединения, 429 и 5xx)
+        :type ok: bool
+        """
+        with self.lock:
+            bucket = self._get_bucket(host)
+            if ok and latency < self.slow_latency:
+                bucket[2] = min(self.max_rate, bucket[2] + self.increase_step / 60)
+            else:
+                bucket[2] = max(self.min_rate, bucket[2] * self.decrease_factor)
+                self.logger.info(f'Rate limit for {host} decreased to {bucket[2] * 60:.2f} requests per minute.')
+
+
+class RetryablePageError(Exception):
+    """
+    Исключение: сайт временно не отдает страницу (капча, 429 или 5xx), ее стоит запросить позже.
+    """
+    pass
+
+
+class CircuitBreaker:
+    """
+    Предохранитель для запросов к сайту. При капче или ответах 429/5xx он размыкается и приостанавливает
+    все запросы к сайту на время, которое удваивается с каждой следующей неудачей подряд (с добавлением случайной
+    добавки, чтобы параллельные запросы не возобновлялись одновременно). Когда пауза истекает, предохранитель
+    переходит в полуоткрытое состояние и снова пропускает запросы: первый успех его замыкает,
+    неудача снова размыкает на больший срок.
+    Для каждой неудачной страницы предохранитель считает повторы, чтобы вызывающий код мог поставить ее в очередь снова.
+    Объект потокобезопасен.
+    :param base_delay: пауза в секундах после первой неудачи
+    :type base_delay: float
+    :param max_delay: максимальная пауза в секундах
+    :type max_delay: float
+    :param max_retries: сколько раз можно повторно запрашивать одну страницу
+    :type max_retries: int
+    :param jitter: доля паузы, до которой к ней добавляется случайная добавка
+    :type jitter: float
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, base_delay: float = 60, max_delay: float = 1800, max_retries: int = 3, jitter: float = 0.5):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retries = max_retries
+        self.jitter = jitter
+        self.state = self.CLOSED
+        self.failures = 0  # неудачи подряд, по ним считается пауза
+        self.opened_until = 0.0  # время (time.monotonic), до которого запросы приостановлены
+        self.retries = {}  # количество неудач для каждой страницы
+        self.last_reason = None
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger()
+
+    @classmethod
+    def from_config(cls, config: Config) -> 'CircuitBreaker':
+        """
+        Создает предохранитель по настройкам из Config.web_connection.
+        :param config: конфигурация
+        :type config: Config
+        :rtype: CircuitBreaker
+        """
+        return cls(base_delay=config.web_connection.breaker_base_delay,
+                   max_delay=config.web_connection.breaker_max_delay,
+                   max_retries=config.web_connection.breaker_max_retries)
+
+    def before_request(self) -> float:
+        """
+        Дожидается, пока предохранитель разрешит запрос к сайту.
+        :return: сколько секунд пришлось ждать
+        :rtype: float
+        """
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if self.state == self.OPEN and now >= self.opened_until:
+                    self.state = self.HALF_OPEN
+                if self.state != self.OPEN:
+                    return waited
+                time_to_sleep = self.opened_until - now
+            self.logger.debug(f'Circuit breaker is {self.state}: sleep for {time_to_sleep:.1f} seconds.')
+            time.sleep(time_to_sleep)
+            waited += time_to_sleep
+
+    def record_success(self, url: str) -> None:
+        """
+        Отмечает успешно полученную страницу и замыкает предохранитель.
+        :param url: адрес страницы
+        :type url: str
+        """
+        with self.lock:
+            if self.state != self.CLOSED:
+                self.logger.info('Circuit breaker is closed.')
+            self.state = self.CLOSED
+            self.failures = 0
+            self.retries.pop(url, None)
+
+    def record_failure(self, url: str, reason: str) -> float:
+        """
+        Отмечает неудачу (капча, 429, 5xx) и размыкает предохранитель.
+        :param url: адрес страницы
+        :type url: str
+        :param reason: причина неудачи, для логов и состояния
+        :type reason: str
+        :return: на сколько секунд приостановлены запросы
+        :rtype: float
+        """
+        with self.lock:
+            self.failures += 1
+            self.retries[url] = self.retries.get(url, 0) + 1
+            delay = min(self.max_delay, self.base_delay * 2 ** (self.failures - 1))
+            delay += random.uniform(0, self.jitter * delay)
+            self.opened_until = time.monotonic() + delay
+            self.state = self.OPEN
+            self.last_reason = reason
+        self.logger.warning(f'Circuit breaker is open for {delay:.1f} seconds because of {reason} at {url}.')
+        return delay
+
+    def should_retry(self, url: str) -> bool:
+        """
+        Проверяет, нужно ли повторно запросить страницу: она не была получена из-за капчи или ошибки сайта,
+        и количество повторов еще не исчерпано.
+        :param url: адрес страницы
+        :type url: str
+        :rtype: bool
+        """
+        with self.lock:
+            return 0 < self.retries.get(url, 0) <= self.max_retries
+
+    def get_state(self) -> dict:
+        """
+        Возвращает состояние предохранителя для принятия решений пакетными задачами.
+        :return: словарь вида {'state': 'closed'|'open'|'half-open', 'failures': неудачи подряд,
+                                'open_for': сколько секунд еще продлится пауза, 'retries': {адрес: количество неудач},
+                                'last_reason': причина последней неудачи}
+        :rtype: dict
+        """
+        with self.lock:
+            return {'state': self.state,
+                    'failures': self.failures,
+                    'open_for': max(0.0, self.opened_until - time.monotonic()) if self.state == self.OPEN else 0.0,
+                    'retries': dict(self.retries),
+                    'last_reason': self.last_reason}
 
 
 class WebConnection:
@@ -20,6 +272,28 @@ class WebConnection:
         defaults to 'utf-8'
     :type encoding: str
     """
+    # сколько страниц соединение запрашивает одновременно в get_pages_text и get_pages_bs
+    concurrency: int = 1
+    # предохранитель, приостанавливающий запросы при капче и ошибках сайта, если соединение обращается к сети
+    circuit_breaker: CircuitBreaker = None
+    # способ парсинга BeautifulSoup, у соединений с конфигурацией берется из Config.bs_parser.features
+    features: str = 'lxml'
+    # кодировка страниц сайта, у соединений с конфигурацией берется из Config.encoding
+    encoding: str = 'utf-8'
+    # строить ли дерево только для списка книг и паджинатора, берется из Config.bs_parser.targeted
+    targeted: bool = False
+
+    def _get_host(self, url: str) -> str:
+        """
+        Возвращает хост, к которому будет отправлен запрос по заданному адресу.
+        :param url: адрес страницы, возможно без префикса сайта
+        :type url: str
+        :return: хост
+        :rtype: str
+        """
+        if url[0] == '/':
+            url = self.site + url
+        return urllib.parse.urlsplit(url).netloc
 
     def get_page_status(self, url: str) -> int:
         """
@@ -49,7 +323,7 @@ class WebConnection:
         :rtype: bs4.BeautifulSoup
         """
         try:
-            result = bs4.BeautifulSoup(self.get_page_text(url), features='lxml')
+            result = bs4.BeautifulSoup(self.get_page_text(url), features=self.features)
         except Exception:
             self.logger.exception(f'Can not get BS object from {url}', exc_info=True)
             result = None
@@ -70,20 +344,110 @@ class WebConnection:
         :rtype: bs4.BeautifulSoup
         """
         try:
-            result = bs4.BeautifulSoup(self.get_page_text(url), features='lxml')
+            text = self.get_page_text(url)
         except Exception:
             self.logger.exception(f'Can not get BS object from {url}', exc_info=True)
             return False
         else:
-            # проверяем на 404
-            if parser.check_404(result):
+            return self._page_bs_from_text(text, url, parser)
+
+    def get_page_bytes(self, url: str) -> bytes:
+        """
+        Возвращает страницу в виде байтов в кодировке соединения, либо генерирует исключение.
+        Базовая реализация кодирует текст страницы, соединения с кешем отдают байты из кеша без декодирования.
+        :param url: адрес страницы
+        :type url: str
+        :return: байты страницы
+        :rtype: bytes
+        """
+        return self.get_page_text(url).encode(self.encoding)
+
+    def get_pages_bytes(self, urls: List[str]) -> List[bytes or None]:
+        """
+        Возвращает байты нескольких страниц в том же порядке, что и адреса.
+        :param urls: список адресов страниц
+        :type urls: List[str]
+        :return: список байтов страниц, None на месте страниц, которые не удалось получить
+        :rtype: List[bytes or None]
+        """
+        result = []
+        for url in urls:
+            try:
+                result.append(self.get_page_bytes(url))
+            except Exception:
+                self.logger.exception(f'Can not get page! {url}', exc_info=True)
+                result.append(None)
+        return result
+
+    def _page_bs_from_text(self, text: str or bytes, url: str, parser=ParserFromHTML) -> bs4.BeautifulSoup or bool:
+        """
+        Строит документ из уже полученного текста страницы методом make_document парсера
+        и проверяет его на 404 и капчу. Байты страницы разбираются без декодирования в строку.
+        :param text: текст страницы или ее байты в кодировке соединения
+        :param url: адрес страницы, нужен для логов
+        :param parser: класс парсера для обработки страниц
+            defaults to ParserFromHTML
+        :return: объект BeautifulSoup (или документ парсера) либо False,
+            если страницу не удалось разобрать, она 404 или капча
+        :rtype: bs4.BeautifulSoup or bool
+        """
+        is_bytes = isinstance(text, bytes)
+        if self.targeted or is_bytes:
+            # в частичном дереве нет ни заголовка, ни текста капчи, поэтому проверяем их по тексту страницы;
+            # байты проверяем всегда, поиск по ним дешевле разбора
+            if parser.check_404_text(text):
                 self.logger.warning(f'Page at {url} is 404!')
                 return False
-            elif parser.check_captcha(result):
+            elif parser.check_captcha_text(text):
                 self.logger.warning(f'Page at {url} is captcha!')
                 return False
-            else:
-                return result
+        try:
+            result = parser.make_document(text, self.features, self.targeted,
+                                          encoding=self.encoding if is_bytes else None)
+        except Exception:
+            self.logger.exception(f'Can not get BS object from {url}', exc_info=True)
+            return False
+        # проверяем на 404
+        if parser.check_404(result):
+            self.logger.warning(f'Page at {url} is 404!')
+            return False
+        elif parser.check_captcha(result):
+            self.logger.warning(f'Page at {url} is captcha!')
+            return False
+        else:
+            return result
+
+    def get_pages_text(self, urls: List[str]) -> List[str or None]:
+        """
+        Возвращает тексты нескольких страниц в том же порядке, что и адреса.
+        Базовая реализация запрашивает страницы последовательно, асинхронные соединения делают это параллельно.
+        :param urls: список адресов страниц
+        :type urls: List[str]
+        :return: список текстов страниц, None на месте страниц, которые не удалось получить
+        :rtype: List[str or None]
+        """
+        result = []
+        for url in urls:
+            try:
+                result.append(self.get_page_text(url))
+            except Exception:
+                self.logger.exception(f'Can not get text from page! {url}', exc_info=True)
+                result.append(None)
+        return result
+
+    def get_pages_bs(self, urls: List[str], parser=ParserFromHTML) -> List[bs4.BeautifulSoup or bool]:
+        """
+        Возвращает объекты BeautifulSoup для нескольких страниц в том же порядке, что и адреса.
+        Для каждой страницы действуют те же правила, что и в get_page_bs.
+        :param urls: список адресов страниц
+        :type urls: List[str]
+        :param parser: класс парсера для обработки страниц
+            defaults to ParserFromHTML
+        :return: список объектов BeautifulSoup, False на месте недоступных страниц, 404 или капчи
+        :rtype: List[bs4.BeautifulSoup or bool]
+        """
+        return [self._page_bs_from_text(text, url, parser) if text is not None else False
+                for url, text in zip(urls, self.get_pages_text(urls))]
 
 
 class SimpleWeb(WebConnection):
@@ -97,51 +461,92 @@ class SimpleWeb(WebConnection):
     :param encoding: кодировка сайта
         defaults to 'utf-8'
     :type encoding: str
-    :param: random_sleep перед запросом страницы засыпание на случайное количество секунд, нужно для обхода блокировок Livelib
+    :param: random_sleep перед запросом страницы ждать разрешения ограничителя частоты запросов,
+        нужно для обхода блокировок Livelib
         default to False
     :type random_sleep: bool
+    :param rate_limiter: ограничитель частоты запросов, можно разделять между несколькими соединениями
+        defaults to RateLimiter с настройками из Config.web_connection
+    :type rate_limiter: RateLimiter
+    :param circuit_breaker: предохранитель, приостанавливающий запросы при капче и ошибках сайта
+        defaults to CircuitBreaker с настройками из Config.web_connection
+    :type circuit_breaker: CircuitBreaker
     """
 
-    def __init__(self, config: Config, random_sleep=False):
+    user_agent = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/102.0.0.0 Safari/537.36'
+
+    def __init__(self, config: Config, random_sleep=False, rate_limiter: RateLimiter = None,
+                 circuit_breaker: CircuitBreaker = None):
         self.site = config.web_connection.site
         self.encoding = config.encoding
         self.random_sleep = random_sleep
+        self.rate_limiter = rate_limiter if rate_limiter else RateLimiter.from_config(config)
+        self.circuit_breaker = circuit_breaker if circuit_breaker else CircuitBreaker.from_config(config)
+        self.timeout = (config.web_connection.connect_timeout, config.web_connection.read_timeout)
+        self.features = config.bs_parser.features
+        self.targeted = config.bs_parser.targeted
         self.logger = logging.getLogger()
+        self.session = self._create_session(config)
+
+    def _create_session(self, config: Config) -> requests.Session:
+        """
+        Создает долгоживущую сессию с пулом соединений, чтобы не устанавливать заново TCP и TLS соединение
+        с сайтом при запросе каждой страницы.
+        :param config: конфигурация с настройками пула (Config.web_connection)
+        :type config: Config
+        :return: сессия с заданными заголовками и пулом соединений
+        :rtype: requests.Session
+        """
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=config.web_connection.pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.headers.update(
+            {
+                'User-Agent': self.user_agent,
+                'Connection': 'keep-alive' if config.web_connection.keep_alive else 'close',
+            }
+        )
+        return session
 
-    def do_random_sleep(self):
-        time_to_sleep = random.randint(90, 120)
-        print(f'Sleep for {time_to_sleep} seconds.')
-        time.sleep(time_to_sleep)
+    def close(self) -> None:
+        """
+        Закрывает все соединения из пула сессии.
+        """
+        self.session.close()
 
-    def _get_page(self, url: str) -> requests.Response:
+    def _get_page(self, url: str, headers: dict = None) -> requests.Response:
         """
         возвращает объект Response по запросу на заданный адрес, либо генерирует исключение.
         :param url: адрес страницы
+        :param headers: дополнительные заголовки запроса
+            defaults to None
         :raises Exception: если невозможно получить страницу
         :rtype: requests.Response
         :return: объект Response по запросу на заданный адрес
         """
         self.logger.debug(f'Making request to {url}')
-        if self.random_sleep:
-            self.logger.debug('Random sleep.')
-            self.do_random_sleep()
         # если начало url - не ссылка на сайт, то добавляем
         if url[0] == '/':
             url = self.site + url
             self.logger.debug(f'Add site prefix to url')
+        host = urllib.parse.urlsplit(url).netloc
+        self.circuit_breaker.before_request()
+        if self.random_sleep:
+            self.rate_limiter.acquire(host)
+        start = time.monotonic()
         try:
-            headers = requests.utils.default_headers()
-            headers.update(
-                {
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/102.0.0.0 Safari/537.36'
-                }
-            )
-            result = requests.get(url, headers=headers)
+            result = self.session.get(url, timeout=self.timeout, headers=headers)
             result.encoding = self.encoding
-            return result
         except Exception:
             self.logger.exception(f'Can not open this page!', exc_info=True)
+            if self.random_sleep:
+                self.rate_limiter.feedback(host, time.monotonic() - start, ok=False)
             raise
+        if self.random_sleep:
+            ok = result.status_code != 429 and result.status_code < 500
+            self.rate_limiter.feedback(host, time.monotonic() - start, ok=ok)
+        return result
 
     def get_page_status(self, url: str) -> int:
         """
@@ -160,17 +565,72 @@ class SimpleWeb(WebConnection):
         Возвращает текст страницы по заданному адресу.
         :param url: адрес страницы
         :type url: str
+        :raises RetryablePageError: если сайт выдал капчу или ответ 429/5xx
         :raises Exception: если невозможно получить текст страницы
         :return: текст страницы
         :rtype: str
         """
+        return self._get_checked_page(url).text
+
+    def get_page_text_if_modified(self, url: str, validators: dict = None) -> typing.Tuple[str or None, dict]:
+        """
+        Условный запрос страницы: если страница не изменилась с момента, описанного валидаторами
+        (сайт ответил 304 Not Modified), возвращает None вместо текста.
+        :param url: адрес страницы
+        :type url: str
+        :param validators: валидаторы сохраненной копии страницы вида {'etag': ..., 'last_modified': ...}
+            defaults to None
+        :type validators: dict
+        :raises RetryablePageError: если сайт выдал капчу или ответ 429/5xx
+        :raises Exception: если невозможно получить текст страницы
+        :return: текст страницы или None, если она не изменилась, и новые валидаторы
+                    вида {'etag': ..., 'last_modified': ..., 'fetch_time': ...}
+        :rtype: Tuple[str or None, dict]
+        """
+        headers = {}
+        if validators:
+            if validators.get('etag'):
+                headers['If-None-Match'] = validators['etag']
+            if validators.get('last_modified'):
+                headers['If-Modified-Since'] = validators['last_modified']
+        page = self._get_checked_page(url, headers)
+        new_validators = {'etag': page.headers.get('ETag'),
+                          'last_modified': page.headers.get('Last-Modified'),
+                          'fetch_time': time.time()}
+        if page.status_code == 304:
+            self.logger.debug(f'Page {url} is not modified.')
+            # в ответе 304 валидаторы могут отсутствовать, тогда сохраняем старые
+            for key in ('etag', 'last_modified'):
+                new_validators[key] = new_validators[key] or validators.get(key)
+            return None, new_validators
+        return page.text, new_validators
+
+    def _get_checked_page(self, url: str, headers: dict = None) -> requests.Response:
+        """
+        Возвращает объект Response, проверенный на капчу и ошибки перегрузки сайта.
+        :param url: адрес страницы
+        :param headers: дополнительные заголовки запроса
+            defaults to None
+        :raises RetryablePageError: если сайт выдал капчу или ответ 429/5xx
+        :raises Exception: если невозможно получить страницу
+        :rtype: requests.Response
+        """
         try:
-            page = self._get_page(url)
+            page = self._get_page(url, headers)
         except Exception:
             self.logger.exception(f'Can not get text from page! {url}', exc_info=True)
             raise
-        else:
-            return page.text
+        # капчу и ошибки перегрузки сайта не отдаем как текст страницы, а приостанавливаем запросы к сайту
+        if page.status_code == 429 or page.status_code >= 500:
+            self.circuit_breaker.record_failure(url, f'status {page.status_code}')
+            raise RetryablePageError(f'Page {url} is temporarily unavailable: status {page.status_code}')
+        if ParserFromHTML.check_captcha_text(page.text):
+            self.circuit_breaker.record_failure(url, 'captcha')
+            if self.random_sleep:
+                self.rate_limiter.feedback(self._get_host(url), 0, ok=False)
+            raise RetryablePageError(f'Page {url} is captcha')
+        self.circuit_breaker.record_success(url)
+        return page
 
 
 class WebWithCache(WebConnection):
@@ -183,9 +643,16 @@ class WebWithCache(WebConnection):
     :param encoding: кодировка сайта
         defaults to 'utf-8'
     :type encoding: str
-    :param: random_sleep перед запросом страницы с помощью SimpleWeb засыпание на случайное количество секунд, нужно для обхода блокировок Livelib
+    :param: random_sleep перед запросом страницы с помощью SimpleWeb ждать разрешения ограничителя частоты запросов,
+        нужно для обхода блокировок Livelib. Страницы из кеша ограничитель не учитывает.
         default to False
     :type random_sleep: bool
+    :param rate_limiter: ограничитель частоты запросов, можно разделять между несколькими соединениями
+        defaults to RateLimiter с настройками из Config.web_connection
+    :type rate_limiter: RateLimiter
+    :param circuit_breaker: предохранитель, приостанавливающий запросы при капче и ошибках сайта
+        defaults to CircuitBreaker с настройками из Config.web_connection
+    :type circuit_breaker: CircuitBreaker
     :param default_file_name: название файлов для сохранения в кеше по умолчанию
         defaults to 'index'
     :type default_file_name: str
@@ -195,18 +662,51 @@ class WebWithCache(WebConnection):
     :param folder: папка для хранения кеша
         defaults to 'cache'
     :type folder: str
+    :param revalidate: проверять ли страницы из кеша на сайте условным запросом (ETag / Last-Modified).
+        Если страница не изменилась (ответ 304), она берется из кеша.
+        defaults to True, если в Config.web_connection.cache_mode задан режим 'revalidate'
+    :type revalidate: bool
+    :param storage: хранилище страниц кеша
+        defaults to хранилище, заданное в Config.web_connection.cache_storage
+    :type storage: CacheStorage
 
     """
     default_file_name = 'index'
     default_file_extension = '.html'
 
-    def __init__(self, config: Config, random_sleep=False):
+    def __init__(self, config: Config, random_sleep=False, rate_limiter: RateLimiter = None,
+                 circuit_breaker: CircuitBreaker = None, revalidate: bool = None, storage: CacheStorage = None):
         self.config = config
         self.site = config.web_connection.site
         self.encoding = config.encoding
         self.folder = config.web_connection.cache_folder
-        self.random_sleep = random_sleep
+        self.features = config.bs_parser.features
+        self.targeted = config.bs_parser.targeted
+        self.storage = storage if storage else create_cache_storage(config)
+        # ограничивает размер кеша и время жизни страниц в нем
+        self.cache_manager = CacheManager.from_config(config, self.storage)
+        self.revalidate = revalidate if revalidate is not None else config.web_connection.cache_mode == 'revalidate'
+        self.revalidate_after = config.web_connection.cache_revalidate_after
         self.logger = logging.getLogger()
+        # одно соединение с пулом на все запросы, которых не оказалось в кеше
+        self.web = SimpleWeb(config=config, random_sleep=random_sleep, rate_limiter=rate_limiter,
+                             circuit_breaker=circuit_breaker)
+
+    @property
+    def rate_limiter(self) -> RateLimiter:
+        return self.web.rate_limiter
+
+    @property
+    def circuit_breaker(self) -> CircuitBreaker:
+        return self.web.circuit_breaker
+
+    @property
+    def random_sleep(self) -> bool:
+        return self.web.random_sleep
+
+    @random_sleep.setter
+    def random_sleep(self, value: bool) -> None:
+        self.web.random_sleep = value
 
     def _parse_url_in_filepath_and_filename(self, url: str) -> list[str, str]:
         """
@@ -241,36 +741,40 @@ class WebWithCache(WebConnection):
         file_name = file_name + self.default_file_extension
         return [path, file_name]
 
-    def _create_file(self, url: str, text: str = '') -> _io.TextIOWrapper:
+    def _get_key(self, url: str) -> str:
+        """
+        Возвращает ключ страницы в хранилище кеша: путь к файлу из _parse_url_in_filepath_and_filename
+        без корневой папки и расширения.
+        Например, http://www.livelib.ru/reader/qwerty/books/1 -> '/reader/qwerty/books/1'
+        :param url: адрес страницы
+        :type url: str
+        :return: ключ страницы
+        :rtype: str
+        """
+        path, file_name = self._parse_url_in_filepath_and_filename(url)
+        return path.removeprefix(self.folder) + file_name.removesuffix(self.default_file_extension)
+
+    def _create_file(self, url: str, text: str = '', rewrite: bool = False) -> _io.TextIOWrapper:
         """
         Сохраняет файл с заданным содержимым в дереве папок, соответствующем адресу страницы, и возвращает этот файл.
+        Работает только с хранилищем FileTreeStorage.
         :param url: адрес страницы
         :type url: str
         :param text: содержимое страницы,
             defaults to ''
         :type text: str
+        :param rewrite: переписать ли файл, если он уже есть в кеше
+            defaults to False
+        :type rewrite: bool
         :return: объект файла с текстом или False, если не удалось сохранить файл.
         :rtype: _io.TextIOWrapper or False
         """
         path, file_name = self._parse_url_in_filepath_and_filename(url)
+        key = self._get_key(url)
         # проверяем, существует ли файл
-        # @todo а если файл существует и мы хотим его принудительно переписать?
-        if not os.path.isfile(path + file_name):
-            # создадим весь путь из папок до нужного файла
-            dirs = path.split('/')
-            path_dir = ''
-            for i in range(len(dirs)):
-                path_dir = '/'.join(dirs[:i + 1])
-                self.logger.debug(f'Dir {path_dir} is found? {os.path.isdir(path_dir)}')
-                if not os.path.isdir(path_dir):
-                    self.logger.debug(f'Create dir {path_dir}')
-                    os.mkdir(path_dir)
-            # создаем файл
+        if rewrite or not self.storage.contains(key):
             try:
-                my_file = open(path + file_name, mode='x', encoding=self.encoding)
-                my_file.write(text)
-                self.logger.debug(f'Create file {my_file} ')
-                my_file.close()
+                self.storage.put(key, text)
             except Exception:
                 self.logger.exception(f'Can not open file for offline connection at {path}{file_name} .', exc_info=True)
                 return False
@@ -283,40 +787,97 @@ class WebWithCache(WebConnection):
             self.logger.exception(f'Can not open file for offline connection at {path}{file_name} .', exc_info=True)
             return False
 
-    def _get_page(self, url: str) -> str:
+    def _get_page(self, url: str, raw: bool = False) -> str or bytes:
         """
            Возвращает текст страницы по заданному адресу, добывая его из кеша или из сети, либо генерирует исключение.
+           В режиме revalidate страница из кеша проверяется на сайте условным запросом.
            :param url: адрес страницы
+           :param raw: вернуть байты страницы в кодировке соединения вместо текста,
+                страница из кеша при этом не декодируется в строку
            :raises Exception: если невозможно получить страницу.
-           :rtype: requests.Response
-           :return: объект Response по запросу на заданный адрес
+           :rtype: str or bytes
+           :return: текст страницы
            """
-        path, file_name = self._parse_url_in_filepath_and_filename(url)
-        # если страница уже есть в кеше, то возвращаем текст из файла
-        if os.path.isfile(path + file_name):
-            self.logger.debug(f'Page {url} is in dump at {path} {file_name}.')
-            try:
-                f = open(path + file_name, mode='r', encoding=self.encoding)
-                result = f.read()
-                f.close()
-                return result
-            except Exception as exc:
-                self.logger.exception(f'Can not load file {path}{file_name} ', exc_info=True)
-                raise
-        # если нет, вызываем ее через simpleweb и сохраняем в кеше
-        else:
-            self.logger.info(f'Can not find page {url} in dump at {path} {file_name}. ')
-            web = SimpleWeb(config=self.config,
-                            random_sleep=self.random_sleep)
-            web_text = web.get_page_text(url)
-            if web_text:
-                f = self._create_file(url, web_text)
-                result = f.read()
-                f.close()
+        key = self._get_key(url)
+        # если страница уже есть в кеше, то возвращаем ее текст
+        try:
+            result = self.storage.get_bytes(key) if raw else self.storage.get(key)
+        except Exception:
+            self.logger.exception(f'Can not load page {key} from dump', exc_info=True)
+            raise
+        if result is not None:
+            self.logger.debug(f'Page {url} is in dump at {key}.')
+            # капча, попавшая в кеш раньше, - не страница, ее нужно запросить заново
+            if ParserFromHTML.check_captcha_text(result):
+                self.logger.warning(f'Page {url} in dump at {key} is captcha, getting it again.')
+            elif self.cache_manager.is_expired(key):
+                self.logger.info(f'Page {url} in dump at {key} is expired, getting it again.')
+            elif not self.revalidate:
                 return result
             else:
-                self.logger.exception(f'Can not get page at {url}', exc_info=True)
-                raise
+                validators = self.storage.get_validators(key)
+                if time.time() - validators.get('fetch_time', 0) < self.revalidate_after:
+                    return result
+                try:
+                    web_text, new_validators = self.web.get_page_text_if_modified(url, validators)
+                except Exception:
+                    self.logger.exception(f'Can not revalidate page {url}, using page from dump.', exc_info=True)
+                    return result
+                if web_text is None:
+                    self.storage.put_validators(key, new_validators)
+                    return result
+                self.logger.info(f'Page {url} in dump at {key} is modified, saving it again.')
+                result = self._save_page(key, web_text, new_validators)
+                return result.encode(self.encoding) if raw else result
+        else:
+            self.logger.info(f'Can not find page {url} in dump at {key}. ')
+        # если страницы нет в кеше или там капча, вызываем ее через simpleweb и сохраняем в кеше
+        web_text, validators = self.web.get_page_text_if_modified(url)
+        if web_text:
+            result = self._save_page(key, web_text, validators)
+            return result.encode(self.encoding) if raw else result
+        else:
+            self.logger.exception(f'Can not get page at {url}', exc_info=True)
+            raise
+
+    def _save_page(self, key: str, text: str, validators: dict) -> str:
+        """
+        Сохраняет страницу в хранилище кеша и возвращает ее текст в том виде, в каком он будет прочитан из кеша.
+        :param key: ключ страницы
+        :type key: str
+        :param text: текст страницы
+        :type text: str
+        :param validators: валидаторы страницы
+        :type validators: dict
+        :return: текст страницы
+        :rtype: str
+        """
+        # при чтении файла в текстовом режиме переводы строк приводятся к '\n', делаем так же для всех хранилищ
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+        self.storage.put(key, text, validators)
+        self.cache_manager.page_saved()
+        return text
+
+    def refresh_page(self, url: str) -> str:
+        """
+        Запрашивает страницу на сайте, не глядя в кеш, и сохраняет ее в кеше вместо старой версии.
+        :param url: адрес страницы
+        :type url: str
+        :raises Exception: если невозможно получить страницу.
+        :return: текст страницы
+        :rtype: str
+        """
+        web_text, validators = self.web.get_page_text_if_modified(url)
+        return self._save_page(self._get_key(url), web_text, validators)
+
+    def close(self) -> None:
+        """
+        Записывает накопленные изменения кеша и закрывает соединения.
+        """
+        self.logger.info(f'Cache compression ratio {self.storage.compression_ratio():.2f}')
+        self.cache_manager.evict()
+        self.storage.close()
+        self.web.close()
 
     def get_page_status(self, url: str) -> int:
         """
@@ -343,3 +904,285 @@ class WebWithCache(WebConnection):
         """
         result = self._get_page(url)
         return result
+
+    def get_page_bytes(self, url: str) -> bytes:
+        """
+        Возвращает байты страницы по заданному адресу. Страница из кеша отдается без декодирования в строку.
+        :param url: адрес страницы
+        :type url: str
+        :raises Exception: если невозможно получить страницу
+        :return: байты страницы в кодировке соединения
+        :rtype: bytes
+        """
+        return self._get_page(url, raw=True)
+
+    def get_page_bs(self, url: str, parser=ParserFromHTML) -> bs4.BeautifulSoup or bool:
+        # страница из кеша разбирается прямо из байтов, без декодирования в строку
+        try:
+            data = self.get_page_bytes(url)
+        except Exception:
+            self.logger.exception(f'Can not get BS object from {url}', exc_info=True)
+            return False
+        return self._page_bs_from_text(data, url, parser)
+
+
+class MemoWeb(WebConnection):
+    """
+    Обертка над любым соединением, которая запоминает в памяти тексты страниц и объекты BeautifulSoup
+    последних max_pages адресов, чтобы одна и та же страница не запрашивалась и не разбиралась дважды
+    за время работы с читателем. Страницы, не полученные из-за ошибки, 404 или капчи, не запоминаются.
+    Разобранные страницы отдаются повторно тем же объектом, поэтому изменять их нельзя.
+    Остальные атрибуты и методы берутся у оборачиваемого соединения.
+    :param web: оборачиваемое соединение
+    :type web: WebConnection
+    :param max_pages: сколько последних страниц держать в памяти
+        defaults to 32
+    :type max_pages: int
+    """
+
+    def __init__(self, web: WebConnection, max_pages: int = 32):
+        self.web = web
+        self.max_pages = max_pages
+        self.texts = collections.OrderedDict()  # адрес -> текст страницы
+        self.soups = collections.OrderedDict()  # (адрес, парсер) -> объект BeautifulSoup
+        self.stats = {'text_hits': 0, 'text_misses': 0, 'soup_hits': 0, 'soup_misses': 0}
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger()
+
+    def __getattr__(self, name: str) -> typing.Any:
+        # вызывается только для атрибутов, которых нет у самой обертки
+        return getattr(self.web, name)
+
+    @property
+    def concurrency(self) -> int:
+        return self.web.concurrency
+
+    @property
+    def circuit_breaker(self) -> CircuitBreaker:
+        return self.web.circuit_breaker
+
+    @property
+    def encoding(self) -> str:
+        return self.web.encoding
+
+    @property
+    def random_sleep(self) -> bool:
+        return self.web.random_sleep
+
+    @random_sleep.setter
+    def random_sleep(self, value: bool) -> None:
+        self.web.random_sleep = value
+
+    def _recall(self, memo: collections.OrderedDict, key: typing.Hashable, stat: str) -> typing.Any:
+        with self.lock:
+            if key in memo:
+                memo.move_to_end(key)
+                self.stats[stat + '_hits'] += 1
+                return memo[key]
+            self.stats[stat + '_misses'] += 1
+            return None
+
+    def _remember(self, memo: collections.OrderedDict, key: typing.Hashable, value: typing.Any) -> None:
+        with self.lock:
+            memo[key] = value
+            memo.move_to_end(key)
+            while len(memo) > self.max_pages:
+                memo.popitem(last=False)
+
+    def _remember_text(self, url: str, text: str or None) -> None:
+        # капча - не страница, при следующем запросе ее нужно получить заново
+        if text is not None and not ParserFromHTML.check_captcha_text(text):
+            self._remember(self.texts, url, text)
+
+    def _parse(self, text: str, url: str, parser=ParserFromHTML) -> bs4.BeautifulSoup or bool:
+        result = self.web._page_bs_from_text(text, url, parser)
+        if result:
+            self._remember(self.soups, (url, parser), result)
+        return result
+
+    def get_stats(self) -> dict:
+        """
+        Возвращает счетчики попаданий и промахов памяти текстов и разобранных страниц.
+        :return: словарь {'text_hits': ..., 'text_misses': ..., 'soup_hits': ..., 'soup_misses': ...}
+        :rtype: dict
+        """
+        with self.lock:
+            return dict(self.stats)
+
+    def clear(self) -> None:
+        """
+        Забывает все запомненные страницы.
+        """
+        with self.lock:
+            self.texts.clear()
+            self.soups.clear()
+
+    def get_page_status(self, url: str) -> int:
+        return self.web.get_page_status(url)
+
+    def get_page_text(self, url: str) -> str:
+        """
+        Возвращает текст страницы из памяти или из оборачиваемого соединения.
+        :param url: адрес страницы
+        :type url: str
+        :raises Exception: если невозможно получить текст страницы
+        :return: текст страницы
+        :rtype: str
+        """
+        result = self._recall(self.texts, url, 'text')
+        if result is None:
+            result = self.web.get_page_text(url)
+            self._remember_text(url, result)
+        return result
+
+    def get_page_bytes(self, url: str) -> bytes:
+        text = self._recall(self.texts, url, 'text')
+        if text is not None:
+            return text.encode(self.encoding)
+        return self.web.get_page_bytes(url)
+
+    def get_page_bs(self, url: str, parser=ParserFromHTML) -> bs4.BeautifulSoup or bool:
+        result = self._recall(self.soups, (url, parser), 'soup')
+        if result is not None:
+            return result
+        try:
+            text = self.get_page_text(url)
+        except Exception:
+            self.logger.exception(f'Can not get BS object from {url}', exc_info=True)
+            return False
+        return self._parse(text, url, parser)
+
+    def get_pages_text(self, urls: List[str]) -> List[str or None]:
+        """
+        Возвращает тексты нескольких страниц, недостающие в памяти страницы запрашиваются
+        у оборачиваемого соединения одной пачкой.
+        :param urls: список адресов страниц
+        :type urls: List[str]
+        :return: список текстов страниц, None на месте страниц, которые не удалось получить
+        :rtype: List[str or None]
+        """
+        result = [self._recall(self.texts, url, 'text') for url in urls]
+        missing = [url for url, text in zip(urls, result) if text is None]
+        if missing:
+            fetched = dict(zip(missing, self.web.get_pages_text(missing)))
+            for i, url in enumerate(urls):
+                if result[i] is None:
+                    result[i] = fetched[url]
+                    self._remember_text(url, result[i])
+        return result
+
+    def get_pages_bs(self, urls: List[str], parser=ParserFromHTML) -> List[bs4.BeautifulSoup or bool]:
+        result = [self._recall(self.soups, (url, parser), 'soup') for url in urls]
+        missing = [url for url, soup in zip(urls, result) if soup is None]
+        texts = dict(zip(missing, self.get_pages_text(missing))) if missing else {}
+        for i, url in enumerate(urls):
+            if result[i] is None:
+                result[i] = self._parse(texts[url], url, parser) if texts[url] is not None else False
+        return result
+
+
+class AsyncBatchMixin:
+    """
+    Примесь для классов соединения, которая запрашивает пачку страниц параллельно с помощью asyncio.
+    Каждая страница запрашивается обычным синхронным get_page_text в отдельном потоке,
+    одновременно к одному хосту уходит не больше concurrency запросов.
+    Внутри работающего цикла событий нужно пользоваться корутинами aget_pages_text и aget_pages_bs,
+    get_pages_text и get_pages_bs сами запускают цикл событий.
+    """
+
+    async def aget_pages_text(self, urls: List[str]) -> List[str or None]:
+        """
+        Асинхронно возвращает тексты нескольких страниц в том же порядке, что и адреса.
+        :param urls: список адресов страниц
+        :type urls: List[str]
+        :return: список текстов страниц, None на месте страниц, которые не удалось получить
+        :rtype: List[str or None]
+        """
+        semaphores = {}
+
+        async def fetch(url: str) -> str or None:
+            host = self._get_host(url)
+            if host not in semaphores:
+                semaphores[host] = asyncio.Semaphore(self.concurrency)
+            async with semaphores[host]:
+                try:
+                    return await asyncio.to_thread(self.get_page_text, url)
+                except Exception:
+                    self.logger.exception(f'Can not get text from page! {url}', exc_info=True)
+                    return None
+
+        return list(await asyncio.gather(*[fetch(url) for url in urls]))
+
+    async def aget_pages_bs(self, urls: List[str], parser=ParserFromHTML) -> List[bs4.BeautifulSoup or bool]:
+        """
+        Асинхронно возвращает объекты BeautifulSoup для нескольких страниц в том же порядке, что и адреса.
+        :param urls: список адресов страниц
+        :type urls: List[str]
+        :param parser: класс парсера для обработки страниц
+            defaults to ParserFromHTML
+        :return: список объектов BeautifulSoup, False на месте недоступных страниц, 404 или капчи
+        :rtype: List[bs4.BeautifulSoup or bool]
+        """
+        texts = await self.aget_pages_text(urls)
+        return [self._page_bs_from_text(text, url, parser) if text is not None else False
+                for url, text in zip(urls, texts)]
+
+    def get_pages_text(self, urls: List[str]) -> List[str or None]:
+        return asyncio.run(self.aget_pages_text(urls))
+
+    def get_pages_bs(self, urls: List[str], parser=ParserFromHTML) -> List[bs4.BeautifulSoup or bool]:
+        return asyncio.run(self.aget_pages_bs(urls, parser))
+
+
+class AsyncWeb(AsyncBatchMixin, SimpleWeb):
+    """
+    Класс соединения, получающий страницы сайта напрямую из сети, пачки страниц запрашиваются параллельно.
+    Количество одновременных запросов к одному хосту задается в Config.web_connection.concurrency.
+    :param config: конфигурация
+    :type config: Config
+    :param: random_sleep перед запросом страницы ждать разрешения ограничителя частоты запросов
+        default to False
+    :type random_sleep: bool
+    :param rate_limiter: ограничитель частоты запросов
+        defaults to RateLimiter с настройками из Config.web_connection
+    :type rate_limiter: RateLimiter
+    :param circuit_breaker: предохранитель, приостанавливающий запросы при капче и ошибках сайта
+        defaults to CircuitBreaker с настройками из Config.web_connection
+    :type circuit_breaker: CircuitBreaker
+    """
+
+    def __init__(self, config: Config, random_sleep=False, rate_limiter: RateLimiter = None,
+                 circuit_breaker: CircuitBreaker = None):
+        super().__init__(config, random_sleep=random_sleep, rate_limiter=rate_limiter, circuit_breaker=circuit_breaker)
+        self.concurrency = config.web_connection.concurrency
+
+
+class AsyncWebWithCache(AsyncBatchMixin, WebWithCache):
+    """
+    Класс соединения, получающий страницы сайта из локального кеша или, если их там нет, из сети.
+    Пачки страниц запрашиваются параллельно, количество одновременных запросов к одному хосту
+    задается в Config.web_connection.concurrency.
+    :param config: конфигурация
+    :type config: Config
+    :param: random_sleep перед запросом страницы из сети ждать разрешения ограничителя частоты запросов
+        default to False
+    :type random_sleep: bool
+    :param rate_limiter: ограничитель частоты запросов
+        defaults to RateLimiter с настройками из Config.web_connection
+    :type rate_limiter: RateLimiter
+    :param circuit_breaker: предохранитель, приостанавливающий запросы при капче и ошибках сайта
+        defaults to CircuitBreaker с настройками из Config.web_connection
+    :type circuit_breaker: CircuitBreaker
+    :param revalidate: проверять ли страницы из кеша на сайте условным запросом (ETag / Last-Modified)
+        defaults to True, если в Config.web_connection.cache_mode задан режим 'revalidate'
+    :type revalidate: bool
+    :param storage: хранилище страниц кеша
+        defaults to хранилище, заданное в Config.web_connection.cache_storage
+    :type storage: CacheStorage
+    """
+
+    def __init__(self, config: Config, random_sleep=False, rate_limiter: RateLimiter = None,
+                 circuit_breaker: CircuitBreaker = None, revalidate: bool = None, storage: CacheStorage = None):
+        super().__init__(config, random_sleep=random_sleep, rate_limiter=rate_limiter, circuit_breaker=circuit_breaker,
+                         revalidate=revalidate, storage=storage)
+        self.concurrency = config.web_connection.concurrency
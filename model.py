@@ -2,12 +2,14 @@ from livelib import *
 
 # загружаем файл с конфигурационными данными
 config = Config('.env')
+# через сколько дней обновление книг читателя делается полным
+FULL_UPDATE_DAYS = 30
 
 # Создаем текущего читателя, пока без логина. Логин спросим у пользователя.
 current_reader = Reader(login='',
                         web_connection=WebWithCache(config, random_sleep=False),
                         db_connection=SQLite3Connection(config, create_if_not_exist=True),
-                        parser_html=ParserFromHTML,
+                        parser_html=get_html_parser(config),
                         parser_db=ParserForDB,
                         parser_xlsx=ParserForXLSX,
                         export=XLSXExport(config)
@@ -27,21 +29,23 @@ if current_reader.exists(login=login):
     print('Регистрируем вас, начинаем работу...')
     # регистрируем пользователя в нашей БД
     current_reader.register()
-    # Теперь включаем задержку обращения к сайту, чтобы он не выдал отказ при частых запросах.
+    # Теперь включаем ограничение частоты обращений к сайту, чтобы он не выдал отказ при частых запросах.
     current_reader.web_connection.random_sleep = True
     # Проверяем, есть ли пользователь в нашей БД с уже загруженными книгами.
     last_update = current_reader.has_db_entries()
     if last_update:
         print(f'У вас есть записи от {last_update}!')
         # # # Скачать новые записи?
-        update = input('Скачать записи заново? (y)')
-        if update == 'y':
-            # Если надо скачать записи заново,
-            # то удаляем имеющиеся записи и скачиваем всю информацию заново
+        update = input('Обновить записи? (y - новые и измененные книги, f - все книги заново)')
+        if update in ('y', 'f'):
+            # Обычно скачиваются только первые страницы с новыми и измененными книгами,
+            # раз в FULL_UPDATE_DAYS дней (или по выбору пользователя) все записи удаляются и скачиваются заново,
+            # чтобы убрать книги, удаленные читателем на сайте
             print('Записи будут скачены.')
-            # Переходим на связь без кеша, чтобы получить книги не из кеша, а непосредственно с сайта
-            current_reader.web_connection = SimpleWeb(config,random_sleep=True)
-            current_reader.update_books()
+            # Переходим на связь с проверкой кеша на сайте: неизменившиеся страницы берутся из кеша,
+            # а изменившиеся скачиваются заново
+            current_reader.web_connection = WebWithCache(config, random_sleep=True, revalidate=True)
+            current_reader.update_books(full=update == 'f', full_after_days=FULL_UPDATE_DAYS)
             print('Записи скачены.')
         else:
             # Если не надо скачивать, то ничего не делаем